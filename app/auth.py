@@ -0,0 +1,124 @@
+import asyncio
+import datetime
+import hashlib
+import secrets
+import sys
+from typing import Optional
+
+from fastapi import Depends, Header
+from fastapi.exceptions import HTTPException
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.cache import TTLCache
+from db.database import async_session, engine, get_async_session
+from db.models import ApiKey, User
+
+from config_app.settings import (  # isort:skip
+    API_KEY_CACHE_NEGATIVE_TTL,
+    API_KEY_CACHE_SIZE,
+    API_KEY_CACHE_TTL,
+)
+
+# Кеш хранит id пользователя по хешу ключа, для неизвестных ключей хранится
+# 0. Кеш свой в каждом процессе, поэтому отозванный ключ перестает
+# действовать в остальных процессах не позже чем через API_KEY_CACHE_TTL
+# секунд. Время жизни выбрано коротким: даже несколько секунд избавляют
+# активного клиента от запроса к базе на каждый его запрос
+api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+
+
+def hash_api_key(api_key: str) -> str:
+    """В базе хранятся только хеши ключей"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+async def resolve_api_key(session: AsyncSession, api_key: str) -> int:
+    """Возвращает id владельца действующего ключа или 0"""
+    key_hash = hash_api_key(api_key)
+    found, user_id = api_key_cache.get(key_hash)
+    if found:
+        return user_id
+
+    user_id = await session.scalar(
+        select(ApiKey.user_id).where(
+            ApiKey.key_hash == key_hash,
+            ApiKey.revoked_at.is_(None),
+        )
+    )
+    if user_id:
+        api_key_cache.set(key_hash, user_id)
+    else:
+        user_id = 0
+        api_key_cache.set(key_hash, user_id, ttl=API_KEY_CACHE_NEGATIVE_TTL)
+    return user_id
+
+
+async def get_current_user_id(
+    api_key: str = Header(...),
+    session: AsyncSession = Depends(get_async_session),
+) -> int:
+    """Зависимость FastAPI, определяет пользователя по заголовку api-key"""
+    user_id = await resolve_api_key(session, api_key)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User is not registered")
+    return user_id
+
+
+def create_api_key(
+    session: AsyncSession,
+    user_id: int,
+    api_key: Optional[str] = None,
+) -> str:
+    """Создает ключ пользователю (без фиксации транзакции) и возвращает
+    его, сам ключ в базе не сохраняется"""
+    api_key = api_key or secrets.token_urlsafe(32)
+    key_hash = hash_api_key(api_key)
+    session.add(ApiKey(key_hash=key_hash, user_id=user_id))
+    api_key_cache.invalidate(key_hash)
+    return api_key
+
+
+async def revoke_api_key(session: AsyncSession, api_key: str) -> bool:
+    """Отзывает ключ и удаляет его из кеша текущего процесса"""
+    key_hash = hash_api_key(api_key)
+    result = await session.execute(
+        update(ApiKey)
+        .where(ApiKey.key_hash == key_hash, ApiKey.revoked_at.is_(None))
+        .values(revoked_at=datetime.datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    api_key_cache.invalidate(key_hash)
+    return bool(result.rowcount)
+
+
+async def issue_api_key(user_id: int) -> Optional[str]:
+    """Выдает новый ключ существующему пользователю, None - если
+    пользователя нет"""
+    async with async_session() as session:
+        if await session.get(User, user_id) is None:
+            return None
+        api_key = create_api_key(session, user_id)
+        await session.commit()
+    return api_key
+
+
+async def main(argv) -> int:
+    """Выдача ключа пользователю, например созданному до появления таблицы
+    api_key: python -m app.auth issue <user_id>"""
+    if len(argv) != 2 or argv[0] != "issue" or not argv[1].isdigit():
+        print("Usage: python -m app.auth issue <user_id>", file=sys.stderr)
+        return 2
+    api_key = await issue_api_key(int(argv[1]))
+    await engine.dispose()
+    if api_key is None:
+        print(f"User {argv[1]} does not exist", file=sys.stderr)
+        return 1
+    print(api_key)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,118 @@
+import asyncio
+from typing import Collection, Dict
+
+from sqlalchemy import case, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.database import async_session, engine
+from db.models import Followers, Like, Publication, User
+
+
+async def change_likes_count(
+    session: AsyncSession,
+    tweet_ids: Collection[int],
+    delta: int,
+) -> None:
+    """Атомарно изменяет счетчики отметок 'нравиться' публикаций"""
+    await session.execute(
+        update(Publication)
+        .where(Publication.id.in_(tweet_ids))
+        .values(likes_count=Publication.likes_count + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def change_likes_counts(
+    session: AsyncSession,
+    deltas: Dict[int, int],
+) -> None:
+    """Атомарно изменяет счетчики нескольких публикаций на разные величины
+    ({id публикации: изменение}) одним запросом"""
+    await session.execute(
+        update(Publication)
+        .where(Publication.id.in_(deltas))
+        .values(
+            likes_count=Publication.likes_count
+            + case(deltas, value=Publication.id, else_=0)
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def change_follow_counts(
+    session: AsyncSession,
+    author_ids: Collection[int],
+    follower_id: int,
+    delta: int,
+) -> None:
+    """Атомарно изменяет счетчики подписчиков авторов и счетчик подписок
+    подписчика одним запросом"""
+    await session.execute(
+        update(User)
+        .where(User.id.in_([*author_ids, follower_id]))
+        .values(
+            followers_count=case(
+                (User.id.in_(author_ids), User.followers_count + delta),
+                else_=User.followers_count,
+            ),
+            following_count=case(
+                (
+                    User.id == follower_id,
+                    User.following_count + delta * len(author_ids),
+                ),
+                else_=User.following_count,
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reconcile_counters(session: AsyncSession) -> int:
+    """Пересчитывает денормализованные счетчики по исходным таблицам и
+    исправляет разошедшиеся значения, возвращает количество исправленных
+    строк"""
+    likes = (
+        select(func.count())
+        .where(Like.publication_id == Publication.id)
+        .scalar_subquery()
+    )
+    followers = (
+        select(func.count())
+        .where(Followers.author_id == User.id)
+        .scalar_subquery()
+    )
+    following = (
+        select(func.count())
+        .where(Followers.follower_id == User.id)
+        .scalar_subquery()
+    )
+
+    repaired_tweets = await session.execute(
+        update(Publication)
+        .where(Publication.likes_count != likes)
+        .values(likes_count=likes)
+        .execution_options(synchronize_session=False)
+    )
+    repaired_users = await session.execute(
+        update(User)
+        .where(
+            (User.followers_count != followers)
+            | (User.following_count != following)
+        )
+        .values(followers_count=followers, following_count=following)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return repaired_tweets.rowcount + repaired_users.rowcount
+
+
+async def main() -> None:
+    async with async_session() as session:
+        repaired = await reconcile_counters(session)
+    await engine.dispose()
+    print(f"Repaired counters: {repaired}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+import math
+import time
+from typing import Optional
+
+from fastapi import Cookie, Depends, Response
+
+from app.auth import get_current_user_id
+from db.database import (  # isort:skip
+    choose_read_sessionmaker,
+    mark_write,
+    recent_writers,
+)
+
+from config_app.settings import READ_YOUR_WRITES_WINDOW  # isort:skip
+
+# Время последней записи пользователя ("<id пользователя>:<unix time>").
+# Запрос чтения может попасть в другой воркер gunicorn, где запись не
+# отмечена, поэтому окно read-your-writes передается и через клиента
+LAST_WRITE_COOKIE = "last_write"
+
+
+def wrote_recently(user_id: int, last_write: Optional[str]) -> bool:
+    """Была ли запись пользователя по cookie last_write в течение
+    READ_YOUR_WRITES_WINDOW секунд"""
+    if not last_write:
+        return False
+    writer_id, _, written_at = last_write.partition(":")
+    try:
+        if int(writer_id) != user_id:
+            return False
+        return 0 <= time.time() - float(written_at) <= (
+            READ_YOUR_WRITES_WINDOW
+        )
+    except ValueError:
+        return False
+
+
+async def get_recent_write(
+    user_id: int = Depends(get_current_user_id),
+    last_write: Optional[str] = Cookie(None),
+) -> bool:
+    """Была ли у пользователя запись в течение READ_YOUR_WRITES_WINDOW
+    секунд: по cookie last_write или по учету процесса. Такие запросы не
+    берут ответ из кеша: кеш в памяти другого воркера не сбрасывается
+    записью и может хранить ответ до нее"""
+    return wrote_recently(user_id, last_write) or recent_writers.get(
+        user_id
+    )[0]
+
+
+async def get_read_session(
+    user_id: int = Depends(get_current_user_id),
+    last_write: Optional[str] = Cookie(None),
+):
+    """Сессия для эндпоинтов чтения: реплика, если она не отстает и
+    пользователь недавно ничего не записывал, иначе основная база"""
+    session_factory = await choose_read_sessionmaker(
+        user_id, wrote_recently(user_id, last_write)
+    )
+    async with session_factory() as session:
+        yield session
+
+
+async def get_writer_id(
+    response: Response,
+    user_id: int = Depends(get_current_user_id),
+):
+    """Определяет пользователя эндпоинтов записи и открывает для него окно
+    read-your-writes: в памяти процесса и в cookie last_write для остальных
+    воркеров. Окно в памяти обновляется и после выполнения запроса, чтобы
+    отсчитываться от момента фиксации изменений"""
+    mark_write(user_id)
+    response.set_cookie(
+        LAST_WRITE_COOKIE,
+        f"{user_id}:{time.time():.3f}",
+        max_age=math.ceil(READ_YOUR_WRITES_WINDOW),
+        httponly=True,
+        samesite="strict",
+    )
+    yield user_id
+    mark_write(user_id)
@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+from typing import Collection, Dict, Iterable, Optional, Set
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app import read_models
+from db.models import Publication
+
+from config_app.settings import (  # isort:skip
+    EVENTS_BROKER,
+    EVENTS_HEARTBEAT,
+    EVENTS_QUEUE_SIZE,
+    EVENTS_REDIS_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+# События потока (Server-Sent Events), в скобках - данные события:
+#   tweet - новая публикация (TweetInfo)
+#   delete - публикация удалена ({"tweet_id"})
+#   like, unlike - отметка 'нравится' ({"tweet_id", "user_id"})
+#   follow, unfollow - подписка пользователя изменилась ({"user_id"})
+#   reset - поток закрыт сервером, ленту нужно перечитать и переподключиться
+# Событие публикуется для автора публикации (или подписчика для follow) и
+# доходит до его собственных потоков и потоков его подписчиков
+FOLLOW_EVENTS = ("follow", "unfollow")
+
+RESET_FRAME = b"event: reset\ndata: {}\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+RETRY_FRAME = b"retry: 3000\n\n"
+
+
+class Subscription:
+    """Поток событий одного подключения с ограниченной очередью.
+
+    Если клиент не успевает читать и очередь переполнилась, события не
+    пропускаются молча: поток закрывается событием reset"""
+
+    def __init__(self, user_id: int, authors: Iterable[int], maxsize: int):
+        self.user_id = user_id
+        self.authors: Set[int] = set(authors) | {user_id}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    def send(self, frame: bytes) -> None:
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self) -> None:
+        """Заменяет недоставленные события на reset"""
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(RESET_FRAME)
+
+
+class EventBroker:
+    """Рассылка событий подключениям текущего процесса"""
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._by_author: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._by_user: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._event_ids = itertools.count(1)
+        self._closing = False
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._by_user.values())
+
+    @property
+    def has_subscribers(self) -> bool:
+        """Есть ли кому доставлять события (позволяет не готовить данные
+        событий впустую)"""
+        return bool(self._by_user)
+
+    def subscribe(self, user_id: int, authors: Iterable[int]) -> Subscription:
+        subscription = Subscription(user_id, authors, self.queue_size)
+        self._by_user[user_id].add(subscription)
+        for author_id in subscription.authors:
+            self._by_author[author_id].add(subscription)
+        if self._closing:
+            subscription.close()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._discard(self._by_user, subscription.user_id, subscription)
+        for author_id in subscription.authors:
+            self._discard(self._by_author, author_id, subscription)
+
+    @staticmethod
+    def _discard(index, key: int, subscription: Subscription) -> None:
+        items = index.get(key)
+        if items is not None:
+            items.discard(subscription)
+            if not items:
+                del index[key]
+
+    def _frame(self, event: str, data) -> bytes:
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+            next(self._event_ids),
+            event.encode(),
+            orjson.dumps(data),
+        )
+
+    def dispatch(self, author_id: int, event: str, data) -> None:
+        """Доставляет событие подключениям этого процесса"""
+        frame = self._frame(event, data)
+        if event not in FOLLOW_EVENTS:
+            for subscription in list(self._by_author.get(author_id, ())):
+                subscription.send(frame)
+            return
+
+        # подписка меняет набор авторов в потоках самого подписчика
+        for subscription in list(self._by_user.get(author_id, ())):
+            if event == "follow":
+                subscription.authors.add(data["user_id"])
+                self._by_author[data["user_id"]].add(subscription)
+            elif data["user_id"] != subscription.user_id:
+                subscription.authors.discard(data["user_id"])
+                self._discard(self._by_author, data["user_id"], subscription)
+            subscription.send(frame)
+
+    async def publish(self, author_id: int, event: str, data) -> None:
+        self.dispatch(author_id, event, data)
+
+    async def stream(
+        self,
+        subscription: Subscription,
+        heartbeat: float = EVENTS_HEARTBEAT,
+    ):
+        """Тело ответа text/event-stream. Если событий нет heartbeat
+        секунд, отправляется комментарий, чтобы прокси и клиент не закрыли
+        соединение по неактивности"""
+        try:
+            yield RETRY_FRAME
+            while True:
+                try:
+                    frame = await asyncio.wait_for(
+                        subscription.queue.get(), heartbeat
+                    )
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT_FRAME
+                    continue
+                yield frame
+                if frame is RESET_FRAME:
+                    break
+        finally:
+            self.unsubscribe(subscription)
+
+    async def start(self) -> None:
+        pass
+
+    def close_streams(self) -> None:
+        """Закрывает все потоки событием reset, новые потоки закрываются
+        сразу. Вызывается в начале остановки сервера: иначе открытые потоки
+        задерживали бы ее до таймаута, а публикация событий продолжает
+        работать для запросов, которые еще выполняются"""
+        self._closing = True
+        for items in list(self._by_user.values()):
+            for subscription in items:
+                subscription.close()
+
+    async def close(self) -> None:
+        """Закрывает все потоки (при остановке сервера)"""
+        self.close_streams()
+
+
+class RedisEventBroker(EventBroker):
+    """Рассылка событий через Redis pub/sub: событие, опубликованное любым
+    процессом, доставляется подключениям всех процессов"""
+
+    def __init__(
+        self,
+        url: str,
+        queue_size: int,
+        channel: str = "microblog:events",
+    ):
+        super().__init__(queue_size)
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError(
+                "EVENTS_BROKER=redis requires the redis package"
+            )
+        self.client = aioredis.from_url(url)
+        self.channel = channel
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def has_subscribers(self) -> bool:
+        # подписчики могут быть у других процессов
+        return True
+
+    async def publish(self, author_id: int, event: str, data) -> None:
+        await self.client.publish(
+            self.channel, orjson.dumps([author_id, event, data])
+        )
+
+    async def _listen(self, pubsub) -> None:
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            try:
+                self.dispatch(*orjson.loads(message["data"]))
+            except Exception:
+                logger.exception("Failed to dispatch event")
+
+    async def start(self) -> None:
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def close(self) -> None:
+        await super().close()
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        await self.client.aclose()
+
+
+def create_broker(broker: str = EVENTS_BROKER) -> EventBroker:
+    if broker == "redis":
+        return RedisEventBroker(EVENTS_REDIS_URL, EVENTS_QUEUE_SIZE)
+    return EventBroker(EVENTS_QUEUE_SIZE)
+
+
+broker = create_broker()
+
+
+async def publish_tweet(session: AsyncSession, tweet_id: int, author_id: int):
+    """Рассылает новую публикацию в виде словаря схемы TweetInfo"""
+    if not broker.has_subscribers:
+        return
+    tweets = await read_models.tweets_by_ids(session, [tweet_id])
+    if tweets:
+        await broker.publish(author_id, "tweet", tweets[0])
+
+
+async def publish_likes(
+    session: AsyncSession,
+    user_id: int,
+    liked: Collection[int] = (),
+    unliked: Collection[int] = (),
+):
+    """Рассылает отметки 'нравится' подписчикам авторов публикаций,
+    удаленные публикации пропускаются"""
+    if not broker.has_subscribers or not (liked or unliked):
+        return
+    rows = await session.execute(
+        select(Publication.id, Publication.author_id).where(
+            Publication.id.in_(set(liked) | set(unliked))
+        )
+    )
+    authors = dict(rows.all())
+    for event, tweet_ids in (("like", liked), ("unlike", unliked)):
+        for tweet_id in tweet_ids:
+            if tweet_id in authors:
+                await broker.publish(
+                    authors[tweet_id],
+                    event,
+                    {"tweet_id": tweet_id, "user_id": user_id},
+                )
+
+
+async def publish_follows(
+    user_id: int,
+    followed: Collection[int] = (),
+    unfollowed: Collection[int] = (),
+):
+    """Сообщает потокам подписчика об изменении его подписок"""
+    for event, author_ids in (("follow", followed), ("unfollow", unfollowed)):
+        for author_id in author_ids:
+            await broker.publish(user_id, event, {"user_id": author_id})
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import hashlib
+from typing import NamedTuple, Optional, Union
+
+from fastapi import Header, Request
+from fastapi.exceptions import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.database import async_session, engine
+from db.models import IdempotencyKey
+
+from config_app.settings import IDEMPOTENCY_KEY_TTL  # isort:skip
+
+# Ответ на запрос с заголовком Idempotency-Key сохраняется в той же
+# транзакции, что и сами изменения. Повтор запроса с тем же ключом (например,
+# после обрыва связи у мобильного клиента) получает сохраненный ответ и
+# ничего не меняет. Сохраняются только успешные ответы. Вместе с ответом
+# сохраняется хеш запроса (метод, путь и тело): ключ, повторно
+# использованный для другого запроса, отклоняется с кодом 422
+
+
+def _expired_before() -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=IDEMPOTENCY_KEY_TTL
+    )
+
+
+class RequestKey(NamedTuple):
+    """Ключ из заголовка Idempotency-Key и хеш запроса, к которому он
+    относится"""
+
+    key: str
+    request_hash: str
+
+
+async def request_key(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+) -> Optional[RequestKey]:
+    """Зависимость FastAPI для эндпоинтов записи. Тело запроса к этому
+    моменту уже прочитано FastAPI и берется из буфера"""
+    if not idempotency_key:
+        return None
+    digest = hashlib.sha256(
+        f"{request.method} {request.url.path}\n".encode()
+    )
+    digest.update(await request.body())
+    return RequestKey(idempotency_key, digest.hexdigest())
+
+
+async def saved_response(
+    session: AsyncSession,
+    user_id: int,
+    key: Optional[RequestKey],
+) -> Optional[dict]:
+    """Ответ, сохраненный для ключа пользователя, устаревший ключ
+    удаляется, чтобы его можно было использовать снова"""
+    if not key:
+        return None
+    row = (
+        await session.execute(
+            select(
+                IdempotencyKey.response,
+                IdempotencyKey.request_hash,
+                IdempotencyKey.created_at,
+            ).where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key.key,
+            )
+        )
+    ).one_or_none()
+    if not row:
+        return None
+    if row.created_at < _expired_before():
+        await session.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key.key,
+            )
+        )
+        return None
+    if row.request_hash != key.request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key is already used for another request",
+        )
+    return row.response
+
+
+async def commit(
+    session: AsyncSession,
+    user_id: int,
+    key: Optional[RequestKey],
+    response: BaseModel,
+) -> Union[BaseModel, dict]:
+    """Фиксирует транзакцию вместе с ответом для ключа. Если параллельный
+    запрос с тем же ключом успел первым, изменения откатываются и
+    возвращается его ответ"""
+    if key:
+        session.add(
+            IdempotencyKey(
+                user_id=user_id,
+                key=key.key,
+                request_hash=key.request_hash,
+                response=response.model_dump(),
+            )
+        )
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        saved = await saved_response(session, user_id, key)
+        if saved is None:
+            raise
+        return saved
+    return response
+
+
+async def purge_expired(session: AsyncSession) -> int:
+    """Удаляет устаревшие ключи, возвращает их количество"""
+    result = await session.execute(
+        delete(IdempotencyKey).where(
+            IdempotencyKey.created_at < _expired_before()
+        )
+    )
+    await session.commit()
+    return result.rowcount
+
+
+async def main() -> None:
+    async with async_session() as session:
+        removed = await purge_expired(session)
+    await engine.dispose()
+    print(f"Removed expired idempotency keys: {removed}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
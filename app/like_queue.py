@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import logging
+from collections import Counter
+from typing import Collection, Dict, Optional, Tuple
+
+import orjson
+from sqlalchemy import delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+
+from app import counters
+from app import response_cache as cache
+from db.database import dialect_insert
+from db.models import Like, Publication
+
+from config_app.settings import (  # isort:skip
+    LIKE_ENQUEUE_TIMEOUT,
+    LIKE_FLUSH_BATCH,
+    LIKE_FLUSH_INTERVAL,
+    LIKE_QUEUE_SIZE,
+    LIKE_STOP_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+# Действие над лайком: (id пользователя, id публикации) -> поставить ли лайк
+LikeKey = Tuple[int, int]
+
+
+class QueueFull(Exception):
+    """Очередь заполнена и не освободилась за время ожидания"""
+
+
+async def apply_likes(
+    session: AsyncSession,
+    actions: Dict[LikeKey, bool],
+) -> Dict[int, int]:
+    """Записывает пакет действий разных пользователей (без фиксации
+    транзакции) и возвращает изменения счетчиков {id публикации: изменение}.
+    Лайки удаленных публикаций пропускаются"""
+    deltas: Counter = Counter()
+    to_like = [key for key, like in actions.items() if like]
+    to_unlike = [key for key, like in actions.items() if not like]
+    if to_like:
+        existing = set(
+            await session.scalars(
+                select(Publication.id).where(
+                    Publication.id.in_({tweet_id for _, tweet_id in to_like})
+                )
+            )
+        )
+        rows = [
+            {
+                "author_id": user_id,
+                "publication_id": tweet_id,
+                "is_liked": True,
+            }
+            for user_id, tweet_id in to_like
+            if tweet_id in existing
+        ]
+        if rows:
+            deltas.update(
+                await session.scalars(
+                    dialect_insert(session, Like)
+                    .values(rows)
+                    .on_conflict_do_nothing(
+                        index_elements=[Like.publication_id, Like.author_id]
+                    )
+                    .returning(Like.publication_id)
+                )
+            )
+    if to_unlike:
+        deltas.subtract(
+            await session.scalars(
+                delete(Like)
+                .where(
+                    tuple_(Like.author_id, Like.publication_id).in_(to_unlike)
+                )
+                .returning(Like.publication_id)
+                .execution_options(synchronize_session=False)
+            )
+        )
+
+    changed = {tweet_id: delta for tweet_id, delta in deltas.items() if delta}
+    if changed:
+        await counters.change_likes_counts(session, changed)
+    return changed
+
+
+class LikeQueue:
+    """Очередь отложенной записи лайков в памяти процесса.
+
+    Для каждой пары (пользователь, публикация) хранится только последнее
+    действие, поэтому лайк и следующая за ним отмена схлопываются в одно
+    действие. Фоновая задача записывает накопленное пакетами не реже чем
+    раз в flush_interval секунд. Если в очереди maxsize пар, новые действия
+    ждут освобождения места не дольше enqueue_timeout секунд, затем
+    получают QueueFull.
+
+    Подтвержденные, но еще не записанные действия (за последние
+    flush_interval секунд или дольше, пока база недоступна) хранятся только
+    в памяти: при аварийном завершении процесса они теряются. При
+    остановке запись повторяется stop_timeout секунд, после чего
+    незаписанные действия выводятся в журнал"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        flush_interval: float,
+        batch_size: int,
+        enqueue_timeout: float,
+        stop_timeout: float,
+    ):
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.stop_timeout = stop_timeout
+        self._pending: Dict[LikeKey, bool] = {}
+        self._changed = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._session_factory: Optional[async_sessionmaker] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def _has_room(self, keys: Collection[LikeKey]) -> bool:
+        new_keys = sum(1 for key in keys if key not in self._pending)
+        return len(self._pending) + new_keys <= self.maxsize
+
+    async def put(self, user_id: int, tweet_id: int, like: bool) -> None:
+        await self.put_many(user_id, {tweet_id: like})
+
+    async def put_many(self, user_id: int, actions: Dict[int, bool]) -> None:
+        """Ставит в очередь действия пользователя ({id публикации: поставить
+        ли лайк}) все сразу: либо все, либо ни одного"""
+        keys = [(user_id, tweet_id) for tweet_id in actions]
+        async with self._changed:
+            if not self._has_room(keys):
+                self._wakeup.set()
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: self._has_room(keys)),
+                        self.enqueue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    raise QueueFull()
+            for key, like in zip(keys, actions.values()):
+                self._pending[key] = like
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _take(self) -> Dict[LikeKey, bool]:
+        async with self._changed:
+            keys = list(itertools.islice(self._pending, self.batch_size))
+            batch = {key: self._pending.pop(key) for key in keys}
+            self._changed.notify_all()
+        return batch
+
+    async def _write(self, batch: Dict[LikeKey, bool]) -> Dict[int, int]:
+        async with self._session_factory() as session:
+            changed = await apply_likes(session, batch)
+            await session.commit()
+        return changed
+
+    async def flush(self) -> bool:
+        """Записывает все накопленные действия. Если запись не удалась,
+        действия возвращаются в очередь и возвращается False"""
+        while self._pending:
+            batch = await self._take()
+            try:
+                try:
+                    changed = await self._write(batch)
+                except IntegrityError:
+                    # публикацию удалили между проверкой и вставкой
+                    changed = await self._write(batch)
+            except Exception:
+                logger.exception("Failed to write like actions")
+                # более новые действия из очереди важнее возвращаемых
+                async with self._changed:
+                    for key, like in batch.items():
+                        self._pending.setdefault(key, like)
+                return False
+            await cache.response_cache.invalidate(
+                *(cache.tweet_tag(tweet_id) for tweet_id in changed)
+            )
+        return True
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self, session_factory: async_sessionmaker) -> None:
+        """Запускает фоновую запись (вызывается из lifespan приложения)"""
+        self._session_factory = session_factory
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу, дождавшись текущей записи, и
+        записывает оставшиеся действия. Неудачная запись повторяется с
+        растущими паузами до истечения stop_timeout секунд, затем
+        оставшиеся действия выводятся в журнал списком
+        [id пользователя, id публикации, поставить ли лайк], по которому
+        их можно применить вручную"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.stop_timeout
+        delay = 0.1
+        while not await self.flush():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self._discard_pending()
+                return
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5)
+
+    def _discard_pending(self) -> None:
+        lost = [
+            [user_id, tweet_id, like]
+            for (user_id, tweet_id), like in self._pending.items()
+        ]
+        logger.error(
+            "Like actions lost on shutdown: %s", orjson.dumps(lost).decode()
+        )
+        self._pending.clear()
+
+
+like_queue = LikeQueue(
+    maxsize=LIKE_QUEUE_SIZE,
+    flush_interval=LIKE_FLUSH_INTERVAL,
+    batch_size=LIKE_FLUSH_BATCH,
+    enqueue_timeout=LIKE_ENQUEUE_TIMEOUT,
+    stop_timeout=LIKE_STOP_TIMEOUT,
+)
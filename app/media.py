@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import os.path
+import time
+import uuid
+from typing import Collection, NamedTuple
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile
+from fastapi.exceptions import HTTPException
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.database import async_session, engine
+from db.models import Attachments
+
+from config_app.settings import (  # isort:skip
+    MEDIA_ACCEL_PREFIX,
+    MEDIA_ACCEL_REDIRECT,
+    MEDIA_ALLOWED_TYPES,
+    MEDIA_CHUNK_SIZE,
+    MEDIA_GC_GRACE_PERIOD,
+    MEDIA_MAX_SIZE,
+    STATIC_PATH,
+)
+
+
+class StoredMedia(NamedTuple):
+    """Результат сохранения загруженного файла"""
+
+    link: str
+    size: int
+    sha256: str
+    mime: str
+
+
+def blob_link(sha256: str, mime: str) -> str:
+    """Путь файла относительно STATIC_PATH, файлы раскладываются по
+    подкаталогам по первым символам хеша содержимого"""
+    extension = mimetypes.guess_extension(mime) or ""
+    return os.path.join(
+        "images", sha256[:2], sha256[2:4], sha256 + extension
+    )
+
+
+async def save_upload(file: UploadFile) -> StoredMedia:
+    """Потоково сохраняет загруженный файл в хранилище, адресуемое по
+    содержимому.
+
+    Файл копируется блоками по MEDIA_CHUNK_SIZE байт во временный файл,
+    попутно считается его размер и sha256. Если файл с таким содержимым уже
+    хранится, временный файл удаляется и используется существующий, иначе
+    временный файл атомарно переименовывается. Файлы недопустимого типа или
+    размером больше MEDIA_MAX_SIZE отклоняются"""
+    if not file.filename:
+        raise HTTPException(status_code=404, detail="File must have a name")
+    if file.content_type not in MEDIA_ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=415, detail="Unsupported media type"
+        )
+
+    images_dir = os.path.join(STATIC_PATH, "images")
+    await aiofiles.os.makedirs(images_dir, exist_ok=True)
+    temp_path = os.path.join(images_dir, f".{uuid.uuid4().hex}.part")
+
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(temp_path, "wb") as out_file:
+            while chunk := await file.read(MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MEDIA_MAX_SIZE:
+                    raise HTTPException(
+                        status_code=413, detail="File is too large"
+                    )
+                digest.update(chunk)
+                await out_file.write(chunk)
+
+        sha256 = digest.hexdigest()
+        link_file = blob_link(sha256, file.content_type)
+        save_path = os.path.join(STATIC_PATH, link_file)
+        if await aiofiles.os.path.exists(save_path):
+            # обновляем время изменения, чтобы сборщик мусора не удалил
+            # переиспользуемый файл до сохранения ссылки на него
+            await asyncio.to_thread(os.utime, save_path)
+            await aiofiles.os.remove(temp_path)
+        else:
+            await aiofiles.os.makedirs(
+                os.path.dirname(save_path), exist_ok=True
+            )
+            await aiofiles.os.replace(temp_path, save_path)
+    except BaseException:
+        if await aiofiles.os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        raise
+
+    return StoredMedia(
+        link=link_file,
+        size=size,
+        sha256=sha256,
+        mime=file.content_type,
+    )
+
+
+async def check_attachable(
+    session: AsyncSession,
+    author_id: int,
+    media_ids: Collection[int],
+) -> None:
+    """Проверяет одним запросом, что все медиа существуют, загружены
+    автором и еще не прикреплены к другой публикации"""
+    rows = await session.execute(
+        select(
+            Attachments.id,
+            Attachments.author_id,
+            Attachments.publication_id,
+        ).where(Attachments.id.in_(media_ids))
+    )
+    found = {row.id: row for row in rows}
+
+    unknown = sorted(
+        media_id
+        for media_id in media_ids
+        if media_id not in found
+        or found[media_id].author_id not in (None, author_id)
+    )
+    if unknown:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Media not found: {', '.join(map(str, unknown))}",
+        )
+    attached = sorted(
+        media_id
+        for media_id in media_ids
+        if found[media_id].publication_id is not None
+    )
+    if attached:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Media already attached: {', '.join(map(str, attached))}",
+        )
+
+
+async def attach_to_tweet(
+    session: AsyncSession,
+    tweet_id: int,
+    media_ids: Collection[int],
+) -> None:
+    """Прикрепляет медиа к публикации одним UPDATE. Если часть медиа
+    успели прикрепить параллельно, выбрасывает ошибку, транзакция
+    откатывается"""
+    result = await session.execute(
+        update(Attachments)
+        .where(
+            Attachments.id.in_(media_ids),
+            Attachments.publication_id.is_(None),
+        )
+        .values(publication_id=tweet_id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(media_ids):
+        raise HTTPException(status_code=409, detail="Media already attached")
+
+
+def file_response(link: str, mime: str) -> Response:
+    """Ответ с файлом хранилища. В режиме MEDIA_ACCEL_REDIRECT приложение
+    только проверяет доступ, а файл (с поддержкой Range) отдает nginx из
+    внутреннего location"""
+    headers = {"Cache-Control": "private, max-age=3600"}
+    if MEDIA_ACCEL_REDIRECT:
+        headers["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX + quote(link)
+        return Response(media_type=mime, headers=headers)
+    return FileResponse(
+        os.path.join(STATIC_PATH, link), media_type=mime, headers=headers
+    )
+
+
+def _is_stale(path: str, older_than: float) -> bool:
+    """Файл существует и не менялся с older_than"""
+    try:
+        return os.path.getmtime(path) < older_than
+    except FileNotFoundError:
+        return False
+
+
+def _stored_blobs(images_dir: str, older_than: float):
+    """Файлы хранилища, измененные раньше older_than, в виде пар
+    (хеш, путь). Уменьшенные копии относятся к хешу исходного файла"""
+    blobs = []
+    for root, _, files in os.walk(images_dir):
+        if root == images_dir:
+            continue
+        for name in files:
+            path = os.path.join(root, name)
+            if _is_stale(path, older_than):
+                sha256 = name.split(".")[0].split("_")[0]
+                blobs.append((sha256, path))
+    return blobs
+
+
+async def _referenced(session: AsyncSession, hashes) -> set:
+    return set(
+        await session.scalars(
+            select(Attachments.hash).where(Attachments.hash.in_(hashes))
+        )
+    )
+
+
+async def collect_garbage(session: AsyncSession, batch_size=500) -> int:
+    """Удаляет файлы хранилища, на которые не ссылается ни одно вложение.
+
+    Количество ссылок на файл - это количество строк attachments с его
+    хешем. Файлы моложе MEDIA_GC_GRACE_PERIOD секунд не трогаются, чтобы не
+    удалить файл загрузки, запись о которой еще не сохранена. Обход
+    каталога может занять много времени, а загрузка того же файла
+    обновляет его время изменения, поэтому перед удалением время и ссылки
+    проверяются заново. Возвращает количество удаленных файлов"""
+    images_dir = os.path.join(STATIC_PATH, "images")
+    older_than = time.time() - MEDIA_GC_GRACE_PERIOD
+    blobs = await asyncio.to_thread(_stored_blobs, images_dir, older_than)
+
+    removed = 0
+    for start in range(0, len(blobs), batch_size):
+        batch = blobs[start:start + batch_size]
+        referenced = await _referenced(
+            session, {sha256 for sha256, _ in batch}
+        )
+        candidates = [
+            (sha256, path)
+            for sha256, path in batch
+            if sha256 not in referenced
+        ]
+        if not candidates:
+            continue
+        # ссылки, сохраненные после первой проверки
+        referenced = await _referenced(
+            session, {sha256 for sha256, _ in candidates}
+        )
+        for sha256, path in candidates:
+            if sha256 in referenced:
+                continue
+            if not await asyncio.to_thread(_is_stale, path, older_than):
+                continue
+            await aiofiles.os.remove(path)
+            removed += 1
+    return removed
+
+
+async def main() -> None:
+    async with async_session() as session:
+        removed = await collect_garbage(session)
+    await engine.dispose()
+    print(f"Removed orphan media files: {removed}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,485 @@
+import bisect
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from db.database import get_pool_stats
+
+from config_app.settings import (  # isort:skip
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_SLOW_REQUEST,
+)
+
+# Метрики в текстовом формате Prometheus. Значения хранятся в памяти
+# процесса, поэтому при нескольких воркерах каждый отдает свои значения
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, self.labels, key, value
+
+
+class Histogram:
+    """Распределение значений по корзинам (как prometheus_client:
+    корзины накопительные, плюс сумма и количество наблюдений)"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # для набора меток: количество в каждой корзине (последняя - +Inf),
+        # сумма значений
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        counts, total = self.values.setdefault(
+            key, ([0] * (len(self.buckets) + 1), [0.0])
+        )
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def samples(self):
+        bucket_labels = self.labels + ("le",)
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            bounds = self.buckets + (float("inf"),)
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    bucket_labels,
+                    key + (_format_value(bound),),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", self.labels, key, total[0]
+            yield f"{self.name}_count", self.labels, key, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector) -> None:
+        """collector() возвращает [(имя, тип, описание, метки, значения)],
+        значения - список пар (значения меток, значение); вызывается при
+        каждом запросе метрик (для величин, которые дешевле прочитать,
+        чем поддерживать)"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, label_names, label_values, value in metric.samples():
+                labels = _format_labels(label_names, label_values)
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collector in self.collectors:
+            for name, type_, help, label_names, values in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for label_values, value in values:
+                    labels = _format_labels(label_names, label_values)
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by route",
+        ["method", "route", "status"],
+    )
+)
+request_statements = registry.register(
+    Histogram(
+        "http_request_sql_statements",
+        "SQL statements executed per request",
+        ["method", "route"],
+        buckets=STATEMENT_BUCKETS,
+    )
+)
+request_sql_duration = registry.register(
+    Histogram(
+        "http_request_sql_duration_seconds",
+        "Time spent in SQL statements per request",
+        ["method", "route"],
+    )
+)
+upload_bytes = registry.register(
+    Counter("media_upload_bytes_total", "Bytes of uploaded media files")
+)
+uploads = registry.register(
+    Counter("media_uploads_total", "Uploaded media files")
+)
+
+
+class RequestStats:
+    """SQL-запросы текущего запроса к API"""
+
+    __slots__ = ("statements", "sql_time", "_started")
+
+    def __init__(self):
+        self.statements = 0
+        self.sql_time = 0.0
+        self._started: List[float] = []
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = (
+    contextvars.ContextVar("request_stats", default=None)
+)
+
+
+# События всех движков (основная база, реплика, тестовая база): запросы
+# учитываются в статистике запроса к API, в контексте которого выполнены
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, *args):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats._started.append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, *args):
+    stats = _request_stats.get()
+    if stats is not None and stats._started:
+        stats.statements += 1
+        stats.sql_time += time.perf_counter() - stats._started.pop()
+
+
+@contextmanager
+def track_request():
+    """Собирает статистику SQL-запросов, выполненных внутри блока"""
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _request_stats.reset(token)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{module}.{name}"
+
+
+class SamplingProfiler:
+    """Профилировщик по выборкам для медленных запросов.
+
+    Фоновый поток раз в interval секунд снимает стек потока с циклом
+    событий, пока выполняется хотя бы один запрос, и добавляет его к
+    выборкам всех выполняющихся запросов. Выборки запроса, который длился
+    дольше threshold секунд, сохраняются в каталог directory в формате
+    folded stacks (строки 'кадр;кадр;кадр количество'), который принимают
+    flamegraph.pl и speedscope. Все запросы процесса выполняются в одном
+    потоке, поэтому в профиль попадает и работа параллельных запросов"""
+
+    def __init__(self, threshold: float, interval: float, directory: str):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self._recorders: List[StackCounter] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._target: Optional[int] = None
+        self._stopped = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if not self._recorders:
+                continue
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            folded = ";".join(reversed(stack))
+            with self._lock:
+                for recorder in self._recorders:
+                    recorder[folded] += 1
+
+    def start(self) -> None:
+        """Запускает поток выборок для текущего потока"""
+        if self._thread is not None:
+            return
+        self._target = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    @contextmanager
+    def record(self):
+        """Собирает выборки, снятые во время выполнения блока"""
+        self.start()
+        samples: StackCounter = StackCounter()
+        with self._lock:
+            self._recorders.append(samples)
+        try:
+            yield samples
+        finally:
+            with self._lock:
+                self._recorders.remove(samples)
+
+    def dump(self, samples: StackCounter, name: str) -> Optional[str]:
+        """Сохраняет выборки и возвращает путь к файлу"""
+        if not samples:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"\W+", "_", name).strip("_")
+        path = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}.folded",
+        )
+        with open(path, "w") as profile:
+            for stack, count in samples.most_common():
+                profile.write(f"{stack} {count}\n")
+        return path
+
+
+profiler = (
+    SamplingProfiler(PROFILE_SLOW_REQUEST, PROFILE_INTERVAL, PROFILE_DIR)
+    if PROFILE_SLOW_REQUEST
+    else None
+)
+
+
+def _route_name(scope) -> str:
+    """Шаблон пути маршрута (например /api/tweets/{tweet_id}/likes), чтобы
+    число меток не росло с числом разных id"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "other"
+
+
+# Потоки событий открыты минутами и часами: их длительность исказила бы
+# гистограмму времени ответа, а открытая запись профиля не дала бы
+# профилировщику останавливаться
+STREAMING_PATHS = {"/api/events"}
+STREAMING_CONTENT_TYPE = b"text/event-stream"
+
+
+def _is_streaming(message) -> bool:
+    """Начало ответа потоком событий (SSE)"""
+    return any(
+        name.lower() == b"content-type"
+        and value.startswith(STREAMING_CONTENT_TYPE)
+        for name, value in message.get("headers", [])
+    )
+
+
+class MetricsMiddleware:
+    """ASGI middleware: время ответа и SQL-запросы каждого запроса по
+    маршрутам, при включенном профилировщике - профили медленных
+    запросов. Потоки событий (STREAMING_PATHS и ответы
+    text/event-stream) не учитываются"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        finished = None
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal status, finished, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = _is_streaming(message)
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body"
+            ):
+                finished = time.perf_counter()
+
+        started = time.perf_counter()
+        with track_request() as stats, _profile() as samples:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                if not streaming:
+                    _observe(scope, status, stats, samples, started, finished)
+
+
+def _observe(scope, status, stats, samples, started, finished) -> None:
+    """Записывает метрики запроса и, если он был медленным, его профиль.
+    Фоновые задачи выполняются после отправки ответа и во время ответа не
+    входят"""
+    duration = (finished or time.perf_counter()) - started
+    method = scope["method"]
+    route = _route_name(scope)
+    request_duration.observe(
+        duration, method=method, route=route, status=status
+    )
+    request_statements.observe(stats.statements, method=method, route=route)
+    request_sql_duration.observe(stats.sql_time, method=method, route=route)
+    if samples is not None and duration >= profiler.threshold:
+        profiler.dump(samples, f"{method} {route}")
+
+
+@contextmanager
+def _profile():
+    if profiler is None:
+        yield None
+        return
+    with profiler.record() as samples:
+        yield samples
+
+
+def pool_collector(engines):
+    """Метрики пулов соединений для Registry.add_collector. engines -
+    функция, возвращающая {имя базы: движок}"""
+
+    def collect():
+        stats = {
+            name: get_pool_stats(async_engine)
+            for name, async_engine in engines().items()
+        }
+        for key, name, type_, help in (
+            ("size", "db_pool_size", "gauge", "Connection pool size"),
+            (
+                "checked_out",
+                "db_pool_checked_out",
+                "gauge",
+                "Connections in use",
+            ),
+            (
+                "overflow",
+                "db_pool_overflow",
+                "gauge",
+                "Overflow connections",
+            ),
+            (
+                "saturation",
+                "db_pool_saturation",
+                "gauge",
+                "Share of the maximum number of connections in use",
+            ),
+            (
+                "checkouts",
+                "db_pool_checkouts_total",
+                "counter",
+                "Connection checkouts",
+            ),
+            (
+                "wait_time_total",
+                "db_pool_wait_seconds_total",
+                "counter",
+                "Time spent waiting for a connection",
+            ),
+            (
+                "wait_time_max",
+                "db_pool_wait_seconds_max",
+                "gauge",
+                "Longest wait for a connection",
+            ),
+            (
+                "connects",
+                "db_pool_connects_total",
+                "counter",
+                "New connections opened",
+            ),
+            (
+                "connect_time_total",
+                "db_pool_connect_seconds_total",
+                "counter",
+                "Time spent opening new connections",
+            ),
+        ):
+            yield (
+                name,
+                type_,
+                help,
+                ("database",),
+                [
+                    ((database,), values[key])
+                    for database, values in stats.items()
+                    if key in values
+                ],
+            )
+
+    return collect
@@ -0,0 +1,39 @@
+import base64
+import datetime
+from typing import Tuple
+
+
+def encode_cursor(created_at: datetime.datetime, tweet_id: int) -> str:
+    """Упаковывает позицию последней публикации страницы в непрозрачный
+    курсор для следующего запроса"""
+    raw = f"{created_at.isoformat()}|{tweet_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Распаковывает курсор, выбрасывает ValueError для некорректных данных"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded).decode()
+        created_at, tweet_id = raw.split("|")
+        return datetime.datetime.fromisoformat(created_at), int(tweet_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def encode_rank_cursor(rank: float, tweet_id: int) -> str:
+    """Курсор для выдачи, упорядоченной по релевантности (поиск)"""
+    raw = f"{rank!r}|{tweet_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, int]:
+    """Распаковывает курсор поиска, выбрасывает ValueError для
+    некорректных данных"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded).decode()
+        rank, tweet_id = raw.split("|")
+        return float(rank), int(tweet_id)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
@@ -0,0 +1,81 @@
+"""Сжатые заранее копии статики (file.js.gz, file.js.br) для gzip_static и
+brotli_static nginx, чтобы сервер не сжимал файлы при каждом запросе.
+Копии brotli создаются, если установлен пакет brotli.
+
+Запуск: python -m app.precompress [каталог]
+"""
+import gzip
+import os
+import sys
+from typing import Callable, Dict
+
+from config_app.settings import STATIC_PATH
+
+# Изображения и видео уже сжаты, загруженные файлы (images) не трогаются
+COMPRESSIBLE_EXTENSIONS = (
+    ".css",
+    ".html",
+    ".ico",
+    ".js",
+    ".json",
+    ".map",
+    ".svg",
+    ".txt",
+)
+MIN_SIZE = 256
+
+
+def _compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    compressors = {".gz": lambda data: gzip.compress(data, 9, mtime=0)}
+    try:
+        import brotli  # type: ignore
+    except ImportError:
+        pass
+    else:
+        compressors[".br"] = brotli.compress
+    return compressors
+
+
+def precompress(directory: str = STATIC_PATH) -> int:
+    """Создает недостающие и устаревшие сжатые копии, возвращает
+    количество записанных файлов. Копия не сохраняется, если она не меньше
+    исходного файла"""
+    compressors = _compressors()
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        if root == directory and "images" in dirs:
+            dirs.remove("images")
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            if os.path.getsize(path) < MIN_SIZE:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for suffix, compress in compressors.items():
+                target = path + suffix
+                if (
+                    os.path.exists(target)
+                    and os.path.getmtime(target) >= mtime
+                ):
+                    continue
+                if data is None:
+                    with open(path, "rb") as source:
+                        data = source.read()
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, "wb") as out_file:
+                    out_file.write(compressed)
+                written += 1
+    return written
+
+
+def main() -> None:
+    directory = sys.argv[1] if len(sys.argv) > 1 else STATIC_PATH
+    print(f"Precompressed files: {precompress(directory)}")
+
+
+if __name__ == "__main__":
+    main()
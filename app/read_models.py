@@ -0,0 +1,301 @@
+import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import JSON, and_, literal_column, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.future import select
+from sqlalchemy.sql.functions import FunctionElement
+
+from app import search, timeline
+from app.pagination import encode_cursor, encode_rank_cursor
+from db.models import Attachments, Followers, Like, Publication, User
+
+# Запросы для чтения ленты и профилей: выбираются только нужные API
+# колонки, связанные списки собираются в JSON на стороне базы, поэтому
+# страница читается одним запросом без создания объектов ORM.
+# Для PostgreSQL используются json_agg/json_build_object, для SQLite -
+# json_group_array/json_object
+
+
+class json_array_agg(FunctionElement):
+    """Агрегирует значения группы в JSON-массив"""
+
+    type = JSON()
+    inherit_cache = True
+
+
+class json_build_object(FunctionElement):
+    """JSON-объект из именованных аргументов. Ключи подставляются в запрос
+    литералами: PostgreSQL не может вывести тип параметров этой функции"""
+
+    type = JSON()
+    inherit_cache = True
+
+    def __init__(self, **fields):
+        args = []
+        for key, value in fields.items():
+            args += [literal_column(f"'{key}'"), value]
+        super().__init__(*args)
+
+
+class json_value(FunctionElement):
+    """Значение JSON-колонки для вложения в json_build_object и
+    json_array_agg (SQLite хранит JSON как текст)"""
+
+    type = JSON()
+    inherit_cache = True
+
+
+@compiles(json_array_agg)
+def _compile_json_array_agg(element, compiler, **kw):
+    return f"json_agg({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_array_agg, "sqlite")
+def _compile_json_array_agg_sqlite(element, compiler, **kw):
+    return f"json_group_array({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_build_object)
+def _compile_json_build_object(element, compiler, **kw):
+    return f"json_build_object({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_build_object, "sqlite")
+def _compile_json_build_object_sqlite(element, compiler, **kw):
+    return f"json_object({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(json_value)
+def _compile_json_value(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(json_value, "sqlite")
+def _compile_json_value_sqlite(element, compiler, **kw):
+    return f"json({compiler.process(element.clauses, **kw)})"
+
+
+def _tweet_attachments():
+    """Ссылки на вложения публикации и их уменьшенные копии"""
+    attachments = (
+        select(Attachments.link, Attachments.variants)
+        .where(Attachments.publication_id == Publication.id)
+        .order_by(Attachments.id)
+        .correlate(Publication)
+        .subquery()
+    )
+    return (
+        select(
+            json_build_object(
+                links=json_array_agg(attachments.c.link),
+                variants=json_array_agg(json_value(attachments.c.variants)),
+            )
+        )
+        .scalar_subquery()
+        .label("attachments")
+    )
+
+
+def _tweet_likes():
+    """Поставившие отметку 'нравится' пользователи"""
+    likes = (
+        select(Like.author_id, User.name)
+        .join(User, User.id == Like.author_id)
+        .where(Like.publication_id == Publication.id)
+        .order_by(Like.author_id)
+        .correlate(Publication)
+        .subquery()
+    )
+    return (
+        select(
+            json_array_agg(
+                json_build_object(user_id=likes.c.author_id, name=likes.c.name)
+            )
+        )
+        .scalar_subquery()
+        .label("likes")
+    )
+
+
+def _tweets_query():
+    """Публикации с автором, вложениями и отметками 'нравится'"""
+    return select(
+        Publication.id,
+        Publication.content,
+        Publication.created_at,
+        Publication.likes_count,
+        User.id.label("author_id"),
+        User.name.label("author_name"),
+        _tweet_attachments(),
+        _tweet_likes(),
+    ).join(User, User.id == Publication.author_id)
+
+
+def _tweet_dict(row) -> dict:
+    """Строка запроса _tweets_query в виде словаря схемы TweetInfo"""
+    attachments = row.attachments or {}
+    return {
+        "id": row.id,
+        "content": row.content,
+        "attachments": attachments.get("links") or [],
+        "attachment_variants": [
+            variants or {} for variants in attachments.get("variants") or []
+        ],
+        "author": {"id": row.author_id, "name": row.author_name},
+        "likes_count": row.likes_count,
+        "likes": row.likes or [],
+    }
+
+
+async def feed_page(
+    session: AsyncSession,
+    user_id: int,
+    limit: int,
+    cursor: Optional[Tuple[datetime.datetime, int]] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Страница ленты пользователя в виде словарей схемы TweetInfo и
+    курсор следующей страницы"""
+    feed = timeline.feed_query(user_id, limit + 1, cursor)
+    query = (
+        _tweets_query()
+        .join(feed, feed.c.id == Publication.id)
+        .order_by(feed.c.created_at.desc(), feed.c.id.desc())
+        .limit(limit + 1)
+    )
+
+    rows = (await session.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [_tweet_dict(row) for row in rows], next_cursor
+
+
+async def tweets_by_ids(
+    session: AsyncSession,
+    tweet_ids: List[int],
+) -> List[dict]:
+    """Публикации по списку id в порядке списка, несуществующие
+    пропускаются"""
+    rows = await session.execute(
+        _tweets_query().where(Publication.id.in_(tweet_ids))
+    )
+    tweets = {row.id: _tweet_dict(row) for row in rows}
+    return [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets]
+
+
+async def search_page(
+    session: AsyncSession,
+    q: str,
+    limit: int,
+    cursor: Optional[Tuple[float, int]] = None,
+) -> Tuple[List[dict], Optional[str]]:
+    """Страница результатов поиска, от более релевантных к менее, в виде
+    словарей схемы TweetInfo и курсор следующей страницы"""
+    matches = search.matches(session, q)
+    if matches is None:
+        return [], None
+
+    query = (
+        _tweets_query()
+        .add_columns(matches.c.rank)
+        .join(matches, matches.c.publication_id == Publication.id)
+        .order_by(matches.c.rank.desc(), Publication.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        cursor_rank, cursor_id = cursor
+        query = query.where(
+            or_(
+                matches.c.rank < cursor_rank,
+                and_(
+                    matches.c.rank == cursor_rank,
+                    Publication.id < cursor_id,
+                ),
+            )
+        )
+
+    rows = (await session.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].id)
+    return [_tweet_dict(row) for row in rows], next_cursor
+
+
+def _profile_users(
+    join_column,
+    filter_column,
+    user_id: int,
+    limit: Optional[int],
+    offset: int,
+):
+    """Страница подписчиков либо подписок пользователя"""
+    users = (
+        select(User.id, User.name)
+        .join(Followers, join_column == User.id)
+        .where(filter_column == user_id)
+        .order_by(User.id)
+        .offset(offset)
+        .limit(limit)
+        .subquery()
+    )
+    return select(
+        json_array_agg(
+            json_build_object(id=users.c.id, name=users.c.name)
+        )
+    ).scalar_subquery()
+
+
+async def user_profile(
+    session: AsyncSession,
+    user_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    counts_only: bool = False,
+) -> Optional[dict]:
+    """Профиль пользователя в виде словаря схемы AuthorsInfoDetail,
+    списки подписчиков и подписок читаются тем же запросом"""
+    columns = [
+        User.id,
+        User.name,
+        User.followers_count,
+        User.following_count,
+    ]
+    if not counts_only:
+        columns += [
+            _profile_users(
+                Followers.follower_id,
+                Followers.author_id,
+                user_id,
+                limit,
+                offset,
+            ).label("follower"),
+            _profile_users(
+                Followers.author_id,
+                Followers.follower_id,
+                user_id,
+                limit,
+                offset,
+            ).label("following"),
+        ]
+    row = (
+        await session.execute(select(*columns).where(User.id == user_id))
+    ).one_or_none()
+    if not row:
+        return None
+
+    profile = {
+        "id": row.id,
+        "name": row.name,
+        "followers_count": row.followers_count,
+        "following_count": row.following_count,
+        "follower": None,
+        "following": None,
+    }
+    if not counts_only:
+        profile["follower"] = row.follower or []
+        profile["following"] = row.following or []
+    return profile
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.cache import TTLCache
+from db.models import Followers, User
+
+from config_app.settings import (  # isort:skip
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_REDIS_URL,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+)
+
+
+class CachedResponse(NamedTuple):
+    """Готовый ответ: тело в JSON, его ETag и версии тегов на момент
+    сохранения"""
+
+    etag: str
+    body: bytes
+    tags: Dict[str, int]
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """Сравнивает ETag с заголовком If-None-Match (слабое сравнение)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (
+        tag[2:] if tag.startswith("W/") else tag for tag in candidates
+    )
+
+
+def json_response(
+    body: bytes,
+    etag: str,
+    if_none_match: Optional[str] = None,
+) -> Response:
+    """Ответ с телом в JSON либо 304, если клиент прислал тот же ETag"""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+class MemoryBackend:
+    """Кеш ответов в памяти процесса.
+
+    Инвалидация по тегам: у каждого тега есть версия, запись считается
+    устаревшей, если версия хотя бы одного ее тега изменилась. Версии
+    выдаются из общего счетчика и не повторяются, поэтому теги, не
+    менявшиеся дольше ttl, можно забывать.
+
+    Значение счетчика запоминается (snapshot) до запроса к базе: если
+    какой-то тег ответа получил версию больше, изменение могло произойти
+    во время запроса и не попасть в ответ, такой ответ не сохраняется"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._tags: Dict[str, Tuple[int, float]] = {}
+        self._clock = 0
+        self._swept_at = time.monotonic()
+
+    def _version(self, tag: str) -> int:
+        return self._tags.get(tag, (0, 0.0))[0]
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        found, entry = self.entries.get(key)
+        if not found:
+            return None
+        for tag, version in entry.tags.items():
+            if self._version(tag) != version:
+                self.entries.invalidate(key)
+                return None
+        return entry
+
+    async def snapshot(self) -> int:
+        return self._clock
+
+    async def set(
+        self,
+        key: str,
+        body: bytes,
+        tags: Iterable[str],
+        snapshot: int,
+    ):
+        entry = CachedResponse(
+            etag=make_etag(body),
+            body=body,
+            tags={tag: self._version(tag) for tag in tags},
+        )
+        if max(entry.tags.values(), default=0) <= snapshot:
+            self.entries.set(key, entry)
+        return entry
+
+    async def invalidate(self, *tags: str) -> None:
+        now = time.monotonic()
+        if tags:
+            self._clock += 1
+        for tag in tags:
+            self._tags[tag] = (self._clock, now)
+        if now - self._swept_at > self.ttl:
+            # записи, сохраненные до последнего изменения тега, уже истекли
+            self._tags = {
+                tag: item
+                for tag, item in self._tags.items()
+                if now - item[1] <= self.ttl
+            }
+            self._swept_at = now
+
+    async def clear(self) -> None:
+        self.entries.clear()
+        self._tags.clear()
+
+    async def close(self) -> None:
+        pass
+
+
+# Увеличивает общий счетчик и назначает его значение версией всех тегов
+_INVALIDATE_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], version, 'EX', ARGV[1])
+end
+return version
+"""
+
+
+class RedisBackend:
+    """Кеш ответов в Redis (или совместимом хранилище), общий для всех
+    процессов приложения. Устроен так же, как MemoryBackend"""
+
+    def __init__(self, url: str, ttl: float, prefix: str = "microblog:"):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError(
+                "RESPONSE_CACHE_BACKEND=redis requires the redis package"
+            )
+        self.client = aioredis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}response:{key}"
+
+    def _tag(self, tag: str) -> str:
+        return f"{self.prefix}tag:{tag}"
+
+    @property
+    def _clock(self) -> str:
+        return f"{self.prefix}clock"
+
+    async def _versions(self, tags) -> Dict[str, int]:
+        if not tags:
+            return {}
+        values = await self.client.mget([self._tag(tag) for tag in tags])
+        return {tag: int(value or 0) for tag, value in zip(tags, values)}
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        raw = await self.client.get(self._key(key))
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        if await self._versions(list(data["tags"])) != data["tags"]:
+            return None
+        return CachedResponse(
+            etag=data["etag"],
+            body=data["body"].encode(),
+            tags=data["tags"],
+        )
+
+    async def snapshot(self) -> int:
+        return int(await self.client.get(self._clock) or 0)
+
+    async def set(
+        self,
+        key: str,
+        body: bytes,
+        tags: Iterable[str],
+        snapshot: int,
+    ):
+        entry = CachedResponse(
+            etag=make_etag(body),
+            body=body,
+            tags=await self._versions(list(tags)),
+        )
+        if max(entry.tags.values(), default=0) <= snapshot:
+            data = {
+                "etag": entry.etag,
+                "body": body.decode(),
+                "tags": entry.tags,
+            }
+            await self.client.set(
+                self._key(key), json.dumps(data), ex=self.ttl
+            )
+        return entry
+
+    async def invalidate(self, *tags: str) -> None:
+        if tags:
+            keys = [self._clock] + [self._tag(tag) for tag in tags]
+            await self.client.eval(
+                _INVALIDATE_SCRIPT, len(keys), *keys, self.ttl
+            )
+
+    async def clear(self) -> None:
+        async for key in self.client.scan_iter(f"{self.prefix}*"):
+            await self.client.delete(key)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class DisabledBackend:
+    """Кеширование выключено, ETag и 304 при этом продолжают работать"""
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return None
+
+    async def snapshot(self) -> int:
+        return 0
+
+    async def set(
+        self,
+        key: str,
+        body: bytes,
+        tags: Iterable[str],
+        snapshot: int,
+    ):
+        return CachedResponse(etag=make_etag(body), body=body, tags={})
+
+    async def invalidate(self, *tags: str) -> None:
+        pass
+
+    async def clear(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+def create_backend(backend: str = RESPONSE_CACHE_BACKEND):
+    if backend == "redis":
+        return RedisBackend(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL)
+    if backend == "memory":
+        return MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+    return DisabledBackend()
+
+
+response_cache = create_backend()
+
+
+def feed_key(user_id: int, limit: int, cursor: Optional[str]) -> str:
+    return f"feed:{user_id}:{limit}:{cursor or ''}"
+
+
+def profile_key(
+    user_id: int,
+    limit: Optional[int],
+    offset: int,
+    counts_only: bool,
+) -> str:
+    return f"profile:{user_id}:{limit or ''}:{offset}:{int(counts_only)}"
+
+
+def feed_tag(user_id: int) -> str:
+    """Лента пользователя: меняется при его подписках и публикациях его
+    самого и авторов, на которых он подписан"""
+    return f"feed:{user_id}"
+
+
+def tweet_tag(tweet_id: int) -> str:
+    """Публикация в ленте: меняется при лайках и удалении"""
+    return f"tweet:{tweet_id}"
+
+
+def user_tag(user_id: int) -> str:
+    """Профиль пользователя: меняется при подписках"""
+    return f"user:{user_id}"
+
+
+async def invalidate_author_feeds(session: AsyncSession, author_id: int):
+    """Сбрасывает ленты автора и его подписчиков после новой публикации.
+
+    Как и при рассылке в ленты (см. app.timeline), у популярных авторов
+    ленты подписчиков не сбрасываются: их публикации появляются в
+    закешированных лентах через RESPONSE_CACHE_TTL секунд"""
+    tags = [feed_tag(author_id)]
+    is_popular = await session.scalar(
+        select(User.is_popular).where(User.id == author_id)
+    )
+    if is_popular is False:
+        followers = await session.scalars(
+            select(Followers.follower_id).where(
+                Followers.author_id == author_id
+            )
+        )
+        tags += [feed_tag(follower_id) for follower_id in followers]
+    await response_cache.invalidate(*tags)
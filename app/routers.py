@@ -1,23 +1,62 @@
-import datetime
-import os.path
-
-import aiofiles
-from fastapi import APIRouter, Depends, FastAPI, File, Header, Path, UploadFile
+from typing import Dict, List, Optional
+
+import orjson
+from fastapi import (  # isort:skip
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    File,
+    Header,
+    Path,
+    Query,
+    UploadFile,
+)
 from fastapi.exceptions import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import delete, literal
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.future import select
 
-from db.database import get_async_session
+from app import (
+    counters,
+    events,
+    idempotency,
+    media,
+    metrics,
+    read_models,
+    search,
+    thumbnails,
+    timeline,
+)
+from app import response_cache as cache
+from app.auth import create_api_key, get_current_user_id, revoke_api_key
+from app.dependencies import (  # isort:skip
+    get_read_session,
+    get_recent_write,
+    get_writer_id,
+)
+from app.like_queue import QueueFull, like_queue
+from app.pagination import decode_cursor, decode_rank_cursor
+from db.database import dialect_insert, get_async_session
 from db.models import Attachments, Followers, Like, Publication, User
-from config_app.settings import API_KEY, ERROR_RESPONSES, STATIC_PATH
+
+from config_app.settings import (  # isort:skip
+    ERROR_RESPONSES,
+    FEED_MAX_PAGE_SIZE,
+    FEED_PAGE_SIZE,
+)
 
 from app.schemas import (  # isort:skip
+    BatchItemResult,
+    BatchOut,
+    FollowsBatchIn,
     GetAllTweetsOut,
+    LikesBatchIn,
     MediasAddOut,
     OutputSchema,
     TweetAddIn,
     TweetAddOut,
-    TweetInfo,
     UserAddIn,
     UserAddOut,
     UserProfileInfoOut,
@@ -32,79 +71,145 @@ async def add_new_useer(
     user: UserAddIn,
     session: AsyncSession = Depends(get_async_session),
 ) -> UserAddOut:
-    """Создание нового пользователя в приложение"""
+    """Создание нового пользователя в приложение, возвращает ключ api-key
+    для дальнейших запросов"""
     new_user = User(name=user.name)
     session.add(new_user)
+    await session.flush()
+    api_key = create_api_key(session, new_user.id)
     await session.commit()
-    return UserAddOut(result=True, author_id=int(new_user.id))
+    return UserAddOut(
+        result=True,
+        author_id=int(new_user.id),
+        api_key=api_key,
+    )
+
+
+@router.delete("/api_key", response_model=OutputSchema)
+async def delete_api_key(
+    api_key: str = Header(...),
+    author_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+) -> OutputSchema:
+    """Отзыв ключа api-key, которым подписан запрос"""
+    await revoke_api_key(session, api_key)
+    return OutputSchema(result=True)
 
 
 @router.post("/tweets", response_model=TweetAddOut)
 async def add_tweet(
     tweet: TweetAddIn,
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> TweetAddOut:
-    """Добавление новой публикации, проверяет наличие media id"""
-    author_id = API_KEY.get(api_key, 0)
-    if not author_id:
-        raise HTTPException(status_code=404, detail="User is not registered")
+    """Добавление новой публикации одной транзакцией, проверяет наличие
+    и принадлежность автору media id"""
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
+    media_ids = set(tweet.tweet_media_ids or [])
+    if media_ids:
+        await media.check_attachable(session, author_id, media_ids)
+
     new_tweet = Publication(
         author_id=author_id,
         content=tweet.tweet_data,
     )
     session.add(new_tweet)
-    await session.commit()
-    if tweet.tweet_media_ids:
-        for media_id in tweet.tweet_media_ids:
-            attachment = await session.execute(
-                select(Attachments).where(Attachments.id == media_id)
-            )
-            attachment_model = attachment.one()[0]
-            attachment_model.publication_id = new_tweet.id
-            session.add(attachment_model)
-
-    await session.commit()
-
-    return TweetAddOut(result=True, tweet_id=int(new_tweet.id))
+    await session.flush()
+    await search.index_tweet(session, new_tweet.id, new_tweet.content)
+    if media_ids:
+        await media.attach_to_tweet(session, new_tweet.id, media_ids)
+    await timeline.push_tweet(session, new_tweet)
+    response = await idempotency.commit(
+        session,
+        author_id,
+        idempotency_key,
+        TweetAddOut(result=True, tweet_id=int(new_tweet.id)),
+    )
+    await cache.invalidate_author_feeds(session, author_id)
+    await events.publish_tweet(session, new_tweet.id, author_id)
+    return response
 
 
 @router.post("/medias", response_model=MediasAddOut)
 async def add_media(
-    api_key: str = Header(...),
+    background_tasks: BackgroundTasks,
+    author_id: int = Depends(get_writer_id),
     file: UploadFile = File(...),
     session: AsyncSession = Depends(get_async_session),
 ) -> MediasAddOut:
-    """Загрузка медиа файлов"""
-
-    if not file.filename:
-        raise HTTPException(status_code=404, detail="File must have a name")
-
-    now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_")
-    file_name = now + file.filename
-    link_file = os.path.join("images", file_name)
-    save_path = os.path.join(STATIC_PATH, link_file)
-
-    async with aiofiles.open(save_path, "wb") as out_file:
-        content = await file.read()
-        await out_file.write(content)
-
-    new_attachment = Attachments(link=link_file)
+    """Загрузка медиа файлов, файл сохраняется на диск потоково,
+    одинаковые файлы хранятся в одном экземпляре. Уменьшенные копии
+    изображений создаются в фоне после ответа"""
+    stored_media = await media.save_upload(file)
+    metrics.uploads.inc()
+    metrics.upload_bytes.inc(stored_media.size)
+
+    new_attachment = Attachments(
+        author_id=author_id,
+        link=stored_media.link,
+        hash=stored_media.sha256,
+        size=stored_media.size,
+        mime=stored_media.mime,
+    )
     session.add(new_attachment)
     await session.commit()
+    background_tasks.add_task(
+        thumbnails.process_attachment,
+        async_sessionmaker(session.bind, expire_on_commit=False),
+        new_attachment.id,
+        new_attachment.link,
+        new_attachment.mime,
+    )
 
     return MediasAddOut(result=True, media_id=int(new_attachment.id))
 
 
+@router.get(
+    "/medias/{media_id}",
+    response_class=Response,
+    responses={200: {"content": {"application/octet-stream": {}}}},
+)
+async def get_media(
+    author_id: int = Depends(get_current_user_id),
+    media_id: int = Path(...),
+    session: AsyncSession = Depends(get_async_session),
+) -> Response:
+    """Файл вложения по id. Вложения публикаций доступны всем, еще не
+    прикрепленные к публикации - только загрузившему их автору"""
+    attachment = await session.get(Attachments, media_id)
+    if not attachment or (
+        attachment.publication_id is None
+        and attachment.author_id != author_id
+    ):
+        raise HTTPException(status_code=404, detail="Media not found")
+    return media.file_response(attachment.link, attachment.mime)
+
+
 @router.delete("/tweets/{tweet_id}", response_model=OutputSchema)
 async def delete_tweet(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
     tweet_id: int = Path(...),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> OutputSchema:
     """Удаление публикации автора, проводится проверка
     принадлежности публикации автору"""
-    author_id = API_KEY.get(api_key, 0)
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
     tweet_id = tweet_id
     tweet_by_author_id_tweet_id = await session.execute(
         select(Publication).where(
@@ -113,123 +218,225 @@ async def delete_tweet(
     )
     tweet_to_delete = tweet_by_author_id_tweet_id.scalar()
     if tweet_to_delete:
+        await timeline.remove_tweet(session, tweet_to_delete.id)
+        await search.unindex_tweet(session, tweet_to_delete.id)
         await session.delete(tweet_to_delete)
-        await session.commit()
-        return OutputSchema(result=True)
+        response = await idempotency.commit(
+            session, author_id, idempotency_key, OutputSchema(result=True)
+        )
+        await cache.response_cache.invalidate(cache.tweet_tag(tweet_id))
+        await events.broker.publish(
+            author_id, "delete", {"tweet_id": tweet_id}
+        )
+        return response
     else:
         raise HTTPException(status_code=404, detail="Tweet not found")
 
 
+async def enqueue_like(
+    session: AsyncSession,
+    author_id: int,
+    tweet_id: int,
+    like: bool,
+) -> None:
+    """Ставит действие в очередь отложенной записи лайков, если публикация
+    существует"""
+    tweet_exists = await session.scalar(
+        select(Publication.id).where(Publication.id == tweet_id)
+    )
+    if not tweet_exists:
+        raise HTTPException(status_code=404, detail="Tweet not found")
+    await enqueue_likes(author_id, {tweet_id: like})
+
+
+async def enqueue_likes(author_id: int, actions: Dict[int, bool]) -> None:
+    """Ставит действия ({id публикации: поставить ли лайк}) в очередь
+    отложенной записи лайков"""
+    try:
+        await like_queue.put_many(author_id, actions)
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Like queue is full")
+
+
 @router.post("/tweets/{tweet_id}/likes", response_model=OutputSchema)
 async def add_like_to_tweet(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
     tweet_id: int = Path(...),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> OutputSchema:
-    """Добавление записи 'нравиться' публикации, проверка существует ли
-    на самом деле публикация, отсутствует ли запись "нравиться" поставленная
-    нами раннее"""
-    author_id = API_KEY.get(api_key, 0)
-    if not author_id:
-        raise HTTPException(status_code=404, detail="User is not registered")
+    """Добавление записи 'нравиться' публикации одним запросом INSERT ...
+    ON CONFLICT DO NOTHING, безопасным при параллельных запросах. Повторная
+    отметка не считается ошибкой, отдельно проверяется только существование
+    публикации, если строка не была добавлена. В режиме отложенной записи
+    лайк подтверждается сразу после постановки в очередь"""
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
 
-    tweet_id = tweet_id
-    tweet = await session.get(Publication, tweet_id)
-    if tweet:
-        like_tweet = await session.execute(
-            select(Like).where(
-                Like.publication_id == tweet_id, Like.author_id == author_id
-            )
+    if like_queue.running:
+        await enqueue_like(session, author_id, tweet_id, True)
+        response = await idempotency.commit(
+            session, author_id, idempotency_key, OutputSchema(result=True)
         )
-        if not like_tweet.scalar():
-            new_like_tweet = Like(
-                author_id=author_id,
-                publication_id=tweet_id,
-                is_liked=True,
-            )
-            session.add(new_like_tweet)
-            await session.commit()
-            return OutputSchema(result=True)
-
-        raise HTTPException(status_code=404, detail="Tweet already like")
+        await events.publish_likes(session, author_id, liked=[tweet_id])
+        return response
+
+    inserted = await session.scalar(
+        dialect_insert(session, Like)
+        .from_select(
+            ["author_id", "publication_id", "is_liked"],
+            select(literal(author_id), Publication.id, literal(True)).where(
+                Publication.id == tweet_id
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Like.publication_id, Like.author_id]
+        )
+        .returning(Like.publication_id)
+    )
+    if inserted:
+        await counters.change_likes_count(session, [tweet_id], 1)
+    elif not await session.get(Publication, tweet_id):
+        raise HTTPException(status_code=404, detail="Tweet not found")
 
-    raise HTTPException(status_code=404, detail="Tweet not found")
+    response = await idempotency.commit(
+        session, author_id, idempotency_key, OutputSchema(result=True)
+    )
+    if inserted:
+        await cache.response_cache.invalidate(cache.tweet_tag(tweet_id))
+        await events.publish_likes(session, author_id, liked=[tweet_id])
+    return response
 
 
 @router.delete("/tweets/{tweet_id}/likes", response_model=OutputSchema)
 async def delete_like_to_tweet(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
     tweet_id: int = Path(...),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> OutputSchema:
     """Удаление записи 'нравиться' публикации, проверка существует ли
-    на самом деле публикация существует ли запись 'нравиться'"""
-    author_id = API_KEY.get(api_key, 0)
-    tweet_id = tweet_id
-    like_model = await session.execute(
-        select(Like).where(
+    на самом деле публикация существует ли запись 'нравиться'. В режиме
+    отложенной записи отмена подтверждается после постановки в очередь"""
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
+    if like_queue.running:
+        await enqueue_like(session, author_id, tweet_id, False)
+        response = await idempotency.commit(
+            session, author_id, idempotency_key, OutputSchema(result=True)
+        )
+        await events.publish_likes(session, author_id, unliked=[tweet_id])
+        return response
+
+    deleted_like = await session.execute(
+        delete(Like).where(
             Like.publication_id == tweet_id,
             Like.author_id == author_id,
         )
     )
-    like_tweet = like_model.scalar()
-    if like_tweet:
-        await session.delete(like_tweet)
-        await session.commit()
-        return OutputSchema(result=True)
+    if deleted_like.rowcount:
+        await counters.change_likes_count(session, [tweet_id], -1)
+        response = await idempotency.commit(
+            session, author_id, idempotency_key, OutputSchema(result=True)
+        )
+        await cache.response_cache.invalidate(cache.tweet_tag(tweet_id))
+        await events.publish_likes(session, author_id, unliked=[tweet_id])
+        return response
     raise HTTPException(status_code=404, detail="Tweet by like not found")
 
 
+async def invalidate_follow(follower_id: int, author_ids) -> None:
+    """Подписка меняет ленту подписчика и профили всех участников"""
+    await cache.response_cache.invalidate(
+        cache.feed_tag(follower_id),
+        cache.user_tag(follower_id),
+        *(cache.user_tag(author_id) for author_id in author_ids),
+    )
+
+
 @router.post("/users/{user_id}/follow", response_model=OutputSchema)
 async def follow_on_user(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
     user_id: int = Path(...),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> OutputSchema:
-    """Подписка на других авторов, проверка существует ли автор,
-    не подписаны ли мы уже на него, не пытаемся ли мы подписаться
-    на самого себя"""
-    author_id = API_KEY.get(api_key, 0)
-    if not author_id:
-        raise HTTPException(status_code=404, detail="User is not registered")
+    """Подписка на других авторов одним запросом INSERT ... ON CONFLICT
+    DO NOTHING, безопасным при параллельных запросах. Повторная подписка не
+    считается ошибкой, подписаться на самого себя нельзя"""
     follow_author = user_id
     if author_id == follow_author:
         raise HTTPException(
             status_code=404,
             detail="You can't subscribe to yourself",
         )
-    subscibe_modul = await session.execute(
-        select(Followers).where(
-            Followers.author_id == follow_author,
-            Followers.follower_id == author_id,
-        ),
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
     )
-    subscibe = subscibe_modul.scalar()
-    if not subscibe:
-        author = await session.get(User, follow_author)
-        if author:
-            new_subscribe = Followers(
-                author_id=follow_author,
-                follower_id=author_id,
-            )
-            session.add(new_subscribe)
-            await session.commit()
-            return OutputSchema(result=True)
-
+    if saved:
+        return saved
+
+    inserted = await session.scalar(
+        dialect_insert(session, Followers)
+        .from_select(
+            ["author_id", "follower_id"],
+            select(User.id, literal(author_id)).where(
+                User.id == follow_author
+            ),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Followers.author_id, Followers.follower_id]
+        )
+        .returning(Followers.author_id)
+    )
+    if inserted:
+        await counters.change_follow_counts(
+            session, [follow_author], author_id, 1
+        )
+        await timeline.promote_authors(session, [follow_author])
+        await timeline.backfill_authors(session, author_id, [follow_author])
+    elif not await session.get(User, follow_author):
         raise HTTPException(status_code=404, detail="Author not exist")
 
-    raise HTTPException(status_code=404, detail="Subscribe already exist")
+    response = await idempotency.commit(
+        session, author_id, idempotency_key, OutputSchema(result=True)
+    )
+    if inserted:
+        await invalidate_follow(author_id, [follow_author])
+        await events.publish_follows(author_id, followed=[follow_author])
+    return response
 
 
 @router.delete("/users/{user_id}/follow", response_model=OutputSchema)
 async def delete_follow(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_writer_id),
     user_id: int = Path(...),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
     session: AsyncSession = Depends(get_async_session),
 ) -> OutputSchema:
     """Удаление подписки на других авторов, проверка существует ли
     подписка на автора"""
-    author_id = API_KEY.get(api_key, 0)
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
     follow_author = user_id
     subscibe_moodel = await session.execute(
         select(Followers).where(
@@ -239,97 +446,405 @@ async def delete_follow(
     )
     subscibe = subscibe_moodel.scalar()
     if subscibe:
+        await timeline.remove_authors(session, author_id, [follow_author])
+        await counters.change_follow_counts(
+            session, [follow_author], author_id, -1
+        )
         await session.delete(subscibe)
-        await session.commit()
-        return OutputSchema(result=True)
+        response = await idempotency.commit(
+            session, author_id, idempotency_key, OutputSchema(result=True)
+        )
+        await invalidate_follow(author_id, [follow_author])
+        await events.publish_follows(author_id, unfollowed=[follow_author])
+        return response
     raise HTTPException(status_code=404, detail="Subscribe not exist")
 
 
+@router.post("/likes:batch", response_model=BatchOut)
+async def batch_likes(
+    batch: LikesBatchIn,
+    author_id: int = Depends(get_writer_id),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
+    session: AsyncSession = Depends(get_async_session),
+) -> BatchOut:
+    """Пакетная установка и снятие отметок 'нравиться' одной транзакцией
+    (например, при синхронизации действий, сделанных без сети). Для каждой
+    публикации действует последнее действие пакета, результаты возвращаются
+    для каждого действия. В режиме отложенной записи пакет подтверждается
+    после постановки в очередь, успешными считаются действия над
+    существующими публикациями"""
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
+    actions = {item.tweet_id: item.like for item in batch.items}
+    to_like = [tweet_id for tweet_id, like in actions.items() if like]
+    to_unlike = [tweet_id for tweet_id, like in actions.items() if not like]
+
+    liked, already_liked, unliked = set(), set(), set()
+    if like_queue.running:
+        # действия пакета идут через ту же очередь, что и одиночные лайки,
+        # иначе более старое действие из очереди перезаписало бы пакет
+        existing = set(
+            await session.scalars(
+                select(Publication.id).where(Publication.id.in_(actions))
+            )
+        )
+        liked = set(to_like) & existing
+        unliked = set(to_unlike) & existing
+        await enqueue_likes(
+            author_id,
+            {tweet_id: actions[tweet_id] for tweet_id in liked | unliked},
+        )
+    else:
+        if to_like:
+            liked = set(
+                await session.scalars(
+                    dialect_insert(session, Like)
+                    .from_select(
+                        ["author_id", "publication_id", "is_liked"],
+                        select(
+                            literal(author_id), Publication.id, literal(True)
+                        ).where(Publication.id.in_(to_like)),
+                    )
+                    .on_conflict_do_nothing(
+                        index_elements=[Like.publication_id, Like.author_id]
+                    )
+                    .returning(Like.publication_id)
+                )
+            )
+            not_inserted = set(to_like) - liked
+            if not_inserted:
+                already_liked = set(
+                    await session.scalars(
+                        select(Publication.id).where(
+                            Publication.id.in_(not_inserted)
+                        )
+                    )
+                )
+            if liked:
+                await counters.change_likes_count(session, liked, 1)
+        if to_unlike:
+            unliked = set(
+                await session.scalars(
+                    delete(Like)
+                    .where(
+                        Like.author_id == author_id,
+                        Like.publication_id.in_(to_unlike),
+                    )
+                    .returning(Like.publication_id)
+                    .execution_options(synchronize_session=False)
+                )
+            )
+            if unliked:
+                await counters.change_likes_count(session, unliked, -1)
+
+    results = []
+    for item in batch.items:
+        if actions[item.tweet_id]:
+            done = item.tweet_id in liked | already_liked
+            error_message = "Tweet not found"
+        else:
+            done = item.tweet_id in unliked
+            error_message = "Tweet by like not found"
+        results.append(
+            BatchItemResult(
+                id=item.tweet_id,
+                result=done,
+                error_message=None if done else error_message,
+            )
+        )
+
+    response = await idempotency.commit(
+        session,
+        author_id,
+        idempotency_key,
+        BatchOut(result=True, items=results),
+    )
+    await cache.response_cache.invalidate(
+        *(cache.tweet_tag(tweet_id) for tweet_id in liked | unliked)
+    )
+    await events.publish_likes(session, author_id, liked, unliked)
+    return response
+
+
+@router.post("/follows:batch", response_model=BatchOut)
+async def batch_follows(
+    batch: FollowsBatchIn,
+    author_id: int = Depends(get_writer_id),
+    idempotency_key: Optional[idempotency.RequestKey] = Depends(
+        idempotency.request_key
+    ),
+    session: AsyncSession = Depends(get_async_session),
+) -> BatchOut:
+    """Пакетные подписки и отписки одной транзакцией. Для каждого автора
+    действует последнее действие пакета, результаты возвращаются для
+    каждого действия"""
+    saved = await idempotency.saved_response(
+        session, author_id, idempotency_key
+    )
+    if saved:
+        return saved
+
+    actions = {
+        item.user_id: item.follow
+        for item in batch.items
+        if item.user_id != author_id
+    }
+    to_follow = [user_id for user_id, follow in actions.items() if follow]
+    to_unfollow = [
+        user_id for user_id, follow in actions.items() if not follow
+    ]
+
+    followed, already_followed, unfollowed = set(), set(), set()
+    if to_follow:
+        followed = set(
+            await session.scalars(
+                dialect_insert(session, Followers)
+                .from_select(
+                    ["author_id", "follower_id"],
+                    select(User.id, literal(author_id)).where(
+                        User.id.in_(to_follow)
+                    ),
+                )
+                .on_conflict_do_nothing(
+                    index_elements=[Followers.author_id, Followers.follower_id]
+                )
+                .returning(Followers.author_id)
+            )
+        )
+        not_inserted = set(to_follow) - followed
+        if not_inserted:
+            already_followed = set(
+                await session.scalars(
+                    select(User.id).where(User.id.in_(not_inserted))
+                )
+            )
+        if followed:
+            await counters.change_follow_counts(
+                session, followed, author_id, 1
+            )
+            await timeline.promote_authors(session, followed)
+            await timeline.backfill_authors(session, author_id, followed)
+    if to_unfollow:
+        unfollowed = set(
+            await session.scalars(
+                delete(Followers)
+                .where(
+                    Followers.follower_id == author_id,
+                    Followers.author_id.in_(to_unfollow),
+                )
+                .returning(Followers.author_id)
+                .execution_options(synchronize_session=False)
+            )
+        )
+        if unfollowed:
+            await timeline.remove_authors(session, author_id, unfollowed)
+            await counters.change_follow_counts(
+                session, unfollowed, author_id, -1
+            )
+
+    results = []
+    for item in batch.items:
+        if item.user_id == author_id:
+            done = False
+            error_message = "You can't subscribe to yourself"
+        elif actions[item.user_id]:
+            done = item.user_id in followed | already_followed
+            error_message = "Author not exist"
+        else:
+            done = item.user_id in unfollowed
+            error_message = "Subscribe not exist"
+        results.append(
+            BatchItemResult(
+                id=item.user_id,
+                result=done,
+                error_message=None if done else error_message,
+            )
+        )
+
+    response = await idempotency.commit(
+        session,
+        author_id,
+        idempotency_key,
+        BatchOut(result=True, items=results),
+    )
+    if followed or unfollowed:
+        await invalidate_follow(author_id, followed | unfollowed)
+        await events.publish_follows(author_id, followed, unfollowed)
+    return response
+
+
+def parse_ids(ids: str) -> List[int]:
+    """Список id через запятую без повторов"""
+    try:
+        tweet_ids = [int(tweet_id) for tweet_id in ids.split(",") if tweet_id]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Invalid ids")
+    tweet_ids = list(dict.fromkeys(tweet_ids))
+    if len(tweet_ids) > FEED_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail="Too many ids")
+    return tweet_ids
+
+
 @router.get("/tweets", response_model=GetAllTweetsOut)
 async def get_all_tweets(
-    api_key: str = Header(...),
-    session: AsyncSession = Depends(get_async_session),
-) -> GetAllTweetsOut:
+    author_id: int = Depends(get_current_user_id),
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    ids: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    recent_write: bool = Depends(get_recent_write),
+    session: AsyncSession = Depends(get_read_session),
+) -> Response:
     """Вывода ленты пользователя(выводит свои публикации и
-    публикации подписок)"""
-    author_id = API_KEY.get(api_key, 0)
-    if not author_id:
-        raise HTTPException(status_code=404, detail="User is not registered")
-
-    subscriptions = await session.execute(
-        select(Followers).where(Followers.follower_id == author_id)
-    )
-    authors_idx = [author_id]
-    for subscription in subscriptions:
-        authors_idx.append(subscription[0].author_id)
-
-    tweets_by_authors = await session.execute(
-        select(Publication).where(Publication.author_id.in_(authors_idx))
-    )
-    list_of_tweets = []
-    for row in tweets_by_authors:
-        tweet = row[0]
-
-        data_tweet = {
-            "id": tweet.id,
-            "content": tweet.content,
-            "attachments": [attachm.link for attachm in tweet.attachment],
-            "author": tweet.author.to_dict(),
-            "likes": [
-                {"user_id": like.author_id, "name": like.author.name}
-                for like in tweet.like
-            ],
-        }
-        list_of_tweets.append(data_tweet)
-    tweets_data = [TweetInfo(**tweet) for tweet in list_of_tweets]
-    return GetAllTweetsOut(result=True, tweets=tweets_data)
+    публикации подписок) страницами от новых к старым, для получения
+    следующей страницы передается next_cursor из предыдущего ответа.
+    Готовые ответы кешируются, клиент с тем же ETag получает 304.
+    Сразу после своей записи пользователь получает ответ из базы, который
+    заменяет закешированный.
+    С параметром ids (id через запятую) вместо ленты возвращает указанные
+    публикации, несуществующие пропускаются"""
+    if ids is not None:
+        tweets = await read_models.tweets_by_ids(session, parse_ids(ids))
+        body = orjson.dumps(
+            {"result": True, "tweets": tweets, "next_cursor": None}
+        )
+        return cache.json_response(body, cache.make_etag(body), if_none_match)
+
+    cache_key = cache.feed_key(author_id, limit, cursor)
+    cached = None
+    if not recent_write:
+        cached = await cache.response_cache.get(cache_key)
+    if cached:
+        return cache.json_response(cached.body, cached.etag, if_none_match)
+    snapshot = await cache.response_cache.snapshot()
+
+    decoded_cursor = None
+    if cursor:
+        try:
+            decoded_cursor = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+    # страница читается одним запросом сразу в словари схемы TweetInfo,
+    # которые сериализуются без построения и проверки моделей pydantic
+    list_of_tweets, next_cursor = await read_models.feed_page(
+        session, author_id, limit, decoded_cursor
+    )
+
+    feed = {
+        "result": True,
+        "tweets": list_of_tweets,
+        "next_cursor": next_cursor,
+    }
+    entry = await cache.response_cache.set(
+        cache_key,
+        orjson.dumps(feed),
+        [cache.feed_tag(author_id)]
+        + [cache.tweet_tag(tweet["id"]) for tweet in list_of_tweets],
+        snapshot,
+    )
+    return cache.json_response(entry.body, entry.etag, if_none_match)
+
+
+@router.get("/search", response_model=GetAllTweetsOut)
+async def search_tweets(
+    author_id: int = Depends(get_current_user_id),
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+    session: AsyncSession = Depends(get_read_session),
+) -> Response:
+    """Полнотекстовый поиск по публикациям, результаты упорядочены по
+    релевантности и выдаются страницами, для получения следующей
+    страницы передается next_cursor из предыдущего ответа"""
+    decoded_cursor = None
+    if cursor:
+        try:
+            decoded_cursor = decode_rank_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+    list_of_tweets, next_cursor = await read_models.search_page(
+        session, q, limit, decoded_cursor
+    )
+    # результаты поиска не кешируются: их меняет любая новая публикация
+    body = orjson.dumps(
+        {"result": True, "tweets": list_of_tweets, "next_cursor": next_cursor}
+    )
+    return cache.json_response(body, cache.make_etag(body), if_none_match)
+
+
+@router.get(
+    "/events",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def stream_events(
+    author_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_async_session),
+) -> StreamingResponse:
+    """Поток событий ленты пользователя (Server-Sent Events): новые и
+    удаленные публикации, отметки 'нравится' и подписки. После события
+    reset ленту нужно перечитать через GET /api/tweets"""
+    authors = await session.scalars(
+        select(Followers.author_id).where(Followers.follower_id == author_id)
+    )
+    subscription = events.broker.subscribe(author_id, authors)
+    # соединение с базой не должно оставаться занятым на время потока
+    await session.close()
+    return StreamingResponse(
+        events.broker.stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/users/{user_id}", response_model=UserProfileInfoOut)
 async def get_user_profile_info(
-    api_key: str = Header(...),
+    author_id: int = Depends(get_current_user_id),
     user_id: str = Path(...),
-    session: AsyncSession = Depends(get_async_session),
-) -> UserProfileInfoOut:
+    limit: Optional[int] = Query(None, ge=1, le=FEED_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    counts_only: bool = Query(False),
+    if_none_match: Optional[str] = Header(None),
+    recent_write: bool = Depends(get_recent_write),
+    session: AsyncSession = Depends(get_read_session),
+) -> Response:
     """Вывод общей информации о профиле юзера пользователя,
-    либо о себе (вместо user_id прописать 'me')"""
+    либо о себе (вместо user_id прописать 'me'). Списки подписчиков и
+    подписок можно получать страницами (limit/offset) либо запросить
+    только их количество (counts_only). Как и лента, сразу после своей
+    записи пользователь получает профиль из базы, а не из кеша"""
 
     if user_id == "me":
-        actual_user_id = API_KEY.get(api_key, 0)
-        if not actual_user_id:
-            raise HTTPException(status_code=404, detail="User is not registered")
+        actual_user_id = author_id
     else:
         actual_user_id = int(user_id)
 
-    author = await session.execute(
-        select(User).where(User.id == actual_user_id),
+    cache_key = cache.profile_key(actual_user_id, limit, offset, counts_only)
+    cached = None
+    if not recent_write:
+        cached = await cache.response_cache.get(cache_key)
+    if cached:
+        return cache.json_response(cached.body, cached.etag, if_none_match)
+    snapshot = await cache.response_cache.snapshot()
+
+    author_data = await read_models.user_profile(
+        session, actual_user_id, limit, offset, counts_only
     )
-    author_model = author.scalar_one_or_none()
-    if not author_model:
+    if not author_data:
         raise HTTPException(status_code=404, detail="User is not found")
 
-    author_data = author_model.to_dict()
-    author_data["follower"] = []
-
-    for follower in author_model.follower:
-        follower = {"id": follower.follower_id}
-        name_row = await session.execute(
-            select(User).where(User.id == follower["id"]),
-        )
-        user_model = name_row.scalar_one_or_none()
-        if user_model:
-            follower["name"] = user_model.name
-        author_data["follower"].append(follower)
-    author_data["following"] = []
-
-    for following in author_model.following:
-        following = {"id": following.author_id}
-        name_row = await session.execute(
-            select(User).where(User.id == following["id"]),
-        )
-        user_model = name_row.scalar_one_or_none()
-        if user_model:
-            following["name"] = user_model.name
-        author_data["following"].append(following)
     profile_data = {"result": True, "user": author_data}
-    return UserProfileInfoOut(**profile_data)
+    entry = await cache.response_cache.set(
+        cache_key,
+        orjson.dumps(profile_data),
+        [cache.user_tag(actual_user_id)],
+        snapshot,
+    )
+    return cache.json_response(entry.body, entry.etag, if_none_match)
@@ -1,6 +1,8 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from config_app.config import BATCH_MAX_ITEMS
 
 
 class OutputSchema(BaseModel):
@@ -25,6 +27,7 @@ class UserAddOut(OutputSchema):
     """
 
     author_id: int
+    api_key: str
 
 
 class TweetAddIn(BaseModel):
@@ -69,8 +72,10 @@ class TweetInfo(BaseModel):
     id: int
     content: str
     attachments: Optional[List]
+    attachment_variants: List[Dict[str, str]] = []
     author: AuthorsInfo
     likes: Optional[List]
+    likes_count: int = 0
 
 
 class GetAllTweetsOut(OutputSchema):
@@ -79,6 +84,7 @@ class GetAllTweetsOut(OutputSchema):
     """
 
     tweets: Optional[List[TweetInfo]]
+    next_cursor: Optional[str] = None
 
 
 class AuthorsInfoDetail(AuthorsInfo):
@@ -88,6 +94,8 @@ class AuthorsInfoDetail(AuthorsInfo):
 
     follower: Optional[List[AuthorsInfo]]
     following: Optional[List[AuthorsInfo]]
+    followers_count: int = 0
+    following_count: int = 0
 
 
 class UserProfileInfoOut(OutputSchema):
@@ -99,6 +107,61 @@ class UserProfileInfoOut(OutputSchema):
     user: AuthorsInfoDetail
 
 
+class LikeBatchItem(BaseModel):
+    """
+    Схема действия пакета отметок 'нравиться': поставить (like=True)
+    либо снять отметку.
+    """
+
+    tweet_id: int
+    like: bool = True
+
+
+class LikesBatchIn(BaseModel):
+    """
+    Схема для данных, отправляемых при пакетном изменении отметок.
+    """
+
+    items: List[LikeBatchItem] = Field(max_length=BATCH_MAX_ITEMS)
+
+
+class FollowBatchItem(BaseModel):
+    """
+    Схема действия пакета подписок: подписаться (follow=True)
+    либо отписаться.
+    """
+
+    user_id: int
+    follow: bool = True
+
+
+class FollowsBatchIn(BaseModel):
+    """
+    Схема для данных, отправляемых при пакетном изменении подписок.
+    """
+
+    items: List[FollowBatchItem] = Field(max_length=BATCH_MAX_ITEMS)
+
+
+class BatchItemResult(BaseModel):
+    """
+    Схема результата одного действия пакета.
+    """
+
+    id: int
+    result: bool
+    error_message: Optional[str] = None
+
+
+class BatchOut(OutputSchema):
+    """
+    Схема для ответа приложения на пакетный запрос, результаты идут
+    в порядке действий запроса.
+    """
+
+    items: List[BatchItemResult]
+
+
 class ErrorResponses(BaseModel):
     """
     Схема для ответа приложения при возникновении ошибки.
@@ -0,0 +1,116 @@
+import re
+from typing import Optional
+
+from sqlalchemy import column, delete, func, insert, literal_column, table
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.models import SEARCH_TABLE, SEARCH_TS_CONFIG, Publication
+
+# Полнотекстовый индекс публикаций (см. db.models): в PostgreSQL - колонка
+# tsvector с GIN-индексом, в SQLite - виртуальная таблица FTS5. Индекс
+# обновляется в той же транзакции, что и публикация
+
+_postgresql_index = table(
+    SEARCH_TABLE,
+    column("publication_id"),
+    column("document"),
+)
+_sqlite_index = table(
+    SEARCH_TABLE,
+    column("rowid"),
+    column("content"),
+)
+
+_ts_config = literal_column(f"'{SEARCH_TS_CONFIG}'::regconfig")
+
+
+def _dialect(session: AsyncSession) -> str:
+    return session.bind.dialect.name
+
+
+async def index_tweet(session: AsyncSession, tweet_id: int, content: str):
+    """Добавляет текст публикации в индекс"""
+    if _dialect(session) == "postgresql":
+        statement = insert(_postgresql_index).values(
+            publication_id=tweet_id,
+            document=func.to_tsvector(_ts_config, content),
+        )
+    else:
+        statement = insert(_sqlite_index).values(
+            rowid=tweet_id, content=content
+        )
+    await session.execute(statement)
+
+
+async def unindex_tweet(session: AsyncSession, tweet_id: int):
+    """Удаляет публикацию из индекса (в PostgreSQL строку удалил бы и
+    ON DELETE CASCADE, но FTS5 внешних ключей не поддерживает)"""
+    if _dialect(session) == "postgresql":
+        statement = delete(_postgresql_index).where(
+            _postgresql_index.c.publication_id == tweet_id
+        )
+    else:
+        statement = delete(_sqlite_index).where(
+            _sqlite_index.c.rowid == tweet_id
+        )
+    await session.execute(statement)
+
+
+async def reindex_all(session: AsyncSession):
+    """Перестраивает индекс по всем публикациям (например, после загрузки
+    данных в обход API)"""
+    if _dialect(session) == "postgresql":
+        index = _postgresql_index
+        statement = insert(index).from_select(
+            ["publication_id", "document"],
+            select(
+                Publication.id,
+                func.to_tsvector(_ts_config, Publication.content),
+            ),
+        )
+    else:
+        index = _sqlite_index
+        statement = insert(index).from_select(
+            ["rowid", "content"], select(Publication.id, Publication.content)
+        )
+    await session.execute(delete(index))
+    await session.execute(statement)
+
+
+def _fts5_query(q: str) -> Optional[str]:
+    """Запрос FTS5 из слов строки поиска: каждое слово берется в кавычки,
+    чтобы операторы и спецсимволы FTS5 не ломали разбор запроса"""
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def matches(session: AsyncSession, q: str):
+    """Подзапрос (publication_id, rank) публикаций, подходящих под строку
+    поиска, чем больше rank, тем релевантнее. None, если в строке нет слов"""
+    if _dialect(session) == "postgresql":
+        query = func.websearch_to_tsquery(_ts_config, q)
+        document = _postgresql_index.c.document
+        return (
+            select(
+                _postgresql_index.c.publication_id,
+                func.ts_rank_cd(document, query).label("rank"),
+            )
+            .where(document.op("@@")(query))
+            .subquery()
+        )
+
+    fts5_query = _fts5_query(q)
+    if fts5_query is None:
+        return None
+    # bm25 возвращает тем меньшее значение, чем релевантнее документ
+    return (
+        select(
+            _sqlite_index.c.rowid.label("publication_id"),
+            (-func.bm25(literal_column(SEARCH_TABLE))).label("rank"),
+        )
+        .where(literal_column(SEARCH_TABLE).op("MATCH")(fts5_query))
+        .subquery()
+    )
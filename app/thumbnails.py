@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import os.path
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from PIL import Image
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.future import select
+
+from app import response_cache as cache
+from db.models import Attachments
+
+from config_app.settings import (  # isort:skip
+    MEDIA_VARIANT_FORMAT,
+    MEDIA_VARIANT_TYPES,
+    MEDIA_VARIANT_WIDTHS,
+    MEDIA_VARIANT_WORKERS,
+    STATIC_PATH,
+)
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Пул процессов для обработки изображений, создается при первом
+    обращении в каждом процессе приложения"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MEDIA_VARIANT_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Останавливает пул процессов, дожидаясь завершения начатых задач"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def variant_link(link: str, width: int, image_format: str) -> str:
+    """Путь уменьшенной копии рядом с исходным файлом"""
+    base, _ = os.path.splitext(link)
+    return f"{base}_w{width}.{image_format}"
+
+
+def generate_variants(
+    static_path: str,
+    link: str,
+    widths: List[int],
+    image_format: str,
+) -> Dict[str, str]:
+    """Создает уменьшенные копии изображения для каждой ширины меньше
+    исходной, уже существующие копии не пересоздаются. Выполняется в
+    отдельном процессе, возвращает словарь {ширина: путь}"""
+    variants = {}
+    with Image.open(os.path.join(static_path, link)) as image:
+        has_alpha = image.mode in ("RGBA", "LA", "P")
+        mode = "RGBA" if has_alpha and image_format != "jpeg" else "RGB"
+        for width in sorted(widths):
+            if width >= image.width:
+                break
+            target_link = variant_link(link, width, image_format)
+            target_path = os.path.join(static_path, target_link)
+            if not os.path.exists(target_path):
+                height = max(1, round(image.height * width / image.width))
+                variant = image.convert(mode)
+                variant.thumbnail((width, height))
+                temp_path = f"{target_path}.{uuid.uuid4().hex}.part"
+                variant.save(temp_path, format=image_format)
+                os.replace(temp_path, target_path)
+            variants[str(width)] = target_link
+    return variants
+
+
+async def process_attachment(
+    session_factory: async_sessionmaker[AsyncSession],
+    attachment_id: int,
+    link: str,
+    mime: str,
+) -> None:
+    """Фоновая обработка загруженного изображения: строит уменьшенные копии
+    в пуле процессов, не блокируя цикл событий, и сохраняет их пути во
+    вложении. Пока обработка не закончена, клиенты получают оригинал"""
+    if mime not in MEDIA_VARIANT_TYPES:
+        return
+
+    global _executor
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    try:
+        variants = await loop.run_in_executor(
+            executor,
+            generate_variants,
+            STATIC_PATH,
+            link,
+            MEDIA_VARIANT_WIDTHS,
+            MEDIA_VARIANT_FORMAT,
+        )
+    except (OSError, Image.DecompressionBombError):
+        # файл не удалось прочитать как изображение или он слишком велик,
+        # остается оригинал
+        return
+    except BrokenProcessPool:
+        # процесс пула завершился аварийно (например, из-за нехватки
+        # памяти), такой пул больше не принимает задачи: при следующем
+        # обращении создается новый
+        logger.exception("Image processing pool is broken")
+        if _executor is executor:
+            _executor = None
+            executor.shutdown(wait=False)
+        return
+
+    async with session_factory() as session:
+        await session.execute(
+            update(Attachments)
+            .where(Attachments.id == attachment_id)
+            .values(variants=variants)
+        )
+        await session.commit()
+        tweet_id = await session.scalar(
+            select(Attachments.publication_id).where(
+                Attachments.id == attachment_id
+            )
+        )
+    if tweet_id:
+        # публикация уже вышла, в кеше лент она осталась без копий
+        await cache.response_cache.invalidate(cache.tweet_tag(tweet_id))
@@ -0,0 +1,468 @@
+import asyncio
+import datetime
+import sys
+from typing import Collection, Optional, Tuple
+
+from sqlalchemy import (
+    and_,
+    delete,
+    func,
+    insert,
+    literal,
+    or_,
+    true,
+    union_all,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db.database import async_session, dialect_insert, engine
+from db.models import Followers, Publication, Timeline, User
+
+from config_app.settings import (  # isort:skip
+    FANOUT_DEMOTE_FOLLOWERS,
+    FANOUT_MAX_FOLLOWERS,
+    TIMELINE_MAX_LENGTH,
+    TIMELINE_MODE,
+)
+
+
+def is_fanout_enabled() -> bool:
+    """Включен ли режим рассылки публикаций в ленты подписчиков при записи"""
+    return TIMELINE_MODE == "fanout"
+
+
+def _before(created_at, item_id, cursor):
+    """Условие keyset-пагинации: записи после курсора (created_at, id) в
+    порядке от новых к старым"""
+    cursor_created_at, cursor_id = cursor
+    return or_(
+        created_at < cursor_created_at,
+        and_(created_at == cursor_created_at, item_id < cursor_id),
+    )
+
+
+def _newest(query, created_at, item_id, limit: int, cursor):
+    """Подзапрос первых limit записей query от новых к старым"""
+    if cursor:
+        query = query.where(_before(created_at, item_id, cursor))
+    return (
+        query.order_by(created_at.desc(), item_id.desc())
+        .limit(limit)
+        .subquery()
+    )
+
+
+def feed_query(
+    user_id: int,
+    limit: int,
+    cursor: Optional[Tuple[datetime.datetime, int]] = None,
+):
+    """Запрос (id, created_at) первых limit публикаций ленты пользователя
+    после курсора, от новых к старым.
+
+    В режиме pull лента собирается из публикаций самого пользователя и его
+    подписок одним условием author_id IN (...). В режиме fanout лента
+    читается из заранее заполненной таблицы timeline по индексу
+    (user_id, created_at, publication_id), а публикации популярных авторов
+    (см. promote_authors), которые при записи не рассылаются, добавляются
+    через UNION ALL отдельным запросом с тем же курсором и пределом.
+    Условия не объединяются через OR: с ним PostgreSQL не использует ни
+    один из индексов"""
+    if not is_fanout_enabled():
+        authors = (
+            select(Followers.author_id)
+            .where(Followers.follower_id == user_id)
+            .union(select(literal(user_id)))
+        )
+        return _newest(
+            select(Publication.id, Publication.created_at).where(
+                Publication.author_id.in_(authors)
+            ),
+            Publication.created_at,
+            Publication.id,
+            limit,
+            cursor,
+        )
+
+    timeline = _newest(
+        select(
+            Timeline.publication_id.label("id"), Timeline.created_at
+        ).where(Timeline.user_id == user_id),
+        Timeline.created_at,
+        Timeline.publication_id,
+        limit,
+        cursor,
+    )
+    popular_subscriptions = (
+        select(Followers.author_id)
+        .join(User, User.id == Followers.author_id)
+        .where(
+            Followers.follower_id == user_id,
+            User.is_popular,
+        )
+    )
+    # публикации автора, ставшего популярным, могут остаться в timeline
+    in_timeline = (
+        select(Timeline.publication_id)
+        .where(
+            Timeline.user_id == user_id,
+            Timeline.publication_id == Publication.id,
+        )
+        .exists()
+    )
+    popular = _newest(
+        select(Publication.id, Publication.created_at).where(
+            Publication.author_id.in_(popular_subscriptions), ~in_timeline
+        ),
+        Publication.created_at,
+        Publication.id,
+        limit,
+        cursor,
+    )
+    return union_all(select(*timeline.c), select(*popular.c)).subquery()
+
+
+async def trim_timeline(session: AsyncSession, user_id: int) -> None:
+    """Удаляет из ленты пользователя записи старше TIMELINE_MAX_LENGTH
+    последних. Граница находится по индексу (user_id, created_at,
+    publication_id), поэтому ленты не длиннее предела почти ничего не
+    стоят"""
+    cutoff = (
+        await session.execute(
+            select(Timeline.created_at, Timeline.publication_id)
+            .where(Timeline.user_id == user_id)
+            .order_by(
+                Timeline.created_at.desc(), Timeline.publication_id.desc()
+            )
+            .offset(TIMELINE_MAX_LENGTH)
+            .limit(1)
+        )
+    ).first()
+    if cutoff is None:
+        return
+    await session.execute(
+        delete(Timeline).where(
+            Timeline.user_id == user_id,
+            or_(
+                Timeline.created_at < cutoff.created_at,
+                and_(
+                    Timeline.created_at == cutoff.created_at,
+                    Timeline.publication_id <= cutoff.publication_id,
+                ),
+            ),
+        )
+    )
+
+
+async def trim_timelines(session: AsyncSession) -> int:
+    """Обрезает все ленты длиннее TIMELINE_MAX_LENGTH и возвращает их
+    количество. Рассылка публикаций ленты не обрезает (это стоило бы
+    запроса на каждого подписчика), поэтому команда запускается
+    периодически"""
+    users = list(
+        await session.scalars(
+            select(Timeline.user_id)
+            .group_by(Timeline.user_id)
+            .having(func.count() > TIMELINE_MAX_LENGTH)
+        )
+    )
+    for user_id in users:
+        await trim_timeline(session, user_id)
+        await session.commit()
+    return len(users)
+
+
+async def push_tweet(session: AsyncSession, tweet: Publication) -> None:
+    """Добавляет новую публикацию в ленту автора и, если автор не относится
+    к популярным, в ленты всех его подписчиков. Ленты не обрезаются, см.
+    trim_timelines"""
+    if not is_fanout_enabled():
+        return
+
+    recipients = select(literal(tweet.author_id).label("user_id"))
+    is_popular = await session.scalar(
+        select(User.is_popular).where(User.id == tweet.author_id)
+    )
+    if not is_popular:
+        recipients = recipients.union_all(
+            select(Followers.follower_id).where(
+                Followers.author_id == tweet.author_id
+            )
+        )
+    recipients = recipients.subquery()
+
+    await session.execute(
+        insert(Timeline).from_select(
+            ["user_id", "publication_id", "created_at"],
+            select(
+                recipients.c.user_id,
+                literal(tweet.id),
+                literal(tweet.created_at),
+            ),
+        )
+    )
+
+
+async def remove_tweet(session: AsyncSession, tweet_id: int) -> None:
+    """Удаляет публикацию из всех лент"""
+    if not is_fanout_enabled():
+        return
+
+    await session.execute(
+        delete(Timeline).where(Timeline.publication_id == tweet_id)
+    )
+
+
+async def backfill_authors(
+    session: AsyncSession,
+    user_id: int,
+    author_ids: Collection[int],
+) -> None:
+    """Добавляет последние публикации авторов (кроме популярных) в ленту
+    нового подписчика. Уже добавленные записи пропускаются: они могли
+    попасть в ленту при переводе автора в обычные (demote_authors)"""
+    if not is_fanout_enabled():
+        return
+
+    regular_authors = select(User.id).where(
+        User.id.in_(author_ids), User.is_popular.is_(False)
+    )
+    await session.execute(
+        dialect_insert(session, Timeline)
+        .from_select(
+            ["user_id", "publication_id", "created_at"],
+            select(literal(user_id), Publication.id, Publication.created_at)
+            .where(Publication.author_id.in_(regular_authors))
+            .order_by(Publication.created_at.desc(), Publication.id.desc())
+            .limit(TIMELINE_MAX_LENGTH),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Timeline.user_id, Timeline.publication_id]
+        )
+    )
+    await trim_timeline(session, user_id)
+
+
+async def remove_authors(
+    session: AsyncSession,
+    user_id: int,
+    author_ids: Collection[int],
+) -> None:
+    """Убирает публикации авторов из ленты отписавшегося пользователя"""
+    if not is_fanout_enabled():
+        return
+
+    await session.execute(
+        delete(Timeline).where(
+            Timeline.user_id == user_id,
+            Timeline.publication_id.in_(
+                select(Publication.id).where(
+                    Publication.author_id.in_(author_ids)
+                )
+            ),
+        )
+    )
+
+
+async def promote_authors(
+    session: AsyncSession,
+    author_ids: Collection[int],
+) -> None:
+    """Отмечает популярными авторов, у которых после подписки стало больше
+    FANOUT_MAX_FOLLOWERS подписчиков. Их новые публикации не рассылаются в
+    ленты, а читаются вместе с лентой отдельным запросом. Обратный перевод
+    выполняет demote_authors"""
+    await session.execute(
+        update(User)
+        .where(
+            User.id.in_(author_ids),
+            User.followers_count > FANOUT_MAX_FOLLOWERS,
+            User.is_popular.is_(False),
+        )
+        .values(is_popular=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def _backfill_followers(
+    session: AsyncSession,
+    author_id: int,
+    batch_size: int,
+    since: Optional[datetime.datetime] = None,
+) -> None:
+    """Добавляет последние публикации автора (созданные не раньше since) в
+    ленты его подписчиков, фиксируя изменения пачками по batch_size
+    подписчиков. Уже добавленные записи пропускаются"""
+    latest = select(Publication.id, Publication.created_at).where(
+        Publication.author_id == author_id
+    )
+    if since is not None:
+        latest = latest.where(Publication.created_at >= since)
+    latest = (
+        latest.order_by(Publication.created_at.desc(), Publication.id.desc())
+        .limit(TIMELINE_MAX_LENGTH)
+        .subquery()
+    )
+    last_id = 0
+    while True:
+        follower_ids = list(
+            await session.scalars(
+                select(Followers.follower_id)
+                .where(
+                    Followers.author_id == author_id,
+                    Followers.follower_id > last_id,
+                )
+                .order_by(Followers.follower_id)
+                .limit(batch_size)
+            )
+        )
+        if not follower_ids:
+            return
+        await session.execute(
+            dialect_insert(session, Timeline)
+            .from_select(
+                ["user_id", "publication_id", "created_at"],
+                select(Followers.follower_id, latest.c.id, latest.c.created_at)
+                .join(latest, true())
+                .where(
+                    Followers.author_id == author_id,
+                    Followers.follower_id.in_(follower_ids),
+                ),
+            )
+            .on_conflict_do_nothing(
+                index_elements=[Timeline.user_id, Timeline.publication_id]
+            )
+        )
+        await session.commit()
+        last_id = follower_ids[-1]
+
+
+async def demote_authors(
+    session: AsyncSession,
+    batch_size: int = 1000,
+) -> int:
+    """Переводит в обычные популярных авторов, у которых подписчиков стало
+    меньше FANOUT_DEMOTE_FOLLOWERS, и возвращает их количество. Запускается
+    периодически, а не при отписке: рассылка последних публикаций автора по
+    всем подписчикам слишком дорога для запроса.
+
+    В режиме fanout публикации автора сначала добавляются в ленты
+    подписчиков, затем снимается признак, и повторно добавляются
+    публикации, созданные за это время (пока признак стоял, они не
+    рассылались). Пока признак не снят, лента читает публикации автора
+    отдельным запросом, поэтому они не пропадают и не дублируются"""
+    author_ids = list(
+        await session.scalars(
+            select(User.id).where(
+                User.is_popular,
+                User.followers_count < FANOUT_DEMOTE_FOLLOWERS,
+            )
+        )
+    )
+    for author_id in author_ids:
+        # запас на публикации, созданные до начала, но зафиксированные
+        # после первого прохода
+        started = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        if is_fanout_enabled():
+            await _backfill_followers(session, author_id, batch_size)
+        await session.execute(
+            update(User)
+            .where(User.id == author_id)
+            .values(is_popular=False)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        if is_fanout_enabled():
+            await _backfill_followers(
+                session, author_id, batch_size, since=started
+            )
+    return len(author_ids)
+
+
+async def rebuild_timeline(session: AsyncSession, user_id: int) -> None:
+    """Заполняет ленту пользователя заново: его собственные публикации и
+    публикации подписок, кроме популярных авторов"""
+    regular_subscriptions = (
+        select(Followers.author_id)
+        .join(User, User.id == Followers.author_id)
+        .where(Followers.follower_id == user_id, User.is_popular.is_(False))
+    )
+    await session.execute(delete(Timeline).where(Timeline.user_id == user_id))
+    await session.execute(
+        insert(Timeline).from_select(
+            ["user_id", "publication_id", "created_at"],
+            select(literal(user_id), Publication.id, Publication.created_at)
+            .where(
+                or_(
+                    Publication.author_id == user_id,
+                    Publication.author_id.in_(regular_subscriptions),
+                )
+            )
+            .order_by(Publication.created_at.desc(), Publication.id.desc())
+            .limit(TIMELINE_MAX_LENGTH),
+        )
+    )
+
+
+async def rebuild_timelines(
+    session: AsyncSession,
+    batch_size: int = 1000,
+) -> int:
+    """Перестраивает ленты всех пользователей (например, при переходе в
+    режим fanout на существующих данных), фиксируя изменения пачками по
+    batch_size пользователей. Признак популярности авторов предварительно
+    пересчитывается по FANOUT_MAX_FOLLOWERS. Возвращает количество
+    пользователей"""
+    await session.execute(
+        update(User)
+        .values(is_popular=User.followers_count > FANOUT_MAX_FOLLOWERS)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    rebuilt = 0
+    last_id = 0
+    while True:
+        user_ids = list(
+            await session.scalars(
+                select(User.id)
+                .where(User.id > last_id)
+                .order_by(User.id)
+                .limit(batch_size)
+            )
+        )
+        if not user_ids:
+            return rebuilt
+        for user_id in user_ids:
+            await rebuild_timeline(session, user_id)
+        await session.commit()
+        rebuilt += len(user_ids)
+        last_id = user_ids[-1]
+
+
+async def main(argv) -> int:
+    """python -m app.timeline rebuild - перестроить все ленты,
+    python -m app.timeline trim - обрезать ленты длиннее
+    TIMELINE_MAX_LENGTH, python -m app.timeline demote - перевести в
+    обычные авторов, у которых стало меньше FANOUT_DEMOTE_FOLLOWERS
+    подписчиков (две последние запускаются периодически)"""
+    if argv not in (["rebuild"], ["trim"], ["demote"]):
+        print(
+            "Usage: python -m app.timeline rebuild|trim|demote",
+            file=sys.stderr,
+        )
+        return 2
+    async with async_session() as session:
+        if argv[0] == "rebuild":
+            print(f"Rebuilt timelines: {await rebuild_timelines(session)}")
+        elif argv[0] == "trim":
+            print(f"Trimmed timelines: {await trim_timelines(session)}")
+        else:
+            print(f"Demoted authors: {await demote_authors(session)}")
+    await engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,95 @@
+"""Сравнение затрат CPU на сериализацию ленты: прежний путь через модели
+pydantic и повторную проверку response_model с кодированием через
+jsonable_encoder и json, и прямая сериализация словарей через orjson.
+
+Запуск: python -m benchmarks.feed_serialization
+"""
+import json
+import time
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from app.schemas import GetAllTweetsOut, TweetInfo
+
+FEED_SIZES = (50, 500, 5000)
+LIKES_PER_TWEET = 5
+ATTACHMENTS_PER_TWEET = 2
+
+
+def make_tweets(count: int) -> list:
+    """Словари публикаций в том виде, в каком их собирает get_all_tweets"""
+    return [
+        {
+            "id": tweet_id,
+            "content": f"Publication {tweet_id} " * 5,
+            "attachments": [
+                f"images/ab/cd/{tweet_id}{n}.jpg"
+                for n in range(ATTACHMENTS_PER_TWEET)
+            ],
+            "attachment_variants": [
+                {"320": f"images/ab/cd/{tweet_id}{n}_w320.webp"}
+                for n in range(ATTACHMENTS_PER_TWEET)
+            ],
+            "author": {"id": tweet_id % 100, "name": f"user{tweet_id % 100}"},
+            "likes_count": LIKES_PER_TWEET,
+            "likes": [
+                {"user_id": user_id, "name": f"user{user_id}"}
+                for user_id in range(LIKES_PER_TWEET)
+            ],
+        }
+        for tweet_id in range(count)
+    ]
+
+
+response_adapter = TypeAdapter(GetAllTweetsOut)
+
+
+def serialize_before(tweets: list) -> bytes:
+    """Модели на каждую публикацию, затем проверка response_model и
+    стандартный JSONResponse, как FastAPI делал для ленты раньше"""
+    feed = GetAllTweetsOut(
+        result=True,
+        tweets=[TweetInfo(**tweet) for tweet in tweets],
+        next_cursor=None,
+    )
+    validated = response_adapter.validate_python(feed.model_dump())
+    return json.dumps(
+        jsonable_encoder(validated),
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+def serialize_after(tweets: list) -> bytes:
+    return orjson.dumps(
+        {"result": True, "tweets": tweets, "next_cursor": None}
+    )
+
+
+def cpu_per_call(func, tweets: list, repeat: int) -> float:
+    """Среднее процессорное время одного вызова в миллисекундах"""
+    func(tweets)
+    started = time.process_time()
+    for _ in range(repeat):
+        func(tweets)
+    return (time.process_time() - started) / repeat * 1000
+
+
+def main():
+    print(f"{'tweets':>7} {'before, ms':>11} {'after, ms':>10} {'speedup':>8}")
+    for size in FEED_SIZES:
+        tweets = make_tweets(size)
+        assert json.loads(serialize_before(tweets)) == json.loads(
+            serialize_after(tweets)
+        )
+        repeat = max(3, 20000 // size)
+        before = cpu_per_call(serialize_before, tweets, repeat)
+        after = cpu_per_call(serialize_after, tweets, repeat)
+        speedup = before / after
+        print(f"{size:>7} {before:>11.3f} {after:>10.3f} {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
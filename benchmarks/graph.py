@@ -0,0 +1,223 @@
+"""Генератор синтетической социальной сети для нагрузочных тестов.
+
+Популярность пользователей распределена по степенному закону (закон Ципфа
+с показателем alpha): пользователь с индексом 0 - самый популярный
+("знаменитость"), на пользователя с индексом i подписываются с весом
+1 / (i + 1) ** alpha. Число подписок, публикаций и лайков у каждого
+пользователя случайное с заданным средним, публикации популярных авторов
+получают больше лайков. При одинаковых параметрах и seed генерируется
+одна и та же сеть.
+"""
+import datetime
+import random
+from collections import defaultdict
+from itertools import accumulate
+from typing import List, NamedTuple, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import search, timeline
+from app.auth import create_api_key
+from app.counters import reconcile_counters
+from db.models import Attachments, Followers, Like, Publication, User
+
+INSERT_BATCH = 1000
+
+
+class GraphConfig(NamedTuple):
+    users: int = 1000
+    follows_per_user: float = 20
+    tweets_per_user: float = 5
+    likes_per_tweet: float = 3
+    attachment_share: float = 0.2
+    alpha: float = 1.1
+    days: int = 30
+    seed: int = 1
+
+
+class SocialGraph(NamedTuple):
+    """Сеть в индексах пользователей и публикаций (не id базы)"""
+
+    config: GraphConfig
+    # (индекс автора, индекс подписчика)
+    follows: List[Tuple[int, int]]
+    # (индекс автора, текст, время публикации) от старых к новым
+    tweets: List[Tuple[int, str, datetime.datetime]]
+    # (индекс публикации, индекс пользователя)
+    likes: List[Tuple[int, int]]
+    # (индекс публикации, ссылка)
+    attachments: List[Tuple[int, str]]
+
+
+def _random_count(rng: random.Random, mean: float, limit: int) -> int:
+    """Случайное неотрицательное число с заданным средним (экспоненциальное
+    распределение, то есть с длинным хвостом)"""
+    if mean <= 0:
+        return 0
+    return min(limit, int(rng.expovariate(1 / mean) + 0.5))
+
+
+def _weighted_sample(rng, cum_weights, count: int, exclude: int) -> set:
+    """count разных индексов с вероятностью, пропорциональной весам"""
+    chosen: set = set()
+    population = range(len(cum_weights))
+    attempts = 0
+    while len(chosen) < count and attempts < 10:
+        for index in rng.choices(
+            population, cum_weights=cum_weights, k=count - len(chosen)
+        ):
+            if index != exclude:
+                chosen.add(index)
+        attempts += 1
+    return chosen
+
+
+def generate(config: GraphConfig) -> SocialGraph:
+    rng = random.Random(config.seed)
+    users = config.users
+    weights = [1 / (index + 1) ** config.alpha for index in range(users)]
+    cum_weights = list(accumulate(weights))
+
+    follows = []
+    for follower in range(users):
+        count = _random_count(rng, config.follows_per_user, users - 1)
+        for author in sorted(
+            _weighted_sample(rng, cum_weights, count, exclude=follower)
+        ):
+            follows.append((author, follower))
+
+    now = datetime.datetime(2024, 1, 1)
+    period = config.days * 24 * 3600
+    tweets = []
+    for author in range(users):
+        for _ in range(_random_count(rng, config.tweets_per_user, 10000)):
+            created_at = now - datetime.timedelta(
+                seconds=rng.randrange(period)
+            )
+            words = " ".join(
+                f"word{rng.randrange(1000)}" for _ in range(rng.randint(3, 20))
+            )
+            tweets.append(
+                (author, f"Tweet of user{author}: {words}", created_at)
+            )
+    tweets.sort(key=lambda tweet: tweet[2])
+
+    # лайков у публикации тем больше, чем больше подписчиков у автора
+    followers = defaultdict(int)
+    for author, _ in follows:
+        followers[author] += 1
+    mean_followers = len(follows) / users if users else 0
+    likes = []
+    attachments = []
+    for tweet_index, (author, _, _) in enumerate(tweets):
+        popularity = (followers[author] + 1) / (mean_followers + 1)
+        count = _random_count(
+            rng, config.likes_per_tweet * popularity, users
+        )
+        for user in rng.sample(range(users), count):
+            likes.append((tweet_index, user))
+        if rng.random() < config.attachment_share:
+            for number in range(rng.randint(1, 2)):
+                attachments.append(
+                    (tweet_index, f"images/bench/{tweet_index}_{number}.jpg")
+                )
+
+    return SocialGraph(config, follows, tweets, likes, attachments)
+
+
+async def _insert_returning_ids(session, model, rows: List[dict]) -> list:
+    ids = []
+    for start in range(0, len(rows), INSERT_BATCH):
+        result = await session.scalars(
+            insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows[start:start + INSERT_BATCH],
+        )
+        ids += result.all()
+    return ids
+
+
+async def _insert(session, model, rows: List[dict]) -> None:
+    for start in range(0, len(rows), INSERT_BATCH):
+        await session.execute(insert(model), rows[start:start + INSERT_BATCH])
+
+
+def api_key(user_index: int) -> str:
+    return f"bench-{user_index}"
+
+
+class LoadedGraph(NamedTuple):
+    """id в базе по индексам пользователей и публикаций сети"""
+
+    user_ids: List[int]
+    tweet_ids: List[int]
+
+
+async def load(session: AsyncSession, graph: SocialGraph) -> LoadedGraph:
+    """Записывает сеть в базу в обход API и возвращает id пользователей и
+    публикаций. Ключ API пользователя - api_key(индекс). После загрузки
+    пересчитываются счетчики, заполняются ленты режима fanout и поисковый
+    индекс"""
+    user_ids = await _insert_returning_ids(
+        session,
+        User,
+        [{"name": f"user{index}"} for index in range(graph.config.users)],
+    )
+    for index, user_id in enumerate(user_ids):
+        create_api_key(session, user_id, api_key(index))
+    await session.flush()
+
+    await _insert(
+        session,
+        Followers,
+        [
+            {"author_id": user_ids[author], "follower_id": user_ids[follower]}
+            for author, follower in graph.follows
+        ],
+    )
+    tweet_ids = await _insert_returning_ids(
+        session,
+        Publication,
+        [
+            {
+                "author_id": user_ids[author],
+                "content": content,
+                "created_at": created_at,
+            }
+            for author, content, created_at in graph.tweets
+        ],
+    )
+    await _insert(
+        session,
+        Like,
+        [
+            {
+                "publication_id": tweet_ids[tweet],
+                "author_id": user_ids[user],
+                "is_liked": True,
+            }
+            for tweet, user in graph.likes
+        ],
+    )
+    await _insert(
+        session,
+        Attachments,
+        [
+            {
+                "publication_id": tweet_ids[tweet],
+                "author_id": user_ids[graph.tweets[tweet][0]],
+                "link": link,
+                "mime": "image/jpeg",
+                "size": 0,
+            }
+            for tweet, link in graph.attachments
+        ],
+    )
+    await session.commit()
+    await reconcile_counters(session)
+
+    if timeline.is_fanout_enabled():
+        await timeline.rebuild_timelines(session)
+    await search.reindex_all(session)
+    await session.commit()
+    return LoadedGraph(user_ids, tweet_ids)
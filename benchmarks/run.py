@@ -0,0 +1,276 @@
+"""Нагрузочные сценарии API на синтетической социальной сети.
+
+Сеть генерируется benchmarks.graph и загружается в пустую базу, затем
+сценарии benchmarks.scenarios выполняются через httpx напрямую в
+приложение (ASGI, без сети). Для каждого сценария выводятся p50/p95/p99
+времени ответа и среднее число SQL-запросов на запрос. Результаты можно
+сохранить как базовые (--save) и сравнить с ними следующий запуск
+(--compare): при ухудшении больше чем на --threshold команда завершается
+с кодом 1.
+
+Запуск:
+    python -m benchmarks.run --users 2000 --save baseline.json
+    python -m benchmarks.run --users 2000 --compare baseline.json
+
+По умолчанию используется временная база SQLite, для PostgreSQL передается
+--database-url с пустой базой (таблицы создаются автоматически).
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app import response_cache as cache
+from app.dependencies import get_read_session
+from benchmarks.graph import GraphConfig, generate, load
+from benchmarks.scenarios import SCENARIOS, Context, Scenario
+from db.database import Base, StatementCounter, create_engine
+from db.database import get_async_session
+from main import app
+
+COMPARED_METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль отсортированного списка с линейной интерполяцией"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q
+    lower = math.floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (
+        position - lower
+    )
+
+
+async def run_scenario(
+    ctx: Context,
+    scenario: Scenario,
+    engine,
+    requests: int,
+    warmup: int,
+) -> dict:
+    """Выполняет requests запросов сценария в scenario.concurrency
+    параллельных потоков. Первые warmup запросов (прогрев кешей) в
+    результаты не входят"""
+    for _ in range(warmup):
+        await scenario.request(ctx)
+
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await scenario.request(ctx)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    with StatementCounter(engine) as statements:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(worker() for _ in range(scenario.concurrency))
+        )
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": scenario.concurrency,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_request": round(statements.count / requests, 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    database_url = args.database_url
+    if not database_url:
+        directory = tempfile.mkdtemp(prefix="microblog-bench-")
+        database_url = (
+            f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+    if database_url.startswith("sqlite"):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        engine = create_async_engine(
+            database_url, connect_args={"timeout": 30}
+        )
+    else:
+        engine = create_engine(database_url)
+    session_factory = async_sessionmaker(
+        engine, expire_on_commit=False, class_=AsyncSession
+    )
+
+    async def override_get_async_session():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = override_get_async_session
+    app.dependency_overrides[get_read_session] = override_get_async_session
+    if args.no_cache:
+        cache.response_cache = cache.DisabledBackend()
+
+    config = GraphConfig(
+        users=args.users,
+        follows_per_user=args.follows,
+        tweets_per_user=args.tweets,
+        likes_per_tweet=args.likes,
+        alpha=args.alpha,
+        seed=args.seed,
+    )
+    started = time.perf_counter()
+    graph = generate(config)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_factory() as session:
+        loaded = await load(session, graph)
+    print(
+        f"Loaded {config.users} users, {len(graph.follows)} follows, "
+        f"{len(graph.tweets)} tweets, {len(graph.likes)} likes "
+        f"in {time.perf_counter() - started:.1f}s",
+        file=sys.stderr,
+    )
+
+    results = {}
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        ctx = Context.create(client, graph, loaded, seed=args.seed)
+        for scenario in SCENARIOS:
+            if args.scenario and scenario.name not in args.scenario:
+                continue
+            results[scenario.name] = await run_scenario(
+                ctx,
+                scenario,
+                engine,
+                args.requests or scenario.requests,
+                args.warmup,
+            )
+    await engine.dispose()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": engine.dialect.name,
+            "response_cache": not args.no_cache,
+            "graph": config._asdict(),
+            "follows": len(graph.follows),
+            "tweets": len(graph.tweets),
+            "likes": len(graph.likes),
+        },
+        "scenarios": results,
+    }
+
+
+def print_results(report: dict) -> None:
+    print(
+        f"{'scenario':<18} {'requests':>8} {'errors':>6} {'rps':>8} "
+        f"{'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9} {'queries':>8}"
+    )
+    for name, result in report["scenarios"].items():
+        print(
+            f"{name:<18} {result['requests']:>8} {result['errors']:>6} "
+            f"{result['rps']:>8} {result['p50_ms']:>9.2f} "
+            f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+            f"{result['queries_per_request']:>8}"
+        )
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> List[str]:
+    """Печатает изменения относительно базовых результатов и возвращает
+    список ухудшений больше threshold (доля)"""
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for name, result in report["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if not old:
+            continue
+        changes = []
+        for metric in COMPARED_METRICS:
+            before, after = old[metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            changes.append(f"{metric} {before} -> {after} ({change:+.0%})")
+            if change > threshold:
+                regressions.append(f"{name}: {metric} {change:+.0%}")
+        print(f"  {name}: " + ", ".join(changes))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--database-url")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--follows", type=float, default=20)
+    parser.add_argument("--tweets", type=float, default=5)
+    parser.add_argument("--likes", type=float, default=3)
+    parser.add_argument("--alpha", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--requests", type=int, help="requests per scenario"
+    )
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=[scenario.name for scenario in SCENARIOS],
+    )
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--save", help="write results as JSON baseline")
+    parser.add_argument("--compare", help="JSON baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print_results(report)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(
+                report, json.load(baseline_file), args.threshold
+            )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+    if args.save:
+        with open(args.save, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Сценарии нагрузки: каждый сценарий - функция, выполняющая один запрос
+к API от имени случайного пользователя сгенерированной сети"""
+import itertools
+import random
+from typing import Awaitable, Callable, Iterator, NamedTuple
+
+from httpx import AsyncClient, Response
+
+from benchmarks.graph import LoadedGraph, SocialGraph, api_key
+
+CELEBRITY = 0
+
+
+class Context(NamedTuple):
+    client: AsyncClient
+    graph: SocialGraph
+    loaded: LoadedGraph
+    rng: random.Random
+    sequence: Iterator[int]
+    # последняя публикация самого популярного автора
+    celebrity_tweet: int
+
+    @classmethod
+    def create(cls, client, graph, loaded, seed: int = 1) -> "Context":
+        celebrity_tweet = loaded.tweet_ids[-1] if loaded.tweet_ids else 0
+        for index in range(len(graph.tweets) - 1, -1, -1):
+            if graph.tweets[index][0] == CELEBRITY:
+                celebrity_tweet = loaded.tweet_ids[index]
+                break
+        return cls(
+            client,
+            graph,
+            loaded,
+            random.Random(seed),
+            itertools.count(),
+            celebrity_tweet,
+        )
+
+    def random_user(self) -> int:
+        return self.rng.randrange(self.graph.config.users)
+
+    def next_user(self) -> int:
+        """Пользователи по очереди, чтобы действия не повторялись"""
+        return next(self.sequence) % self.graph.config.users
+
+
+class Scenario(NamedTuple):
+    name: str
+    request: Callable[[Context], Awaitable[Response]]
+    requests: int
+    concurrency: int
+
+
+def _headers(user_index: int) -> dict:
+    return {"api-key": api_key(user_index)}
+
+
+async def feed_read(ctx: Context) -> Response:
+    """Первая страница ленты случайного пользователя"""
+    return await ctx.client.get(
+        "/api/tweets",
+        params={"limit": 50},
+        headers=_headers(ctx.random_user()),
+    )
+
+
+async def post_tweet(ctx: Context) -> Response:
+    """Новая публикация случайного пользователя"""
+    user = ctx.random_user()
+    return await ctx.client.post(
+        "/api/tweets",
+        json={"tweet_data": f"Benchmark tweet of user{user}"},
+        headers=_headers(user),
+    )
+
+
+async def like_storm(ctx: Context) -> Response:
+    """Множество пользователей одновременно лайкают последнюю публикацию
+    самого популярного автора"""
+    return await ctx.client.post(
+        f"/api/tweets/{ctx.celebrity_tweet}/likes",
+        headers=_headers(ctx.next_user()),
+    )
+
+
+async def celebrity_profile(ctx: Context) -> Response:
+    """Профиль самого популярного автора с первой страницей подписчиков"""
+    return await ctx.client.get(
+        f"/api/users/{ctx.loaded.user_ids[CELEBRITY]}",
+        params={"limit": 50},
+        headers=_headers(ctx.random_user()),
+    )
+
+
+SCENARIOS = [
+    Scenario("feed_read", feed_read, requests=500, concurrency=10),
+    Scenario("post_tweet", post_tweet, requests=200, concurrency=10),
+    Scenario("like_storm", like_storm, requests=500, concurrency=50),
+    Scenario(
+        "celebrity_profile", celebrity_profile, requests=300, concurrency=10
+    ),
+]
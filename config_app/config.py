@@ -3,7 +3,139 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+
+def get_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
 DB_NAME = os.environ.get("DB_NAME")
 DB_USER = os.environ.get("DB_USER")
 DB_PASS = os.environ.get("DB_PASS")
+DB_HOST = os.environ.get("DB_HOST", "db")
+DB_PORT = int(os.environ.get("DB_PORT", 5432))
+
+DB_ECHO = get_bool("DB_ECHO", False)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = get_bool("DB_POOL_PRE_PING", True)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+# PgBouncer в режиме пула транзакций не поддерживает подготовленные выражения
+DB_PGBOUNCER = get_bool("DB_PGBOUNCER", False)
+DB_SCHEMA_CHECK = get_bool("DB_SCHEMA_CHECK", True)
+
+# Реплика для чтения, используется, только если задан DB_REPLICA_HOST
+DB_REPLICA_HOST = os.environ.get("DB_REPLICA_HOST")
+DB_REPLICA_PORT = int(os.environ.get("DB_REPLICA_PORT", DB_PORT))
+DB_REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", 5))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(
+    os.environ.get("DB_REPLICA_LAG_CHECK_INTERVAL", 1)
+)
+READ_YOUR_WRITES_WINDOW = float(os.environ.get("READ_YOUR_WRITES_WINDOW", 5))
+
+# Кеш ответов ленты и профилей: memory (в памяти процесса), redis или none
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+RESPONSE_CACHE_REDIS_URL = os.environ.get(
+    "RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0"
+)
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 10000))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 10))
+
+# Поток событий ленты (SSE): memory - события доходят только до клиентов
+# того же процесса, redis - рассылаются всем процессам через pub/sub
+EVENTS_BROKER = os.environ.get("EVENTS_BROKER", "memory")
+EVENTS_REDIS_URL = os.environ.get("EVENTS_REDIS_URL", RESPONSE_CACHE_REDIS_URL)
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+EVENTS_HEARTBEAT = float(os.environ.get("EVENTS_HEARTBEAT", 15))
+
+
+FEED_PAGE_SIZE = int(os.environ.get("FEED_PAGE_SIZE", 50))
+FEED_MAX_PAGE_SIZE = int(os.environ.get("FEED_MAX_PAGE_SIZE", 200))
+# Максимальное число действий в одном пакетном запросе
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+
+TIMELINE_MODE = os.environ.get("TIMELINE_MODE", "pull")
+TIMELINE_MAX_LENGTH = int(os.environ.get("TIMELINE_MAX_LENGTH", 800))
+FANOUT_MAX_FOLLOWERS = int(os.environ.get("FANOUT_MAX_FOLLOWERS", 5000))
+# Популярный автор снова становится обычным (его публикации рассылаются),
+# когда подписчиков становится меньше этого порога. Разрыв с
+# FANOUT_MAX_FOLLOWERS не дает автору у границы переключаться туда и
+# обратно на каждой подписке и отписке
+FANOUT_DEMOTE_FOLLOWERS = int(
+    os.environ.get("FANOUT_DEMOTE_FOLLOWERS", 4000)
+)
+
+MEDIA_MAX_SIZE = int(os.environ.get("MEDIA_MAX_SIZE", 20 * 1024 * 1024))
+MEDIA_CHUNK_SIZE = int(os.environ.get("MEDIA_CHUNK_SIZE", 1024 * 1024))
+MEDIA_ALLOWED_TYPES = os.environ.get(
+    "MEDIA_ALLOWED_TYPES",
+    "image/jpeg,image/png,image/gif,image/webp,video/mp4",
+).split(",")
+MEDIA_GC_GRACE_PERIOD = int(os.environ.get("MEDIA_GC_GRACE_PERIOD", 3600))
+# В production статику и файлы отдает nginx: SERVE_STATIC=false отключает
+# раздачу каталога static приложением, при MEDIA_ACCEL_REDIRECT=true файлы,
+# доступ к которым проверяет приложение, отдаются через X-Accel-Redirect
+# во внутренний location nginx с префиксом MEDIA_ACCEL_PREFIX
+SERVE_STATIC = get_bool("SERVE_STATIC", True)
+MEDIA_ACCEL_REDIRECT = get_bool("MEDIA_ACCEL_REDIRECT", False)
+MEDIA_ACCEL_PREFIX = os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-media/")
+MEDIA_VARIANT_WIDTHS = [
+    int(width)
+    for width in os.environ.get(
+        "MEDIA_VARIANT_WIDTHS", "320,640,1280"
+    ).split(",")
+]
+MEDIA_VARIANT_FORMAT = os.environ.get("MEDIA_VARIANT_FORMAT", "webp")
+MEDIA_VARIANT_TYPES = os.environ.get(
+    "MEDIA_VARIANT_TYPES", "image/jpeg,image/png,image/webp"
+).split(",")
+MEDIA_VARIANT_WORKERS = int(os.environ.get("MEDIA_VARIANT_WORKERS", 2))
+
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", 10000))
+# Кеш ключей у каждого процесса свой: отозванный ключ действует в других
+# воркерах до истечения API_KEY_CACHE_TTL секунд, поэтому время короткое
+API_KEY_CACHE_TTL = float(os.environ.get("API_KEY_CACHE_TTL", 5))
+API_KEY_CACHE_NEGATIVE_TTL = float(
+    os.environ.get("API_KEY_CACHE_NEGATIVE_TTL", 10)
+)
+
+# Отложенная запись лайков: запросы подтверждаются после постановки в
+# очередь, фоновая задача записывает накопленные изменения пакетами
+LIKE_WRITE_BEHIND = get_bool("LIKE_WRITE_BEHIND", False)
+LIKE_QUEUE_SIZE = int(os.environ.get("LIKE_QUEUE_SIZE", 10000))
+LIKE_FLUSH_INTERVAL = float(os.environ.get("LIKE_FLUSH_INTERVAL", 0.5))
+LIKE_FLUSH_BATCH = int(os.environ.get("LIKE_FLUSH_BATCH", 500))
+LIKE_ENQUEUE_TIMEOUT = float(os.environ.get("LIKE_ENQUEUE_TIMEOUT", 1))
+# Сколько секунд при остановке воркера повторяется запись оставшихся
+# лайков, если база недоступна (должно быть меньше SERVER_GRACEFUL_TIMEOUT)
+LIKE_STOP_TIMEOUT = float(os.environ.get("LIKE_STOP_TIMEOUT", 10))
+
+# Сколько секунд хранится ответ на запрос с заголовком Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.environ.get("IDEMPOTENCY_KEY_TTL", 86400))
+
+# Профили запросов дольше PROFILE_SLOW_REQUEST секунд (0 - профилировщик
+# выключен) сохраняются в PROFILE_DIR, выборки снимаются раз в
+# PROFILE_INTERVAL секунд
+PROFILE_SLOW_REQUEST = float(os.environ.get("PROFILE_SLOW_REQUEST", 0))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
 
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+SERVER_KEEPALIVE = int(os.environ.get("SERVER_KEEPALIVE", 5))
+SERVER_BACKLOG = int(os.environ.get("SERVER_BACKLOG", 2048))
+SERVER_MAX_REQUESTS = int(os.environ.get("SERVER_MAX_REQUESTS", 10000))
+SERVER_MAX_REQUESTS_JITTER = int(
+    os.environ.get("SERVER_MAX_REQUESTS_JITTER", 1000)
+)
+SERVER_TIMEOUT = int(os.environ.get("SERVER_TIMEOUT", 60))
+SERVER_GRACEFUL_TIMEOUT = int(os.environ.get("SERVER_GRACEFUL_TIMEOUT", 30))
+# auto выбирает uvloop и httptools, если они установлены
+SERVER_LOOP = os.environ.get("SERVER_LOOP", "auto")
+SERVER_HTTP = os.environ.get("SERVER_HTTP", "auto")
+SERVER_RELOAD = get_bool("SERVER_RELOAD", False)
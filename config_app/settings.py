@@ -1,14 +1,98 @@
 import os
 from app.schemas import ErrorResponses
-from config_app.config import DB_NAME, DB_PASS, DB_USER
+from config_app.config import (  # isort:skip
+    API_KEY_CACHE_NEGATIVE_TTL,
+    API_KEY_CACHE_SIZE,
+    API_KEY_CACHE_TTL,
+    BATCH_MAX_ITEMS,
+    DB_ECHO,
+    DB_HOST,
+    DB_MAX_OVERFLOW,
+    DB_NAME,
+    DB_PASS,
+    DB_PGBOUNCER,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_PORT,
+    DB_REPLICA_HOST,
+    DB_REPLICA_LAG_CHECK_INTERVAL,
+    DB_REPLICA_MAX_LAG,
+    DB_REPLICA_PORT,
+    DB_SCHEMA_CHECK,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_USER,
+    EVENTS_BROKER,
+    EVENTS_HEARTBEAT,
+    EVENTS_QUEUE_SIZE,
+    EVENTS_REDIS_URL,
+    FANOUT_DEMOTE_FOLLOWERS,
+    FANOUT_MAX_FOLLOWERS,
+    FEED_MAX_PAGE_SIZE,
+    FEED_PAGE_SIZE,
+    IDEMPOTENCY_KEY_TTL,
+    LIKE_ENQUEUE_TIMEOUT,
+    LIKE_FLUSH_BATCH,
+    LIKE_FLUSH_INTERVAL,
+    LIKE_QUEUE_SIZE,
+    LIKE_STOP_TIMEOUT,
+    LIKE_WRITE_BEHIND,
+    MEDIA_ACCEL_PREFIX,
+    MEDIA_ACCEL_REDIRECT,
+    MEDIA_ALLOWED_TYPES,
+    MEDIA_CHUNK_SIZE,
+    MEDIA_GC_GRACE_PERIOD,
+    MEDIA_MAX_SIZE,
+    MEDIA_VARIANT_FORMAT,
+    MEDIA_VARIANT_TYPES,
+    MEDIA_VARIANT_WIDTHS,
+    MEDIA_VARIANT_WORKERS,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_SLOW_REQUEST,
+    READ_YOUR_WRITES_WINDOW,
+    RESPONSE_CACHE_BACKEND,
+    RESPONSE_CACHE_REDIS_URL,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    SERVER_HOST,
+    SERVER_HTTP,
+    SERVER_KEEPALIVE,
+    SERVER_LOOP,
+    SERVER_PORT,
+    SERVER_RELOAD,
+    SERVER_WORKERS,
+    SERVE_STATIC,
+    TIMELINE_MAX_LENGTH,
+    TIMELINE_MODE,
+)
 
 STATIC_PATH = os.path.join(os.getcwd(), "static")
 
-# DATABASE_URL = "sqlite+aiosqlite:///./app.db"
+ALEMBIC_CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "alembic.ini",
+)
 
-DATABASE_URL_POSTGRES = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@db/{DB_NAME}"
+# DATABASE_URL = "sqlite+aiosqlite:///./app.db"
 
-ERROR_RESPONSES = {404: {"model": ErrorResponses}, 422: {"model": ErrorResponses}}
+DATABASE_URL_POSTGRES = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+)
+DATABASE_URL_REPLICA = (
+    f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@"
+    f"{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    if DB_REPLICA_HOST
+    else None
+)
 
-API_KEY = {"test": 1, "test2": 2, "test3": 3}
+ERROR_RESPONSES = {
+    404: {"model": ErrorResponses},
+    409: {"model": ErrorResponses},
+    413: {"model": ErrorResponses},
+    415: {"model": ErrorResponses},
+    422: {"model": ErrorResponses},
+    503: {"model": ErrorResponses},
+}
 
@@ -0,0 +1,44 @@
+import sys
+from typing import List, Optional
+
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn.workers import UvicornWorker
+
+from config_app.config import (  # isort:skip
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_HTTP,
+    SERVER_LOOP,
+)
+
+
+class GracefulServer(Server):
+    """Сервер uvicorn, который в начале остановки закрывает потоки событий
+    (SSE). Lifespan приложения завершается только после всех запросов, а
+    потоки сами не заканчиваются и держали бы воркер до
+    SERVER_GRACEFUL_TIMEOUT"""
+
+    async def shutdown(self, sockets: Optional[List] = None) -> None:
+        from app.events import broker
+
+        broker.close_streams()
+        await super().shutdown(sockets=sockets)
+
+
+class ProductionUvicornWorker(UvicornWorker):
+    """Воркер gunicorn с настраиваемыми циклом событий и HTTP парсером"""
+
+    CONFIG_KWARGS = {
+        "loop": SERVER_LOOP,
+        "http": SERVER_HTTP,
+        "timeout_graceful_shutdown": SERVER_GRACEFUL_TIMEOUT,
+    }
+
+    async def _serve(self) -> None:
+        # то же, что UvicornWorker._serve, но с GracefulServer
+        self.config.app = self.wsgi
+        server = GracefulServer(config=self.config)
+        self._install_sigquit_handler()
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
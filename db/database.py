@@ -3,21 +3,313 @@ from sqlalchemy.ext.asyncio import (  # isort:skip
     async_sessionmaker,
     create_async_engine,
 )
+import math
+import time
+import uuid
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 # flake8: noqa
-from config_app.settings import DATABASE_URL_POSTGRES
+from config_app.settings import (  # isort:skip
+    ALEMBIC_CONFIG,
+    DATABASE_URL_POSTGRES,
+    DATABASE_URL_REPLICA,
+    DB_ECHO,
+    DB_MAX_OVERFLOW,
+    DB_PGBOUNCER,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_REPLICA_LAG_CHECK_INTERVAL,
+    DB_REPLICA_MAX_LAG,
+    DB_STATEMENT_CACHE_SIZE,
+    READ_YOUR_WRITES_WINDOW,
+)
+from app.cache import TTLCache
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, учитывающий время ожидания свободного соединения и,
+    отдельно, время открытия новых соединений. Время открытия в ожидание не
+    входит: иначе медленное подключение к базе выглядело бы как нехватка
+    соединений в пуле"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.connects = 0
+        self.connect_time_total = 0.0
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        record = super()._create_connection()
+        connect_time = time.perf_counter() - started
+        self.connects += 1
+        self.connect_time_total += connect_time
+        # параллельные получения соединений чередуются в цикле событий,
+        # поэтому время открытия передается с самим соединением
+        record._connect_time = connect_time
+        return record
+
+    def _do_get(self):
+        started = time.perf_counter()
+        record = super()._do_get()
+        wait_time = time.perf_counter() - started - record.__dict__.pop(
+            "_connect_time", 0.0
+        )
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        return record
+
+
+def _prepared_statement_name() -> str:
+    return f"__asyncpg_{uuid.uuid4()}__"
+
+
+def get_connect_args() -> dict:
+    """Параметры подключения asyncpg.
+
+    В режиме DB_PGBOUNCER подготовленные выражения не кешируются и получают
+    уникальные имена, так как PgBouncer в режиме пула транзакций может
+    выполнить следующий запрос на другом соединении с сервером"""
+    if DB_PGBOUNCER:
+        return {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": _prepared_statement_name,
+        }
+    return {
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+    }
+
+
+def create_engine(url=DATABASE_URL_POSTGRES):
+    """Создает движок с настройками пула из переменных окружения"""
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=get_connect_args(),
+    )
 
-engine = create_async_engine(DATABASE_URL_POSTGRES, echo=True)
+
+def get_pool_stats(async_engine) -> dict:
+    """Состояние пула соединений: занятые соединения, насыщенность
+    (доля занятых от максимально возможного числа), время ожидания и
+    открытия соединений"""
+    pool = async_engine.sync_engine.pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checked_in": pool.checkedin(),
+    }
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    stats["saturation"] = pool.checkedout() / capacity if capacity else 0.0
+    if isinstance(pool, InstrumentedQueuePool):
+        stats["checkouts"] = pool.checkouts
+        stats["wait_time_total"] = pool.wait_time_total
+        stats["wait_time_max"] = pool.wait_time_max
+        stats["connects"] = pool.connects
+        stats["connect_time_total"] = pool.connect_time_total
+    return stats
+
+
+engine = create_engine()
 async_session = async_sessionmaker(
     engine,
     expire_on_commit=False,
     class_=AsyncSession,
 )
 
+# Необязательная реплика для чтения, без нее чтение идет с основной базы
+replica_engine = (
+    create_engine(DATABASE_URL_REPLICA) if DATABASE_URL_REPLICA else None
+)
+async_read_session = async_sessionmaker(
+    replica_engine or engine,
+    expire_on_commit=False,
+    class_=AsyncSession,
+)
+
 Base = declarative_base()
 
 
+def init_engine():
+    """Создает собственные движки для текущего процесса воркера.
+    Движки, созданные при импорте (например, в главном процессе gunicorn),
+    закрываются без закрытия унаследованных соединений"""
+    global engine, replica_engine
+    engine.sync_engine.dispose(close=False)
+    engine = create_engine()
+    async_session.configure(bind=engine)
+    if replica_engine is not None:
+        replica_engine.sync_engine.dispose(close=False)
+        replica_engine = create_engine(DATABASE_URL_REPLICA)
+    async_read_session.configure(bind=replica_engine or engine)
+    return engine
+
+
+async def dispose_engine():
+    """Закрывает соединения пулов при остановке воркера"""
+    await engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+
+
+# Пользователи, недавно выполнявшие запись, читают с основной базы, чтобы
+# сразу видеть свои изменения. Учет в памяти процесса действует только в
+# пределах одного воркера, между воркерами время записи передается в cookie
+# (см. app.dependencies)
+recent_writers = TTLCache(maxsize=100000, ttl=READ_YOUR_WRITES_WINDOW)
+
+
+def mark_write(user_id: int) -> None:
+    """Отмечает запись пользователя, открывая окно read-your-writes"""
+    recent_writers.set(user_id, True)
+
+
+async def measure_replica_lag(async_engine) -> float:
+    """Отставание реплики PostgreSQL в секундах. Если реплика применила
+    все полученные изменения, отставание считается нулевым. Для других
+    СУБД (например, SQLite в тестах) отставание не измеряется"""
+    if async_engine.dialect.name != "postgresql":
+        return 0.0
+    async with async_engine.connect() as conn:
+        lag = await conn.scalar(
+            text(
+                "SELECT CASE "
+                "WHEN NOT pg_is_in_recovery() THEN 0 "
+                "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                "THEN 0 "
+                "ELSE COALESCE(EXTRACT(EPOCH FROM "
+                "now() - pg_last_xact_replay_timestamp()), 0) END"
+            )
+        )
+    return float(lag)
+
+
+class ReplicaLagMonitor:
+    """Периодически проверяет отставание реплики, результат проверки
+    кешируется на check_interval секунд. Недоступная реплика считается
+    отставшей"""
+
+    def __init__(self, max_lag: float, check_interval: float):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = 0.0
+        self.checked_at = -math.inf
+
+    async def is_fresh(self, async_engine) -> bool:
+        now = time.monotonic()
+        if now - self.checked_at >= self.check_interval:
+            self.checked_at = now
+            try:
+                self.lag = await measure_replica_lag(async_engine)
+            except Exception:
+                self.lag = math.inf
+        return self.lag <= self.max_lag
+
+
+replica_monitor = ReplicaLagMonitor(
+    max_lag=DB_REPLICA_MAX_LAG,
+    check_interval=DB_REPLICA_LAG_CHECK_INTERVAL,
+)
+
+
+async def choose_read_sessionmaker(
+    user_id: int,
+    wrote_recently: bool = False,
+) -> async_sessionmaker:
+    """Выбирает базу для чтения: реплику, если она настроена и не отстает,
+    а пользователь недавно ничего не записывал (wrote_recently - запись,
+    известная по запросу, а не по учету процесса), иначе основную базу"""
+    if replica_engine is None:
+        return async_session
+    if wrote_recently or recent_writers.get(user_id)[0]:
+        return async_session
+    if not await replica_monitor.is_fresh(replica_engine):
+        return async_session
+    return async_read_session
+
+
+class SchemaVersionError(RuntimeError):
+    """Схема базы данных не совпадает с последней миграцией"""
+
+
+async def check_schema_version(async_engine) -> None:
+    """Сверяет версию схемы базы данных с последней миграцией alembic.
+    Сами миграции при запуске не выполняются, их нужно применить заранее
+    командой alembic upgrade head"""
+    script = ScriptDirectory.from_config(Config(ALEMBIC_CONFIG))
+    heads = set(script.get_heads())
+    async with async_engine.connect() as conn:
+        current = await conn.run_sync(
+            lambda sync_conn: set(
+                MigrationContext.configure(sync_conn).get_current_heads()
+            )
+        )
+    if current != heads:
+        raise SchemaVersionError(
+            f"Database schema version {sorted(current)} does not match "
+            f"migrations head {sorted(heads)}, run 'alembic upgrade head'"
+        )
+
+
+def dialect_insert(session: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для СУБД, к которой привязана
+    сессия (PostgreSQL или SQLite в тестах)"""
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
 async def get_async_session():
     async with async_session() as session:
         yield session
+
+
+class StatementCounter:
+    """Считает SQL-запросы, выполненные движком внутри блока with.
+    Если задан max_statements, при выходе из блока проверяет, что лимит
+    не превышен (используется в тестах для контроля N+1 запросов)"""
+
+    def __init__(self, async_engine, max_statements=None):
+        self.engine = async_engine.sync_engine
+        self.max_statements = max_statements
+        self.statements = []
+
+    def _on_execute(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+        if exc_type is None and self.max_statements is not None:
+            assert self.count <= self.max_statements, (
+                f"Expected at most {self.max_statements} SQL statements, "
+                f"got {self.count}:\n" + "\n".join(self.statements)
+            )
@@ -1,4 +1,18 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+import datetime
+
+from sqlalchemy import (  # isort:skip
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    JSON,
+    Integer,
+    String,
+    false,
+    func,
+)
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import relationship
 
 from db.database import Base
@@ -8,29 +22,42 @@ class User(Base):
     __tablename__ = "user"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
+    followers_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    following_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+    # публикации популярных авторов не рассылаются в ленты, см. app.timeline
+    is_popular = Column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
 
     tweet = relationship(
         "Publication",
         back_populates="author",
         cascade="all, delete",
-        lazy="selectin",
+        lazy="raise_on_sql",
     )
     follower = relationship(
         "Followers",
         foreign_keys="Followers.author_id",
         back_populates="author",
         cascade="all, delete",
-        lazy="selectin",
+        lazy="raise_on_sql",
     )
     following = relationship(
         "Followers",
         foreign_keys="Followers.follower_id",
         back_populates="follower_author",
         cascade="all, delete",
-        lazy="selectin",
+        lazy="raise_on_sql",
     )
     like = relationship(
-        "Like", back_populates="author", cascade="all, delete", lazy="selectin"
+        "Like",
+        back_populates="author",
+        cascade="all, delete",
+        lazy="raise_on_sql",
     )
 
     def to_dict(self):
@@ -44,19 +71,34 @@ class Publication(Base):
     __tablename__ = "publication"
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String, nullable=False)
-    author_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"))
+    author_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), index=True
+    )
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        server_default=func.now(),
+    )
+    likes_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
+
+    __table_args__ = (
+        Index("ix_publication_created_at_id", "created_at", "id"),
+    )
 
-    author = relationship("User", back_populates="tweet", lazy="selectin")
+    author = relationship("User", back_populates="tweet", lazy="raise_on_sql")
     like = relationship(
         "Like",
         back_populates="tweet",
-        lazy="selectin",
+        lazy="raise_on_sql",
         cascade="all, delete",
     )
     attachment = relationship(
         "Attachments",
         back_populates="tweet",
-        lazy="selectin",
+        lazy="raise_on_sql",
         cascade="all, delete",
     )
 
@@ -74,20 +116,23 @@ class Followers(Base):
         Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
     )
     follower_id = Column(
-        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+        Integer,
+        ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
     )
 
     author = relationship(
         "User",
         foreign_keys="Followers.author_id",
         back_populates="follower",
-        lazy="selectin",
+        lazy="raise_on_sql",
     )
     follower_author = relationship(
         "User",
         foreign_keys="Followers.follower_id",
-        back_populates="",
-        lazy="selectin",
+        back_populates="following",
+        lazy="raise_on_sql",
     )
 
     def to_dict(self):
@@ -105,12 +150,17 @@ class Like(Base):
         primary_key=True,
     )
     author_id = Column(
-        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+        Integer,
+        ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
     )
     is_liked = Column(Boolean, default=False)
 
-    tweet = relationship("Publication", back_populates="like", lazy="selectin")
-    author = relationship("User", back_populates="like", lazy="selectin")
+    tweet = relationship(
+        "Publication", back_populates="like", lazy="raise_on_sql"
+    )
+    author = relationship("User", back_populates="like", lazy="raise_on_sql")
 
     def to_dict(self):
         return {
@@ -127,11 +177,144 @@ class Attachments(Base):
         Integer,
         ForeignKey("publication.id", ondelete="CASCADE"),
         nullable=True,
+        index=True,
+    )
+    author_id = Column(
+        Integer,
+        ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=True,
     )
     link = Column(String)
+    hash = Column(String(64), index=True)
+    size = Column(Integer)
+    mime = Column(String)
+    variants = Column(JSON, nullable=True)
 
     tweet = relationship(
         "Publication",
         back_populates="attachment",
-        lazy="selectin",
+        lazy="raise_on_sql",
+    )
+
+
+class Timeline(Base):
+    __tablename__ = "timeline"
+    user_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    publication_id = Column(
+        Integer,
+        ForeignKey("publication.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
     )
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_timeline_user_id_created_at",
+            "user_id",
+            "created_at",
+            "publication_id",
+        ),
+    )
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "publication_id": self.publication_id,
+            "created_at": self.created_at,
+        }
+
+
+class ApiKey(Base):
+    __tablename__ = "api_key"
+    key_hash = Column(String(64), primary_key=True)
+    user_id = Column(
+        Integer,
+        ForeignKey("user.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        server_default=func.now(),
+    )
+    revoked_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "created_at": self.created_at,
+            "revoked_at": self.revoked_at,
+        }
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_key"
+    user_id = Column(
+        Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True
+    )
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response = Column(JSON, nullable=False)
+    created_at = Column(
+        DateTime,
+        nullable=False,
+        default=datetime.datetime.utcnow,
+        server_default=func.now(),
+        index=True,
+    )
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "key": self.key,
+            "created_at": self.created_at,
+        }
+
+
+# Полнотекстовый индекс публикаций устроен в разных СУБД по-разному, поэтому
+# создается отдельным DDL, а не моделью: в PostgreSQL это таблица с колонкой
+# tsvector и GIN-индексом, в SQLite (тесты) - виртуальная таблица FTS5
+SEARCH_TABLE = "publication_search"
+SEARCH_TS_CONFIG = "simple"
+
+SEARCH_DDL_POSTGRESQL = (
+    f"CREATE TABLE {SEARCH_TABLE} ("
+    "publication_id INTEGER PRIMARY KEY "
+    "REFERENCES publication (id) ON DELETE CASCADE, "
+    "document TSVECTOR NOT NULL)",
+    f"CREATE INDEX ix_{SEARCH_TABLE}_document "
+    f"ON {SEARCH_TABLE} USING GIN (document)",
+)
+SEARCH_DDL_SQLITE = (
+    f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(content)",
+)
+
+for statement in SEARCH_DDL_POSTGRESQL:
+    event.listen(
+        Publication.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+for statement in SEARCH_DDL_SQLITE:
+    event.listen(
+        Publication.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+event.listen(
+    Publication.__table__,
+    "before_drop",
+    DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"),
+)
+
+
+def include_name(name, type_, parent_names) -> bool:
+    """Фильтр объектов для сравнения схемы в alembic: таблицы
+    полнотекстового индекса (и служебные таблицы FTS5) не описаны
+    моделями"""
+    return not (type_ == "table" and name.startswith(SEARCH_TABLE))
@@ -0,0 +1,30 @@
+# Запуск в production:
+#   gunicorn -c gunicorn.conf.py main:app
+from config_app.config import (  # isort:skip
+    SERVER_BACKLOG,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_HOST,
+    SERVER_KEEPALIVE,
+    SERVER_MAX_REQUESTS,
+    SERVER_MAX_REQUESTS_JITTER,
+    SERVER_PORT,
+    SERVER_TIMEOUT,
+    SERVER_WORKERS,
+)
+
+bind = f"{SERVER_HOST}:{SERVER_PORT}"
+workers = SERVER_WORKERS
+worker_class = "config_app.workers.ProductionUvicornWorker"
+keepalive = SERVER_KEEPALIVE
+backlog = SERVER_BACKLOG
+# воркеры периодически перезапускаются, чтобы ограничить рост памяти
+max_requests = SERVER_MAX_REQUESTS
+max_requests_jitter = SERVER_MAX_REQUESTS_JITTER
+timeout = SERVER_TIMEOUT
+# время на завершение обрабатываемых запросов после SIGTERM
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+# приложение загружается в каждом воркере отдельно, чтобы соединения с
+# базой данных не наследовались от главного процесса
+preload_app = False
+accesslog = "-"
+errorlog = "-"
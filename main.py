@@ -4,23 +4,53 @@ import uvicorn  # type: ignore
 from fastapi import FastAPI
 from fastapi.exceptions import HTTPException, RequestValidationError
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
-from db.database import Base, async_session, engine
+from db import database
+from db.database import get_pool_stats
+from app import metrics
+from app.events import broker
+from app.like_queue import like_queue
+from app.response_cache import response_cache
 from app.routers import router
+from app.thumbnails import shutdown_executor
+
+from config_app.settings import (  # isort:skip
+    DB_SCHEMA_CHECK,
+    LIKE_WRITE_BEHIND,
+    SERVER_HOST,
+    SERVER_HTTP,
+    SERVER_KEEPALIVE,
+    SERVER_LOOP,
+    SERVER_PORT,
+    SERVER_RELOAD,
+    SERVER_WORKERS,
+    SERVE_STATIC,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    engine = database.init_engine()
+    if DB_SCHEMA_CHECK:
+        await database.check_schema_version(engine)
+    if LIKE_WRITE_BEHIND:
+        like_queue.start(database.async_session)
+    await broker.start()
     yield
-    await async_session.close()  # type: ignore
-    await engine.dispose()
+    # сервер вызывает завершение lifespan после обработки начатых запросов
+    await like_queue.stop()
+    await broker.close()
+    if metrics.profiler is not None:
+        metrics.profiler.stop()
+    shutdown_executor()
+    await response_cache.close()
+    await database.dispose_engine()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.exception_handler(RequestValidationError)
@@ -50,9 +80,51 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     )
 
 
+@app.get("/health/db")
+async def database_health():
+    """Состояние пула соединений с базой данных и, если она настроена,
+    пула реплики вместе с ее отставанием"""
+    stats = get_pool_stats(database.engine)
+    if database.replica_engine is not None:
+        stats["replica"] = get_pool_stats(database.replica_engine)
+        stats["replica"]["lag"] = database.replica_monitor.lag
+    return stats
+
+
+def _database_engines() -> dict:
+    engines = {"primary": database.engine}
+    if database.replica_engine is not None:
+        engines["replica"] = database.replica_engine
+    return engines
+
+
+metrics.registry.add_collector(metrics.pool_collector(_database_engines))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Метрики процесса в текстовом формате Prometheus: время ответа и
+    число SQL-запросов по маршрутам, пулы соединений, загрузки файлов"""
+    return PlainTextResponse(
+        metrics.registry.render(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 app.include_router(router)
-app.mount("/", StaticFiles(directory="static", html=True))
+if SERVE_STATIC:
+    # в production (SERVE_STATIC=false) каталог static раздает nginx
+    app.mount("/", StaticFiles(directory="static", html=True))
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    uvicorn.run(
+        "main:app",
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=None if SERVER_RELOAD else SERVER_WORKERS,
+        reload=SERVER_RELOAD,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+    )
@@ -0,0 +1,92 @@
+"""baseline schema
+
+Схема, которую приложение создавало через create_all до перехода на
+миграции. Для существующей базы выполните `alembic stamp 0001`, затем
+`alembic upgrade head`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 12:00:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_user_id", "user", ["id"])
+    op.create_index("ix_user_name", "user", ["name"])
+
+    op.create_table(
+        "publication",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("content", sa.String(), nullable=False),
+        sa.Column("author_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["author_id"], ["user.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_publication_id", "publication", ["id"])
+
+    op.create_table(
+        "followers",
+        sa.Column("author_id", sa.Integer(), nullable=False),
+        sa.Column("follower_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["author_id"], ["user.id"], ondelete="CASCADE"
+        ),
+        sa.ForeignKeyConstraint(
+            ["follower_id"], ["user.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("author_id", "follower_id"),
+    )
+
+    op.create_table(
+        "like",
+        sa.Column("publication_id", sa.Integer(), nullable=False),
+        sa.Column("author_id", sa.Integer(), nullable=False),
+        sa.Column("is_liked", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["author_id"], ["user.id"], ondelete="CASCADE"
+        ),
+        sa.ForeignKeyConstraint(
+            ["publication_id"], ["publication.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("publication_id", "author_id"),
+    )
+
+    op.create_table(
+        "attachments",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("publication_id", sa.Integer(), nullable=True),
+        sa.Column("link", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["publication_id"], ["publication.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("attachments")
+    op.drop_table("like")
+    op.drop_table("followers")
+    op.drop_index("ix_publication_id", table_name="publication")
+    op.drop_table("publication")
+    op.drop_index("ix_user_name", table_name="user")
+    op.drop_index("ix_user_id", table_name="user")
+    op.drop_table("user")
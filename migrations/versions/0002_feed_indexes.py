@@ -0,0 +1,52 @@
+"""publication created_at and foreign key indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 12:10:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # SQLite не умеет добавлять столбец с вычисляемым значением по
+    # умолчанию через ALTER TABLE, поэтому таблица пересоздается
+    sqlite = op.get_bind().dialect.name == "sqlite"
+    with op.batch_alter_table(
+        "publication", recreate="always" if sqlite else "auto"
+    ) as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "created_at",
+                sa.DateTime(),
+                server_default=sa.func.now(),
+                nullable=False,
+            )
+        )
+    op.create_index(
+        "ix_publication_created_at_id", "publication", ["created_at", "id"]
+    )
+    op.create_index("ix_publication_author_id", "publication", ["author_id"])
+    op.create_index("ix_followers_follower_id", "followers", ["follower_id"])
+    op.create_index("ix_like_author_id", "like", ["author_id"])
+    op.create_index(
+        "ix_attachments_publication_id", "attachments", ["publication_id"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_attachments_publication_id", table_name="attachments")
+    op.drop_index("ix_like_author_id", table_name="like")
+    op.drop_index("ix_followers_follower_id", table_name="followers")
+    op.drop_index("ix_publication_author_id", table_name="publication")
+    op.drop_index("ix_publication_created_at_id", table_name="publication")
+    with op.batch_alter_table("publication") as batch_op:
+        batch_op.drop_column("created_at")
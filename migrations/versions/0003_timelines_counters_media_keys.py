@@ -0,0 +1,132 @@
+"""timelines, counters, media metadata and api keys
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 12:20:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "followers_count",
+                sa.Integer(),
+                server_default="0",
+                nullable=False,
+            )
+        )
+        batch_op.add_column(
+            sa.Column(
+                "following_count",
+                sa.Integer(),
+                server_default="0",
+                nullable=False,
+            )
+        )
+    with op.batch_alter_table("publication") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "likes_count",
+                sa.Integer(),
+                server_default="0",
+                nullable=False,
+            )
+        )
+
+    # заполняем счетчики по существующим данным
+    op.execute(
+        'UPDATE publication SET likes_count = (SELECT count(*) FROM "like" '
+        'WHERE "like".publication_id = publication.id)'
+    )
+    op.execute(
+        'UPDATE "user" SET '
+        "followers_count = (SELECT count(*) FROM followers "
+        'WHERE followers.author_id = "user".id), '
+        "following_count = (SELECT count(*) FROM followers "
+        'WHERE followers.follower_id = "user".id)'
+    )
+
+    with op.batch_alter_table("attachments") as batch_op:
+        batch_op.add_column(sa.Column("author_id", sa.Integer()))
+        batch_op.add_column(sa.Column("hash", sa.String(length=64)))
+        batch_op.add_column(sa.Column("size", sa.Integer()))
+        batch_op.add_column(sa.Column("mime", sa.String()))
+        batch_op.add_column(sa.Column("variants", sa.JSON()))
+        batch_op.create_foreign_key(
+            "fk_attachments_author_id_user",
+            "user",
+            ["author_id"],
+            ["id"],
+            ondelete="CASCADE",
+        )
+    op.create_index("ix_attachments_hash", "attachments", ["hash"])
+
+    op.create_table(
+        "timeline",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("publication_id", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["publication_id"], ["publication.id"], ondelete="CASCADE"
+        ),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "publication_id"),
+    )
+    op.create_index(
+        "ix_timeline_publication_id", "timeline", ["publication_id"]
+    )
+    op.create_index(
+        "ix_timeline_user_id_created_at",
+        "timeline",
+        ["user_id", "created_at", "publication_id"],
+    )
+
+    op.create_table(
+        "api_key",
+        sa.Column("key_hash", sa.String(length=64), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+        sa.Column("revoked_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("key_hash"),
+    )
+    op.create_index("ix_api_key_user_id", "api_key", ["user_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_api_key_user_id", table_name="api_key")
+    op.drop_table("api_key")
+    op.drop_index("ix_timeline_user_id_created_at", table_name="timeline")
+    op.drop_index("ix_timeline_publication_id", table_name="timeline")
+    op.drop_table("timeline")
+    op.drop_index("ix_attachments_hash", table_name="attachments")
+    with op.batch_alter_table("attachments") as batch_op:
+        batch_op.drop_constraint(
+            "fk_attachments_author_id_user", type_="foreignkey"
+        )
+        batch_op.drop_column("variants")
+        batch_op.drop_column("mime")
+        batch_op.drop_column("size")
+        batch_op.drop_column("hash")
+        batch_op.drop_column("author_id")
+    with op.batch_alter_table("publication") as batch_op:
+        batch_op.drop_column("likes_count")
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_column("following_count")
+        batch_op.drop_column("followers_count")
@@ -0,0 +1,44 @@
+"""full-text search index for publications
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 15:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from db.models import (  # isort:skip
+    SEARCH_DDL_POSTGRESQL,
+    SEARCH_DDL_SQLITE,
+    SEARCH_TABLE,
+    SEARCH_TS_CONFIG,
+)
+
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name == "postgresql":
+        for statement in SEARCH_DDL_POSTGRESQL:
+            op.execute(statement)
+        op.execute(
+            f"INSERT INTO {SEARCH_TABLE} (publication_id, document) "
+            f"SELECT id, to_tsvector('{SEARCH_TS_CONFIG}', content) "
+            "FROM publication"
+        )
+    else:
+        for statement in SEARCH_DDL_SQLITE:
+            op.execute(statement)
+        op.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, content) "
+            "SELECT id, content FROM publication"
+        )
+
+
+def downgrade() -> None:
+    op.execute(f"DROP TABLE {SEARCH_TABLE}")
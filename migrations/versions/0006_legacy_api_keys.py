@@ -0,0 +1,65 @@
+"""legacy api keys
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 18:40:00
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0006"
+down_revision: Union[str, None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Ключи, которые раньше были заданы в config_app/settings.py (API_KEY) и
+# которые использует клиент по умолчанию. Переносятся в таблицу api_key для
+# существующих пользователей, чтобы после миграции 0003 они не потеряли
+# доступ. Отозвать их можно через DELETE /api/api_key
+LEGACY_API_KEYS = {"test": 1, "test2": 2, "test3": 3}
+
+user = sa.table("user", sa.column("id", sa.Integer))
+api_key = sa.table(
+    "api_key",
+    sa.column("key_hash", sa.String),
+    sa.column("user_id", sa.Integer),
+    sa.column("created_at", sa.DateTime),
+)
+
+
+def _hash(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    for key, user_id in LEGACY_API_KEYS.items():
+        key_hash = _hash(key)
+        user_exists = connection.scalar(
+            sa.select(user.c.id).where(user.c.id == user_id)
+        )
+        key_exists = connection.scalar(
+            sa.select(api_key.c.key_hash).where(api_key.c.key_hash == key_hash)
+        )
+        if user_exists and not key_exists:
+            connection.execute(
+                api_key.insert().values(
+                    key_hash=key_hash,
+                    user_id=user_id,
+                    created_at=sa.func.now(),
+                )
+            )
+
+
+def downgrade() -> None:
+    op.execute(
+        api_key.delete().where(
+            api_key.c.key_hash.in_(
+                [_hash(key) for key in LEGACY_API_KEYS]
+            )
+        )
+    )
@@ -0,0 +1,31 @@
+"""idempotency key request hash
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 19:30:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+revision: str = "0007"
+down_revision: Union[str, None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # сохраненные ответы без хеша запроса нельзя безопасно сверить с
+    # повтором, поэтому удаляются (ключи живут не дольше IDEMPOTENCY_KEY_TTL)
+    op.execute("DELETE FROM idempotency_key")
+    with op.batch_alter_table("idempotency_key") as batch_op:
+        batch_op.add_column(
+            sa.Column("request_hash", sa.String(length=64), nullable=False)
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("idempotency_key") as batch_op:
+        batch_op.drop_column("request_hash")
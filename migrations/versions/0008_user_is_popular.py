@@ -0,0 +1,47 @@
+"""user is_popular flag
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 21:10:00
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from config_app.settings import FANOUT_MAX_FOLLOWERS
+
+revision: str = "0008"
+down_revision: Union[str, None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+user = sa.table(
+    "user",
+    sa.column("followers_count", sa.Integer),
+    sa.column("is_popular", sa.Boolean),
+)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.add_column(
+            sa.Column(
+                "is_popular",
+                sa.Boolean(),
+                server_default=sa.false(),
+                nullable=False,
+            )
+        )
+    # до этой миграции популярность определялась по счетчику подписчиков
+    op.execute(
+        user.update()
+        .where(user.c.followers_count > FANOUT_MAX_FOLLOWERS)
+        .values(is_popular=True)
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("user") as batch_op:
+        batch_op.drop_column("is_popular")
@@ -4,9 +4,13 @@ from typing import AsyncGenerator
 import pytest
 from httpx import AsyncClient
 
-from db.database import get_async_session
+from app.auth import create_api_key
+from app.counters import reconcile_counters
+from app.dependencies import get_read_session
+from app.thumbnails import shutdown_executor
+from db.database import Base, StatementCounter, get_async_session
 from db.models import Attachments, Followers, Like, Publication, User
-from main import Base, app
+from main import app
 
 from sqlalchemy.ext.asyncio import (  # isort:skip
     AsyncSession,
@@ -32,6 +36,7 @@ async def override_get_async_session():
 
 
 app.dependency_overrides[get_async_session] = override_get_async_session
+app.dependency_overrides[get_read_session] = override_get_async_session
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -43,6 +48,10 @@ async def setup_database(async_session):
     user2 = User(name="user2")
     user3 = User(name="user3")
     async_session.add_all([user1, user2, user3])
+    await async_session.flush()
+    create_api_key(async_session, user1.id, "test")
+    create_api_key(async_session, user2.id, "test2")
+    create_api_key(async_session, user3.id, "test3")
     await async_session.commit()
 
     publication1 = Publication(content="Publication 1", author_id=user1.id)
@@ -76,7 +85,11 @@ async def setup_database(async_session):
     attachment3 = Attachments(link="link3", publication_id=publication3.id)
     async_session.add_all([attachment1, attachment2, attachment3])
     await async_session.commit()
+
+    # пересчитываем счетчики после прямой вставки строк
+    await reconcile_counters(async_session)
     yield
+    shutdown_executor()
     async with test_engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
 
@@ -98,3 +111,14 @@ async def async_client() -> AsyncGenerator[AsyncClient, None]:
 async def async_session():
     async with test_async_session() as session:
         yield session
+
+
+@pytest.fixture
+def max_statements():
+    """Проверяет, что код внутри блока with выполняет не больше
+    заданного количества SQL-запросов"""
+
+    def counter(limit):
+        return StatementCounter(test_engine, max_statements=limit)
+
+    return counter
@@ -1,4 +1,55 @@
+import gzip
+import io
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+import pytest
+import uvicorn
 from httpx import AsyncClient
+from PIL import Image
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import (
+    auth,
+    dependencies,
+    events,
+    media,
+    metrics,
+    routers,
+    thumbnails,
+    timeline,
+)
+from app.events import (  # isort:skip
+    HEARTBEAT_FRAME,
+    RESET_FRAME,
+    RETRY_FRAME,
+    EventBroker,
+)
+from app.counters import reconcile_counters
+from app.dependencies import get_read_session
+from app.like_queue import LikeQueue, QueueFull
+from app.precompress import precompress
+from app.response_cache import (
+    MemoryBackend,
+    feed_key,
+    feed_tag,
+    response_cache,
+    tweet_tag,
+)
+from app.schemas import GetAllTweetsOut, UserProfileInfoOut
+from benchmarks.graph import GraphConfig, generate
+from benchmarks.run import percentile
+from config_app.workers import GracefulServer
+from db import database
+from db.database import Base, InstrumentedQueuePool, get_pool_stats
+from db.models import Attachments, Publication, Timeline, User
+from main import app
 
 
 async def test_add_user(async_client: AsyncClient):
@@ -78,3 +129,1293 @@ async def test_get_user_profile_info(async_client: AsyncClient):
     response = await async_client.get("/api/users/2", headers=headers)
     assert response.status_code == 200
     assert "result" in response.json()
+
+
+async def test_get_all_tweets_paginated(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    response = await async_client.get(
+        "/api/tweets", params={"limit": 2}, headers=headers
+    )
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page["tweets"]) == 2
+    assert first_page["next_cursor"]
+
+    response = await async_client.get(
+        "/api/tweets",
+        params={"limit": 2, "cursor": first_page["next_cursor"]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    second_page = response.json()
+    assert second_page["next_cursor"] is None
+    tweets = first_page["tweets"] + second_page["tweets"]
+    ids = [tweet["id"] for tweet in tweets]
+    assert ids == sorted(ids, reverse=True)
+    assert len(set(ids)) == len(ids) == 3
+
+
+async def test_get_all_tweets_invalid_cursor(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    response = await async_client.get(
+        "/api/tweets", params={"cursor": "broken"}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+async def test_fanout_timeline(async_client: AsyncClient, monkeypatch):
+    monkeypatch.setattr(timeline, "TIMELINE_MODE", "fanout")
+    response = await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Fan-out tweet"},
+        headers={"api-key": "test3"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": "test2"}
+    )
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [tweet_id]
+
+    response = await async_client.delete(
+        f"/api/tweets/{tweet_id}", headers={"api-key": "test3"}
+    )
+    assert response.status_code == 200
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": "test2"}
+    )
+    assert response.json()["tweets"] == []
+
+
+async def test_fanout_timeline_pulls_popular_authors(
+    async_client: AsyncClient, monkeypatch
+):
+    monkeypatch.setattr(timeline, "TIMELINE_MODE", "fanout")
+    monkeypatch.setattr(timeline, "FANOUT_MAX_FOLLOWERS", 0)
+    response = await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Popular tweet"},
+        headers={"api-key": "test3"},
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": "test2"}
+    )
+    assert tweet_id in [tweet["id"] for tweet in response.json()["tweets"]]
+
+
+async def test_feed_query_plan(async_session, monkeypatch):
+    def compile_feed(dialect):
+        return str(
+            select(*timeline.feed_query(2, 10).c).compile(
+                dialect=dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+
+    pull_sql = compile_feed(postgresql.dialect())
+    assert " OR " not in pull_sql
+    assert "UNION SELECT 2" in pull_sql
+
+    monkeypatch.setattr(timeline, "TIMELINE_MODE", "fanout")
+    fanout_sql = compile_feed(postgresql.dialect())
+    assert "UNION ALL" in fanout_sql
+    assert "FROM timeline" in fanout_sql
+    assert "timeline.publication_id IN" not in fanout_sql
+
+    # лента читается из индекса timeline, а не перебором publication
+    connection = await async_session.connection()
+    plan = await connection.exec_driver_sql(
+        "EXPLAIN QUERY PLAN " + compile_feed(async_session.bind.dialect)
+    )
+    details = [row[-1] for row in plan]
+    assert any("ix_timeline_user_id_created_at" in row for row in details)
+
+
+async def test_fanout_timeline_rebuild_and_trim(
+    async_client: AsyncClient, async_session, monkeypatch
+):
+    monkeypatch.setattr(timeline, "TIMELINE_MODE", "fanout")
+    monkeypatch.setattr(timeline, "TIMELINE_MAX_LENGTH", 1)
+
+    async def timeline_ids(user_id):
+        return list(
+            await async_session.scalars(
+                select(Timeline.publication_id).where(
+                    Timeline.user_id == user_id
+                )
+            )
+        )
+
+    users_count = await async_session.scalar(
+        select(func.count()).select_from(User)
+    )
+    assert await timeline.rebuild_timelines(async_session) == users_count
+    pull_feed = await async_client.get(
+        "/api/tweets", params={"limit": 1}, headers={"api-key": "test2"}
+    )
+    assert await timeline_ids(2) == [pull_feed.json()["tweets"][0]["id"]]
+
+    # рассылка ленты не обрезает, это делает периодическая команда
+    response = await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Untrimmed"},
+        headers={"api-key": "test3"},
+    )
+    tweet_id = response.json()["tweet_id"]
+    assert len(await timeline_ids(2)) == 2
+    assert await timeline.trim_timelines(async_session) >= 1
+    assert await timeline_ids(2) == [tweet_id]
+
+
+async def test_fanout_demotes_author_with_hysteresis(
+    async_client: AsyncClient, async_session, monkeypatch
+):
+    monkeypatch.setattr(timeline, "TIMELINE_MODE", "fanout")
+    followers_count = await async_session.scalar(
+        select(User.followers_count).where(User.id == 3)
+    )
+    monkeypatch.setattr(timeline, "FANOUT_MAX_FOLLOWERS", followers_count)
+    monkeypatch.setattr(
+        timeline, "FANOUT_DEMOTE_FOLLOWERS", followers_count - 1
+    )
+    # после подписки автор становится популярным
+    response = await async_client.post(
+        "/api/users/3/follow", headers={"api-key": "test"}
+    )
+    assert response.status_code == 200
+    response = await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Posted while popular"},
+        headers={"api-key": "test3"},
+    )
+    tweet_id = response.json()["tweet_id"]
+    entry = select(Timeline).where(
+        Timeline.user_id == 2, Timeline.publication_id == tweet_id
+    )
+    assert await async_session.scalar(entry) is None
+
+    # отписка возвращает счетчик ниже порога популярности, но не ниже
+    # порога перевода в обычные, и ленты при ней не заполняются
+    response = await async_client.delete(
+        "/api/users/3/follow", headers={"api-key": "test"}
+    )
+    assert response.status_code == 200
+    assert await timeline.demote_authors(async_session) == 0
+    assert await async_session.scalar(entry) is None
+
+    monkeypatch.setattr(
+        timeline, "FANOUT_DEMOTE_FOLLOWERS", followers_count + 1
+    )
+    assert await timeline.demote_authors(async_session) == 1
+    assert await async_session.scalar(entry) is not None
+    assert await async_session.scalar(
+        select(Timeline).where(
+            Timeline.user_id == 1, Timeline.publication_id == tweet_id
+        )
+    ) is None
+    assert not await async_session.scalar(
+        select(User.is_popular).where(User.id == 3)
+    )
+    # повторное заполнение уже заполненной ленты ничего не ломает
+    await timeline.backfill_authors(async_session, 2, [3])
+    await async_session.commit()
+    assert await async_session.scalar(
+        select(func.count()).select_from(Timeline).where(
+            Timeline.user_id == 2, Timeline.publication_id == tweet_id
+        )
+    ) == 1
+
+
+async def test_get_user_profile_info_paginated(async_client: AsyncClient):
+    headers = {"api-key": "test"}
+    response = await async_client.get(
+        "/api/users/1", params={"limit": 1}, headers=headers
+    )
+    assert response.status_code == 200
+    user = response.json()["user"]
+    assert user["followers_count"] == 1
+    assert user["follower"] == [{"id": 2, "name": "user2"}]
+    assert user["following"] == []
+
+
+async def test_get_user_profile_info_counts_only(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    response = await async_client.get(
+        "/api/users/me", params={"counts_only": True}, headers=headers
+    )
+    assert response.status_code == 200
+    user = response.json()["user"]
+    assert user["follower"] is None
+    assert user["following_count"] == 2
+
+
+async def test_endpoints_statement_budget(
+    async_client: AsyncClient, max_statements
+):
+    headers = {"api-key": "test2"}
+    with max_statements(3):
+        response = await async_client.get("/api/tweets", headers=headers)
+    assert response.status_code == 200
+
+    with max_statements(3):
+        response = await async_client.get("/api/users/1", headers=headers)
+    assert response.status_code == 200
+
+    with max_statements(2):
+        response = await async_client.delete(
+            "/api/tweets/2/likes", headers=headers
+        )
+    assert response.status_code == 200
+
+
+async def test_like_counters(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    response = await async_client.post("/api/tweets/3/likes", headers=headers)
+    assert response.status_code == 200
+
+    response = await async_client.get("/api/tweets", headers=headers)
+    tweet = next(t for t in response.json()["tweets"] if t["id"] == 3)
+    assert tweet["likes_count"] == len(tweet["likes"]) == 1
+
+
+async def test_reconcile_counters(async_session):
+    user = await async_session.get(User, 1)
+    user.followers_count = 100
+    await async_session.commit()
+
+    assert await reconcile_counters(async_session) == 1
+    await async_session.refresh(user)
+    assert user.followers_count == 1
+
+
+async def test_add_media(async_client: AsyncClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(media, "MEDIA_CHUNK_SIZE", 4)
+    content = b"\x89PNG fake image content"
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("image.png", content, "image/png")},
+        headers={"api-key": "test"},
+    )
+    assert response.status_code == 200
+    assert response.json()["media_id"]
+    saved_files = [
+        path for path in (tmp_path / "images").rglob("*") if path.is_file()
+    ]
+    assert [path.read_bytes() for path in saved_files] == [content]
+
+
+async def test_add_media_rejects_large_file(
+    async_client: AsyncClient, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(media, "MEDIA_MAX_SIZE", 4)
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("image.png", b"too large", "image/png")},
+        headers={"api-key": "test"},
+    )
+    assert response.status_code == 413
+    assert list((tmp_path / "images").iterdir()) == []
+
+
+async def test_add_media_rejects_content_type(async_client: AsyncClient):
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("script.sh", b"echo", "text/x-shellscript")},
+        headers={"api-key": "test"},
+    )
+    assert response.status_code == 415
+
+
+async def test_add_media_deduplicates_content(
+    async_client: AsyncClient, async_session, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    media_ids = []
+    for name in ("first.png", "second.png"):
+        response = await async_client.post(
+            "/api/medias",
+            files={"file": (name, b"same content", "image/png")},
+            headers={"api-key": "test"},
+        )
+        media_ids.append(response.json()["media_id"])
+
+    first, second = [
+        await async_session.get(Attachments, media_id)
+        for media_id in media_ids
+    ]
+    assert first.id != second.id
+    assert first.link == second.link
+    assert first.hash == second.hash
+    assert first.size == len(b"same content")
+
+
+async def test_media_garbage_collection(
+    async_session, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(media, "MEDIA_GC_GRACE_PERIOD", -1)
+    referenced = tmp_path / media.blob_link("a" * 64, "image/png")
+    orphan = tmp_path / media.blob_link("b" * 64, "image/png")
+    for path in (referenced, orphan):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"content")
+    async_session.add(Attachments(link="link", hash="a" * 64))
+    await async_session.commit()
+
+    assert await media.collect_garbage(async_session) == 1
+    assert referenced.exists()
+    assert not orphan.exists()
+
+
+async def test_media_garbage_collection_rechecks_reused_file(
+    async_session, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(media, "MEDIA_GC_GRACE_PERIOD", -1)
+    reused = tmp_path / media.blob_link("c" * 64, "image/png")
+    reused.parent.mkdir(parents=True, exist_ok=True)
+    reused.write_bytes(b"content")
+    stored_blobs = media._stored_blobs
+
+    def reuse_during_scan(images_dir, older_than):
+        blobs = stored_blobs(images_dir, older_than)
+        # загрузка того же файла, запись о которой еще не сохранена
+        touched_at = time.time() + 100
+        os.utime(reused, (touched_at, touched_at))
+        return blobs
+
+    monkeypatch.setattr(media, "_stored_blobs", reuse_during_scan)
+    assert await media.collect_garbage(async_session) == 0
+    assert reused.exists()
+
+
+async def test_add_media_generates_variants(
+    async_client: AsyncClient, async_session, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(thumbnails, "STATIC_PATH", str(tmp_path))
+    monkeypatch.setattr(thumbnails, "MEDIA_VARIANT_WIDTHS", [320, 1280])
+    image_file = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(image_file, format="PNG")
+
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("photo.png", image_file.getvalue(), "image/png")},
+        headers={"api-key": "test"},
+    )
+    assert response.status_code == 200
+
+    attachment = await async_session.get(
+        Attachments, response.json()["media_id"], populate_existing=True
+    )
+    assert list(attachment.variants) == ["320"]
+    with Image.open(tmp_path / attachment.variants["320"]) as variant:
+        assert variant.size == (320, 240)
+        assert variant.format == "WEBP"
+
+
+async def test_thumbnail_pool_recreated_after_crash(monkeypatch):
+    broken = ProcessPoolExecutor(max_workers=1)
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+    monkeypatch.setattr(thumbnails, "_executor", broken)
+    await thumbnails.process_attachment(None, 1, "missing.png", "image/png")
+    assert thumbnails._executor is None
+
+
+async def test_add_tweet_with_media(
+    async_client: AsyncClient, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    headers = {"api-key": "test2"}
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("image.gif", b"GIF89a", "image/gif")},
+        headers=headers,
+    )
+    media_id = response.json()["media_id"]
+    request_data = {"tweet_data": "With media", "tweet_media_ids": [media_id]}
+
+    response = await async_client.post(
+        "/api/tweets", json=request_data, headers={"api-key": "test3"}
+    )
+    assert response.status_code == 404
+
+    response = await async_client.post(
+        "/api/tweets", json=request_data, headers=headers
+    )
+    assert response.status_code == 200
+
+    response = await async_client.post(
+        "/api/tweets", json=request_data, headers=headers
+    )
+    assert response.status_code == 409
+
+
+async def test_add_tweet_with_unknown_media(
+    async_client: AsyncClient, async_session
+):
+    tweets_count = await async_session.scalar(func.count(Publication.id))
+    request_data = {"tweet_data": "Unknown media", "tweet_media_ids": [999]}
+    response = await async_client.post(
+        "/api/tweets", json=request_data, headers={"api-key": "test"}
+    )
+    assert response.status_code == 404
+    assert response.json()["error_message"] == "Media not found: 999"
+    assert await async_session.scalar(func.count(Publication.id)) == (
+        tweets_count
+    )
+
+
+async def test_new_user_api_key_lifecycle(async_client: AsyncClient):
+    response = await async_client.post("/api/user", json={"name": "Keyed"})
+    user = response.json()
+    headers = {"api-key": user["api_key"]}
+
+    response = await async_client.get("/api/users/me", headers=headers)
+    assert response.json()["user"]["id"] == user["author_id"]
+
+    response = await async_client.delete("/api/api_key", headers=headers)
+    assert response.status_code == 200
+    response = await async_client.get("/api/users/me", headers=headers)
+    assert response.status_code == 404
+
+
+async def test_unknown_api_key(async_client: AsyncClient):
+    headers = {"api-key": "unknown"}
+    response = await async_client.delete("/api/tweets/2", headers=headers)
+    assert response.status_code == 404
+    assert response.json()["error_message"] == "User is not registered"
+
+
+async def test_api_key_cache(async_session, max_statements):
+    auth.api_key_cache.clear()
+    with max_statements(2):
+        assert await auth.resolve_api_key(async_session, "test") == 1
+        assert await auth.resolve_api_key(async_session, "missing") == 0
+    with max_statements(0):
+        assert await auth.resolve_api_key(async_session, "test") == 1
+        assert await auth.resolve_api_key(async_session, "missing") == 0
+
+
+async def test_api_key_cache_zero_negative_ttl(
+    async_session, monkeypatch, max_statements
+):
+    monkeypatch.setattr(auth, "API_KEY_CACHE_NEGATIVE_TTL", 0)
+    auth.api_key_cache.clear()
+    with max_statements(2):
+        assert await auth.resolve_api_key(async_session, "missing") == 0
+        assert await auth.resolve_api_key(async_session, "missing") == 0
+    assert len(auth.api_key_cache) == 0
+
+
+async def test_pool_stats(tmp_path):
+    pool_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=2,
+        max_overflow=2,
+    )
+    async with pool_engine.connect():
+        stats = get_pool_stats(pool_engine)
+    await pool_engine.dispose()
+
+    assert stats["checked_out"] == 1
+    assert stats["saturation"] == 0.25
+    assert stats["checkouts"] == 1
+    assert stats["connects"] == 1
+    # время открытия соединения не считается ожиданием
+    assert 0 <= stats["wait_time_total"] < stats["connect_time_total"]
+
+
+async def test_pgbouncer_mode_disables_prepared_statements(monkeypatch):
+    monkeypatch.setattr(database, "DB_PGBOUNCER", True)
+    connect_args = database.get_connect_args()
+    assert connect_args["statement_cache_size"] == 0
+    assert connect_args["prepared_statement_cache_size"] == 0
+    name_func = connect_args["prepared_statement_name_func"]
+    assert name_func() != name_func()
+
+    pgbouncer_engine = database.create_engine()
+    assert isinstance(pgbouncer_engine.pool, InstrumentedQueuePool)
+    assert pgbouncer_engine.echo is False
+
+
+async def test_read_replica_routing(async_client: AsyncClient, monkeypatch):
+    replica_engine = create_async_engine("sqlite+aiosqlite://")
+    monkeypatch.setattr(database, "replica_engine", replica_engine)
+    monkeypatch.setattr(
+        database,
+        "replica_monitor",
+        database.ReplicaLagMonitor(max_lag=5, check_interval=0),
+    )
+    database.recent_writers.clear()
+
+    choose = database.choose_read_sessionmaker
+    assert await choose(3) is database.async_read_session
+
+    # после записи пользователь читает с основной базы
+    response = await async_client.post(
+        "/api/tweets/3/likes", headers={"api-key": "test3"}
+    )
+    assert response.status_code == 200
+    assert await choose(3) is database.async_session
+    assert await choose(2) is database.async_read_session
+
+    # в другом воркере запись видна только по cookie
+    database.recent_writers.clear()
+    last_write = response.cookies[dependencies.LAST_WRITE_COOKIE]
+    assert dependencies.wrote_recently(3, last_write)
+    assert not dependencies.wrote_recently(2, last_write)
+    assert not dependencies.wrote_recently(3, "3:0")
+    assert await choose(3) is database.async_read_session
+    assert await choose(3, True) is database.async_session
+
+    async def lagging(async_engine):
+        return 60.0
+
+    monkeypatch.setattr(database, "measure_replica_lag", lagging)
+    assert await choose(2) is database.async_session
+    await replica_engine.dispose()
+
+
+async def test_read_session_routes_recent_writer_to_primary(
+    async_client: AsyncClient, async_session, monkeypatch
+):
+    # остальные тесты читают через основную сессию, здесь реплика -
+    # отдельная пустая база, по ответу видно, откуда он прочитан
+    monkeypatch.delitem(app.dependency_overrides, get_read_session)
+    replica_engine = create_async_engine("sqlite+aiosqlite://")
+    async with replica_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(database, "replica_engine", replica_engine)
+    monkeypatch.setattr(
+        database, "async_read_session", async_sessionmaker(replica_engine)
+    )
+    monkeypatch.setattr(
+        database, "async_session", async_sessionmaker(async_session.bind)
+    )
+    monkeypatch.setattr(
+        database,
+        "replica_monitor",
+        database.ReplicaLagMonitor(max_lag=5, check_interval=0),
+    )
+    database.recent_writers.clear()
+    async_client.cookies.clear()
+
+    tweet_id = await async_session.scalar(select(Publication.id).limit(1))
+    headers = {"api-key": "test2"}
+    params = {"ids": str(tweet_id)}
+    response = await async_client.get(
+        "/api/tweets", params=params, headers=headers
+    )
+    assert response.json()["tweets"] == []
+
+    # запись в другом воркере известна только по cookie
+    headers["cookie"] = f"{dependencies.LAST_WRITE_COOKIE}=2:{time.time()}"
+    response = await async_client.get(
+        "/api/tweets", params=params, headers=headers
+    )
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [tweet_id]
+    await replica_engine.dispose()
+
+
+async def test_feed_response_cache(async_client: AsyncClient, max_statements):
+    headers = {"api-key": "test2"}
+    response = await async_client.get("/api/tweets", headers=headers)
+    etag = response.headers["etag"]
+
+    with max_statements(0):
+        cached = await async_client.get("/api/tweets", headers=headers)
+        not_modified = await async_client.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+    assert cached.json() == response.json()
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    # лайк сбрасывает закешированную ленту с этой публикацией
+    tweet = response.json()["tweets"][0]
+    response = await async_client.post(
+        f"/api/tweets/{tweet['id']}/likes", headers={"api-key": "test"}
+    )
+    assert response.status_code == 200
+    response = await async_client.get(
+        "/api/tweets", headers={**headers, "if-none-match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()["tweets"][0]["likes_count"] == (
+        tweet["likes_count"] + 1
+    )
+
+    # новая публикация автора сбрасывает ленты его подписчиков
+    await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Fresh"},
+        headers={"api-key": "test"},
+    )
+    response = await async_client.get("/api/tweets", headers=headers)
+    assert response.json()["tweets"][0]["content"] == "Fresh"
+
+
+async def test_popular_author_feeds_expire_by_ttl(
+    async_client: AsyncClient, async_session
+):
+    popular = update(User).where(User.id == 1)
+    await async_session.execute(popular.values(is_popular=True))
+    await async_session.commit()
+    before = await async_client.get(
+        "/api/tweets", headers={"api-key": "test2"}
+    )
+
+    await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "Popular"},
+        headers={"api-key": "test"},
+    )
+    # лента подписчика не сбрасывается, лента самого автора - сбрасывается
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": "test2"}
+    )
+    assert response.json() == before.json()
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": "test"}
+    )
+    assert response.json()["tweets"][0]["content"] == "Popular"
+    await async_session.execute(popular.values(is_popular=False))
+    await async_session.commit()
+
+
+async def test_response_cache_skips_stale_store():
+    backend = MemoryBackend(maxsize=10, ttl=60)
+    snapshot = await backend.snapshot()
+    # публикация лайкнута, пока ответ читался из базы
+    await backend.invalidate(tweet_tag(1))
+    await backend.set("feed", b"old", [feed_tag(1), tweet_tag(1)], snapshot)
+    assert await backend.get("feed") is None
+
+    snapshot = await backend.snapshot()
+    await backend.set("feed", b"new", [feed_tag(1), tweet_tag(1)], snapshot)
+    assert (await backend.get("feed")).body == b"new"
+
+
+async def test_profile_response_cache(async_client: AsyncClient):
+    headers = {"api-key": "test3"}
+    response = await async_client.get("/api/users/2", headers=headers)
+    followers_count = response.json()["user"]["followers_count"]
+
+    response = await async_client.post(
+        "/api/users/2/follow", headers=headers
+    )
+    assert response.status_code == 200
+    response = await async_client.get("/api/users/2", headers=headers)
+    assert response.json()["user"]["followers_count"] == followers_count + 1
+
+
+async def test_recent_writer_skips_response_cache(
+    async_client: AsyncClient,
+):
+    # ответ, оставшийся в кеше другого воркера от состояния до записи
+    stale = orjson.dumps({"result": True, "tweets": [], "next_cursor": "x"})
+    snapshot = await response_cache.snapshot()
+    await response_cache.set(
+        feed_key(3, 5, None), stale, [feed_tag(3)], snapshot
+    )
+    database.recent_writers.clear()
+    async_client.cookies.clear()
+    headers = {"api-key": "test3"}
+    params = {"limit": 5}
+    response = await async_client.get(
+        "/api/tweets", params=params, headers=headers
+    )
+    assert response.content == stale
+
+    headers["cookie"] = f"{dependencies.LAST_WRITE_COOKIE}=3:{time.time()}"
+    response = await async_client.get(
+        "/api/tweets", params=params, headers=headers
+    )
+    assert response.content != stale
+    # ответ из базы заменил устаревший и в кеше
+    del headers["cookie"]
+    cached = await async_client.get(
+        "/api/tweets", params=params, headers=headers
+    )
+    assert cached.content == response.content
+
+
+async def test_fast_json_matches_schemas(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    response = await async_client.get("/api/tweets", headers=headers)
+    assert response.headers["content-type"] == "application/json"
+    feed = GetAllTweetsOut.model_validate_json(response.content)
+    assert feed.model_dump() == response.json()
+
+    response = await async_client.get("/api/users/me", headers=headers)
+    profile = UserProfileInfoOut.model_validate_json(response.content)
+    assert profile.model_dump() == response.json()
+
+
+async def test_read_models_single_statement(
+    async_client: AsyncClient, max_statements
+):
+    headers = {"api-key": "test2"}
+    await async_client.get("/api/users/me", headers=headers)
+    await response_cache.clear()
+
+    with max_statements(1):
+        response = await async_client.get(
+            "/api/tweets", params={"limit": 2}, headers=headers
+        )
+    feed = response.json()
+    assert len(feed["tweets"]) == 2
+    assert feed["next_cursor"]
+
+    with max_statements(1):
+        response = await async_client.get("/api/users/me", headers=headers)
+    user = response.json()["user"]
+    assert [author["id"] for author in user["following"]] == [1, 3]
+
+
+async def test_like_and_follow_are_idempotent(
+    async_client: AsyncClient, max_statements
+):
+    headers = {"api-key": "test3"}
+    await async_client.delete("/api/tweets/2/likes", headers=headers)
+    with max_statements(2):
+        response = await async_client.post(
+            "/api/tweets/2/likes", headers=headers
+        )
+    assert response.status_code == 200
+    response = await async_client.post("/api/tweets/2/likes", headers=headers)
+    assert response.status_code == 200
+    response = await async_client.post(
+        "/api/tweets/100/likes", headers=headers
+    )
+    assert response.status_code == 404
+
+    response = await async_client.post("/api/users/1/follow", headers=headers)
+    assert response.status_code == 200
+    response = await async_client.post(
+        "/api/users/100/follow", headers=headers
+    )
+    assert response.status_code == 404
+
+    response = await async_client.get("/api/users/me", headers=headers)
+    user = response.json()["user"]
+    assert user["following_count"] == len(user["following"])
+
+
+async def test_idempotency_key(async_client: AsyncClient, async_session):
+    headers = {"api-key": "test3", "idempotency-key": "retry-1"}
+    request_data = {"tweet_data": "Sent twice"}
+    first = await async_client.post(
+        "/api/tweets", json=request_data, headers=headers
+    )
+    second = await async_client.post(
+        "/api/tweets", json=request_data, headers=headers
+    )
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    count = await async_session.scalar(
+        func.count(Publication.id).select().where(
+            Publication.content == "Sent twice"
+        )
+    )
+    assert count == 1
+
+    # ключ действует только для своего пользователя
+    response = await async_client.post(
+        "/api/tweets",
+        json=request_data,
+        headers={**headers, "api-key": "test2"},
+    )
+    assert response.json()["tweet_id"] != first.json()["tweet_id"]
+
+    # ключ нельзя использовать для другого запроса
+    response = await async_client.post(
+        "/api/likes:batch",
+        json={"items": [{"tweet_id": 1}]},
+        headers=headers,
+    )
+    assert response.status_code == 422
+    response = await async_client.post(
+        "/api/tweets", json={"tweet_data": "Other"}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+async def test_batch_likes(async_client: AsyncClient, max_statements):
+    headers = {"api-key": "test2"}
+    await async_client.delete("/api/tweets/3/likes", headers=headers)
+    await async_client.post("/api/tweets/2/likes", headers=headers)
+    request_data = {
+        "items": [
+            {"tweet_id": 3},
+            {"tweet_id": 2, "like": False},
+            {"tweet_id": 100},
+            {"tweet_id": 101, "like": False},
+        ]
+    }
+    with max_statements(6):
+        response = await async_client.post(
+            "/api/likes:batch", json=request_data, headers=headers
+        )
+    assert response.status_code == 200
+    assert [item["result"] for item in response.json()["items"]] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert response.json()["items"][2]["error_message"] == "Tweet not found"
+
+    response = await async_client.get(
+        "/api/tweets", params={"ids": "3,2,100"}, headers=headers
+    )
+    tweets = response.json()["tweets"]
+    assert [tweet["id"] for tweet in tweets] == [3, 2]
+    assert 2 in [like["user_id"] for like in tweets[0]["likes"]]
+    assert 2 not in [like["user_id"] for like in tweets[1]["likes"]]
+    assert tweets[0]["likes_count"] == len(tweets[0]["likes"])
+    assert tweets[1]["likes_count"] == len(tweets[1]["likes"])
+
+    response = await async_client.get(
+        "/api/tweets", params={"ids": "3,x"}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+async def test_batch_follows(async_client: AsyncClient):
+    headers = {"api-key": "test3"}
+    request_data = {
+        "items": [
+            {"user_id": 2},
+            {"user_id": 3},
+            {"user_id": 1, "follow": False},
+            {"user_id": 100},
+        ]
+    }
+    response = await async_client.post(
+        "/api/follows:batch", json=request_data, headers=headers
+    )
+    assert response.status_code == 200
+    assert [item["result"] for item in response.json()["items"]] == [
+        True,
+        False,
+        True,
+        False,
+    ]
+
+    response = await async_client.get("/api/users/me", headers=headers)
+    user = response.json()["user"]
+    assert [author["id"] for author in user["following"]] == [2]
+    assert user["following_count"] == 1
+
+
+async def test_like_write_behind(
+    async_client: AsyncClient, async_session, monkeypatch
+):
+    headers = {"api-key": "test3"}
+    await async_client.delete("/api/tweets/2/likes", headers=headers)
+    response = await async_client.get(
+        "/api/tweets", params={"ids": "2"}, headers=headers
+    )
+    likes_count = response.json()["tweets"][0]["likes_count"]
+
+    queue = LikeQueue(
+        maxsize=10,
+        flush_interval=60,
+        batch_size=100,
+        enqueue_timeout=0.01,
+        stop_timeout=0,
+    )
+    queue.start(async_sessionmaker(async_session.bind))
+    monkeypatch.setattr(routers, "like_queue", queue)
+    for method in ("post", "delete", "post"):
+        response = await async_client.request(
+            method, "/api/tweets/2/likes", headers=headers
+        )
+        assert response.status_code == 200
+    response = await async_client.post(
+        "/api/tweets/100/likes", headers=headers
+    )
+    assert response.status_code == 404
+    # ответ сохраняется для ключа и в режиме отложенной записи
+    retry_headers = {**headers, "idempotency-key": "queued-like"}
+    response = await async_client.post(
+        "/api/tweets/2/likes", headers=retry_headers
+    )
+    assert response.status_code == 200
+    response = await async_client.delete(
+        "/api/tweets/2/likes", headers=retry_headers
+    )
+    assert response.status_code == 422
+    assert len(queue) == 1
+
+    # остановка записывает накопленные действия
+    await queue.stop()
+    assert len(queue) == 0
+    response = await async_client.get(
+        "/api/tweets", params={"ids": "2"}, headers=headers
+    )
+    tweet = response.json()["tweets"][0]
+    assert tweet["likes_count"] == likes_count + 1
+    assert 3 in [like["user_id"] for like in tweet["likes"]]
+
+    # пакет идет через очередь и отменяет стоящий в ней лайк
+    queue.start(async_sessionmaker(async_session.bind))
+    await async_client.delete("/api/tweets/2/likes", headers=headers)
+    await async_client.post("/api/tweets/2/likes", headers=headers)
+    response = await async_client.post(
+        "/api/likes:batch",
+        json={"items": [{"tweet_id": 2, "like": False}, {"tweet_id": 100}]},
+        headers=headers,
+    )
+    assert [item["result"] for item in response.json()["items"]] == [
+        True,
+        False,
+    ]
+    assert len(queue) == 1
+    await queue.stop()
+    response = await async_client.get(
+        "/api/tweets", params={"ids": "2"}, headers=headers
+    )
+    tweet = response.json()["tweets"][0]
+    assert tweet["likes_count"] == likes_count
+    assert 3 not in [like["user_id"] for like in tweet["likes"]]
+
+
+async def test_like_queue_backpressure():
+    queue = LikeQueue(
+        maxsize=1,
+        flush_interval=60,
+        batch_size=100,
+        enqueue_timeout=0.01,
+        stop_timeout=0,
+    )
+    await queue.put(1, 2, True)
+    await queue.put(1, 2, False)
+    with pytest.raises(QueueFull):
+        await queue.put(1, 3, True)
+    with pytest.raises(QueueFull):
+        await queue.put_many(1, {2: True, 3: True})
+    assert len(queue) == 1
+    assert queue._pending == {(1, 2): False}
+
+
+async def test_like_queue_retries_on_stop(caplog):
+    queue = LikeQueue(
+        maxsize=10,
+        flush_interval=60,
+        batch_size=100,
+        enqueue_timeout=0.01,
+        stop_timeout=1,
+    )
+    attempts = []
+
+    async def unstable_write(batch):
+        attempts.append(batch)
+        if len(attempts) < 3:
+            raise ConnectionError("database is unavailable")
+        return {}
+
+    queue._write = unstable_write
+    queue.start(None)
+    await queue.put(1, 2, True)
+    await queue.stop()
+    assert len(attempts) == 3
+    assert len(queue) == 0
+
+    async def failing_write(batch):
+        raise ConnectionError("database is unavailable")
+
+    queue._write = failing_write
+    queue.stop_timeout = 0.2
+    queue.start(None)
+    await queue.put(1, 3, False)
+    await queue.stop()
+    assert len(queue) == 0
+    assert "Like actions lost on shutdown: [[1,3,false]]" in caplog.text
+
+
+async def test_search(async_client: AsyncClient):
+    headers = {"api-key": "test2"}
+    tweet_ids = []
+    for text in (
+        "Zebra crossing",
+        "Zebra zebra everywhere",
+        "Giraffe only",
+        "Zebra, giraffe",
+    ):
+        response = await async_client.post(
+            "/api/tweets", json={"tweet_data": text}, headers=headers
+        )
+        tweet_ids.append(response.json()["tweet_id"])
+
+    response = await async_client.get(
+        "/api/search", params={"q": "zebra"}, headers=headers
+    )
+    assert response.status_code == 200
+    GetAllTweetsOut.model_validate(response.json())
+    found = [tweet["id"] for tweet in response.json()["tweets"]]
+    assert sorted(found) == sorted(tweet_ids[:2] + tweet_ids[3:])
+    # чаще встречающееся слово - выше в выдаче
+    assert found[0] == tweet_ids[1]
+
+    # страницы по курсору не пересекаются и покрывают всю выдачу
+    pages = []
+    cursor = None
+    while True:
+        params = {"q": "zebra", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = await async_client.get(
+            "/api/search", params=params, headers=headers
+        )
+        pages += [tweet["id"] for tweet in response.json()["tweets"]]
+        cursor = response.json()["next_cursor"]
+        if not cursor:
+            break
+    assert pages == found
+
+    await async_client.delete(f"/api/tweets/{tweet_ids[3]}", headers=headers)
+    response = await async_client.get(
+        "/api/search", params={"q": "giraffe"}, headers=headers
+    )
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [
+        tweet_ids[2]
+    ]
+
+    response = await async_client.get(
+        "/api/search", params={"q": '"*'}, headers=headers
+    )
+    assert response.json()["tweets"] == []
+    response = await async_client.get(
+        "/api/search", params={"q": "zebra", "cursor": "x"}, headers=headers
+    )
+    assert response.status_code == 422
+
+
+async def test_events_broker():
+    broker = EventBroker(queue_size=2)
+    subscription = broker.subscribe(3, [2])
+    other = broker.subscribe(4, [])
+    stream = broker.stream(subscription, heartbeat=0.01)
+    assert await stream.__anext__() == RETRY_FRAME
+    assert await stream.__anext__() == HEARTBEAT_FRAME
+
+    broker.dispatch(2, "delete", {"tweet_id": 7})
+    frame = await stream.__anext__()
+    assert b"event: delete\ndata: {\"tweet_id\":7}\n\n" in frame
+    assert other.queue.empty()
+
+    # подписка начинает доставку событий нового автора
+    broker.dispatch(3, "follow", {"user_id": 1})
+    await stream.__anext__()
+    broker.dispatch(1, "like", {"tweet_id": 5, "user_id": 1})
+    assert b"event: like" in await stream.__anext__()
+    assert other.queue.empty()
+
+    # переполненная очередь заменяется событием reset
+    for tweet_id in range(3):
+        broker.dispatch(2, "delete", {"tweet_id": tweet_id})
+    assert await stream.__anext__() == RESET_FRAME
+    with pytest.raises(StopAsyncIteration):
+        await stream.__anext__()
+    assert len(broker) == 1
+
+
+async def test_server_shutdown_closes_event_streams(monkeypatch):
+    broker = EventBroker(queue_size=10)
+    monkeypatch.setattr(events, "broker", broker)
+    subscription = broker.subscribe(3, [2])
+    server = GracefulServer(uvicorn.Config(app=None))
+    server.servers = []
+    server.force_exit = True
+
+    await server.shutdown()
+    assert subscription.queue.get_nowait() == RESET_FRAME
+    # потоки, открытые во время остановки, закрываются сразу
+    late = broker.subscribe(4, [])
+    assert late.queue.get_nowait() == RESET_FRAME
+
+
+async def test_write_endpoints_publish_events(
+    async_client: AsyncClient, monkeypatch
+):
+    broker = EventBroker(queue_size=10)
+    monkeypatch.setattr(events, "broker", broker)
+    subscription = broker.subscribe(3, [2])
+
+    headers = {"api-key": "test2"}
+    response = await async_client.post(
+        "/api/tweets", json={"tweet_data": "Streamed"}, headers=headers
+    )
+    tweet_id = response.json()["tweet_id"]
+    await async_client.post(
+        f"/api/tweets/{tweet_id}/likes", headers={"api-key": "test"}
+    )
+    await async_client.delete(f"/api/tweets/{tweet_id}", headers=headers)
+
+    frames = [subscription.queue.get_nowait() for _ in range(3)]
+    assert [frame.split(b"\n")[1] for frame in frames] == [
+        b"event: tweet",
+        b"event: like",
+        b"event: delete",
+    ]
+    tweet = orjson.loads(frames[0].split(b"data: ")[1])
+    assert tweet["content"] == "Streamed"
+    assert tweet["author"]["id"] == 2
+    assert subscription.queue.empty()
+
+
+async def test_metrics(async_client: AsyncClient):
+    headers = {"api-key": "test"}
+    await async_client.get("/api/tweets", params={"ids": "2"}, headers=headers)
+    await async_client.get("/api/users/100", headers=headers)
+    response = await async_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/api/tweets",status="200"}'
+    ) in text
+    assert 'route="/api/users/{user_id}",status="404"' in text
+    assert 'db_pool_size{database="primary"}' in text
+    assert "# TYPE media_upload_bytes_total counter" in text
+
+    # запросы к базе учтены в статистике своего маршрута
+    _, total = metrics.request_statements.values[("GET", "/api/tweets")]
+    assert total[0] >= 1
+
+
+async def test_metrics_skip_event_streams():
+    async def stream(scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    def observed():
+        return sum(
+            sum(counts)
+            for counts, _ in metrics.request_duration.values.values()
+        )
+
+    before = observed()
+    middleware = metrics.MetricsMiddleware(stream)
+    for path in ("/api/events", "/api/other-stream"):
+        await middleware(
+            {"type": "http", "method": "GET", "path": path}, None, send
+        )
+    assert observed() == before
+
+
+async def test_track_request_counts_statements(async_session):
+    with metrics.track_request() as stats:
+        await async_session.scalar(func.count(User.id).select())
+        await async_session.scalar(func.count(Publication.id).select())
+    assert stats.statements == 2
+    assert stats.sql_time > 0
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = metrics.SamplingProfiler(
+        threshold=0, interval=0.001, directory=str(tmp_path)
+    )
+    with profiler.record() as samples:
+        time.sleep(0.05)
+    profiler.stop()
+
+    path = profiler.dump(samples, "GET /api/tweets")
+    assert path.endswith("-GET_api_tweets.folded")
+    with open(path) as profile:
+        stack, count = profile.readline().rsplit(" ", 1)
+    assert int(count) > 0
+    assert stack.split(";")[-1].endswith("test_sampling_profiler")
+
+
+def test_benchmark_graph_generator():
+    config = GraphConfig(users=200, follows_per_user=10, seed=3)
+    graph = generate(config)
+    assert graph == generate(config)
+    assert len(set(graph.follows)) == len(graph.follows)
+    assert all(author != follower for author, follower in graph.follows)
+
+    # подписчики распределены неравномерно: у первого пользователя их
+    # намного больше, чем у типичного
+    followers = Counter(author for author, _ in graph.follows)
+    counts = sorted(followers.values())
+    assert followers[0] == counts[-1]
+    assert counts[-1] > 10 * counts[len(counts) // 2]
+
+    assert percentile([], 0.5) == 0.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.5) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0], 0.99) == pytest.approx(3.97)
+
+
+async def test_get_media_checks_access(
+    async_client: AsyncClient, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(media, "STATIC_PATH", str(tmp_path))
+    response = await async_client.post(
+        "/api/medias",
+        files={"file": ("draft.png", b"draft image", "image/png")},
+        headers={"api-key": "test"},
+    )
+    media_id = response.json()["media_id"]
+
+    # еще не прикрепленный файл доступен только загрузившему
+    response = await async_client.get(
+        f"/api/medias/{media_id}", headers={"api-key": "test"}
+    )
+    assert response.status_code == 200
+    assert response.content == b"draft image"
+    assert response.headers["content-type"] == "image/png"
+    response = await async_client.get(
+        f"/api/medias/{media_id}", headers={"api-key": "test2"}
+    )
+    assert response.status_code == 404
+
+    await async_client.post(
+        "/api/tweets",
+        json={"tweet_data": "With media", "tweet_media_ids": [media_id]},
+        headers={"api-key": "test"},
+    )
+    monkeypatch.setattr(media, "MEDIA_ACCEL_REDIRECT", True)
+    response = await async_client.get(
+        f"/api/medias/{media_id}", headers={"api-key": "test2"}
+    )
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"].startswith(
+        "/protected-media/images/"
+    )
+
+
+def test_precompress(tmp_path):
+    (tmp_path / "js").mkdir()
+    (tmp_path / "images").mkdir()
+    bundle = tmp_path / "js" / "app.1234abcd.js"
+    bundle.write_text("console.log('microblog');\n" * 100)
+    (tmp_path / "js" / "tiny.js").write_text("1")
+    (tmp_path / "images" / "upload.svg").write_text("<svg/>" * 100)
+
+    assert precompress(str(tmp_path)) >= 1
+    compressed = tmp_path / "js" / "app.1234abcd.js.gz"
+    assert gzip.decompress(compressed.read_bytes()) == bundle.read_bytes()
+    assert not (tmp_path / "js" / "tiny.js.gz").exists()
+    assert not (tmp_path / "images" / "upload.svg.gz").exists()
+    # актуальные копии не пересоздаются
+    assert precompress(str(tmp_path)) == 0
@@ -0,0 +1,61 @@
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.auth import hash_api_key
+from config_app.settings import ALEMBIC_CONFIG
+from db.database import Base, SchemaVersionError, check_schema_version
+from db.models import include_name
+
+
+def run_upgrade(connection, revision="head"):
+    config = Config(ALEMBIC_CONFIG)
+    config.attributes["connection"] = connection
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, revision)
+
+
+async def test_migrations_match_models(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(run_upgrade)
+        diff = await conn.run_sync(
+            lambda sync_conn: compare_metadata(
+                MigrationContext.configure(
+                    sync_conn, opts={"include_name": include_name}
+                ),
+                Base.metadata,
+            )
+        )
+    await check_schema_version(engine)
+    await engine.dispose()
+    assert diff == []
+
+
+async def test_check_schema_version_outdated(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(run_upgrade, "0001")
+    with pytest.raises(SchemaVersionError):
+        await check_schema_version(engine)
+    await engine.dispose()
+
+
+async def test_legacy_api_keys_migrated(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'm.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(run_upgrade, "0005")
+        await conn.execute(
+            text("INSERT INTO \"user\" (id, name) VALUES (1, 'a'), (2, 'b')")
+        )
+        await conn.run_sync(run_upgrade)
+        rows = await conn.execute(
+            text("SELECT key_hash, user_id FROM api_key ORDER BY user_id")
+        )
+        keys = rows.all()
+    await engine.dispose()
+    assert keys == [(hash_api_key("test"), 1), (hash_api_key("test2"), 2)]